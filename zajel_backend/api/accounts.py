@@ -0,0 +1,139 @@
+"""
+Background account deletion.
+
+``user.delete()`` makes Django's collector load the customer's orders,
+tokens and cart lines into memory and update or delete them while the
+request waits, which gets slow and lock-heavy for long order histories.
+Instead ``request_deletion`` deactivates the account, which already locks
+it out of every session and database token, revokes its signed tokens
+(api.tokens) and records an ``AccountDeletion`` that ``start`` hands to
+the background job queue (api.jobs).
+
+``delete_account`` then removes tokens, cart lines, idempotency records
+and sessions in bulk, detaches and anonymizes the customer's orders (hot
+and archived) in batches of set-based updates, and deletes the user row
+last, when nothing is left to cascade to. Every step can be repeated, so
+the queue retries a failed deletion and ``process_account_deletions``
+simply runs interrupted or failed ones again.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import jobs, tokens
+from .models import User, Order, ArchivedOrder, CartItem, IdempotencyKey, AccountDeletion, RefreshToken
+
+# Customer details cleared on the orders of a deleted account; the wilaya
+# stays for the sales rollups
+ANONYMIZED_ORDER_FIELDS = {
+    'user': None,
+    'full_name': '',
+    'email': '',
+    'phone_number': '',
+    'address': '',
+    'postal_code': '',
+}
+
+
+def request_deletion(user):
+    """Lock ``user`` out and record the deletion of their account; returns the job"""
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        job = AccountDeletion.objects.filter(account_id=user.pk, status__in=['pending', 'running']).first()
+        if job is None:
+            job = AccountDeletion.objects.create(account_id=user.pk)
+        tokens.revoke(user.pk)
+    return job
+
+
+def start(job):
+    """Queue the background job that carries out ``job``"""
+    jobs.enqueue('delete_account', {'job_id': str(job.pk)})
+
+
+def claimable_jobs():
+    """Jobs waiting to run: pending, failed, or running for longer than ``ACCOUNT_DELETION_STALE_AFTER``"""
+    stale = timezone.now() - timedelta(seconds=settings.ACCOUNT_DELETION_STALE_AFTER)
+    return AccountDeletion.objects.filter(
+        Q(status__in=['pending', 'failed']) | Q(status='running', started_at__lt=stale)
+    )
+
+
+def run_deletion(job_id, batch_size=None):
+    """
+    Claim and run one deletion; returns False when it was not claimable
+    (e.g. another worker has it). Errors are recorded on the deletion and
+    raised again so the job queue retries it.
+    """
+    claimed = claimable_jobs().filter(pk=job_id).update(status='running', started_at=timezone.now(), error='')
+    if not claimed:
+        return False
+
+    job = AccountDeletion.objects.get(pk=job_id)
+    try:
+        job.orders_anonymized = delete_account(job.account_id, batch_size or settings.ACCOUNT_DELETION_BATCH_SIZE)
+        job.status = 'completed'
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+        raise
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'orders_anonymized', 'error', 'finished_at'])
+    return True
+
+
+def delete_account(user_id, batch_size):
+    """Delete everything tied to ``user_id``, then the user; returns the number of orders anonymized"""
+    Token.objects.filter(user_id=user_id).delete()
+    RefreshToken.objects.filter(user_id=user_id).delete()
+    CartItem.objects.filter(user_id=user_id).delete()
+    IdempotencyKey.objects.filter(scope__endswith=f' user:{user_id}').delete()
+    delete_sessions(user_id, batch_size)
+    anonymized = sum(anonymize_orders(model, user_id, batch_size) for model in (Order, ArchivedOrder))
+    User.objects.filter(pk=user_id).delete()
+    return anonymized
+
+
+def anonymize_orders(model, user_id, batch_size):
+    """Detach and anonymize the orders of ``user_id``, one bounded UPDATE per batch"""
+    anonymized = 0
+    while True:
+        ids = list(model.objects.filter(user_id=user_id).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return anonymized
+        anonymized += model.objects.filter(id__in=ids).update(**ANONYMIZED_ORDER_FIELDS)
+
+
+def delete_sessions(user_id, batch_size):
+    """
+    Delete the database sessions logged in as ``user_id``. Sessions do not
+    index their user, so live sessions are scanned in key order a batch at
+    a time; with other session engines there is nothing to remove (the
+    account is already inactive, so its sessions no longer authenticate).
+    """
+    if settings.SESSION_ENGINE != 'django.contrib.sessions.backends.db':
+        return 0
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.contrib.sessions.models import Session
+
+    store = SessionStore()
+    now = timezone.now()
+    user_key = str(user_id)
+    deleted, last_key = 0, ''
+    while True:
+        batch = list(
+            Session.objects.filter(session_key__gt=last_key, expire_date__gt=now)
+            .order_by('session_key').values_list('session_key', 'session_data')[:batch_size]
+        )
+        if not batch:
+            return deleted
+        last_key = batch[-1][0]
+        keys = [key for key, data in batch if store.decode(data).get(SESSION_KEY) == user_key]
+        if keys:
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
@@ -1,7 +1,13 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import User, Author, Book, Order, OrderItem, WILAYA_CHOICES, ORDER_STATUS_CHOICES
+from .models import User, Author, Book, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, AccountDeletion, Job, StockChange, WILAYA_CHOICES, ORDER_STATUS_CHOICES
+from .orders import ORDER_STATUS_TRANSITIONS, OrderTransitionError, transition_orders
+from .stock import adjust_stock
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -32,9 +38,13 @@ class AuthorAdmin(admin.ModelAdmin):
     search_fields = ['name']
     ordering = ['name']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(book_count=Count('books'))
+    
     def book_count(self, obj):
-        return obj.books.count()
+        return obj.book_count
     book_count.short_description = 'Number of Books'
+    book_count.admin_order_field = 'book_count'
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
@@ -43,7 +53,7 @@ class BookAdmin(admin.ModelAdmin):
     list_filter = ['available', 'publishing_date', 'author', 'publisher']
     search_fields = ['name', 'author__name', 'publisher']
     ordering = ['-created_at']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'cover_preview']
     
     fieldsets = (
         ('Basic Information', {
@@ -66,6 +76,27 @@ class BookAdmin(admin.ModelAdmin):
             return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', obj.cover_image.url)
         return "No cover"
     cover_preview.short_description = 'Cover Preview'
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            if obj.stock:
+                StockChange.objects.create(
+                    book=obj, delta=obj.stock, stock_after=obj.stock, available=obj.available, reason='adjustment'
+                )
+            return
+        if 'stock' not in form.changed_data:
+            super().save_model(request, obj, form, change)
+            return
+        # The entered stock is applied as a delta from the current row
+        # (checkouts may have moved it since the form loaded), through
+        # adjust_stock so availability follows and the change is logged
+        with transaction.atomic():
+            current = Book.objects.select_for_update().values_list('stock', flat=True).get(pk=obj.pk)
+            target, obj.stock = obj.stock, current
+            super().save_model(request, obj, form, change)
+            adjust_stock({obj.pk: target - current}, reason='adjustment')
+        obj.refresh_from_db(fields=['stock', 'available', 'updated_at'])
 
 class OrderItemInline(admin.TabularInline):
     """Inline admin for OrderItem"""
@@ -74,15 +105,31 @@ class OrderItemInline(admin.TabularInline):
     readonly_fields = ['subtotal']
     fields = ['book', 'quantity', 'unit_price', 'subtotal']
 
+class OrderAdminForm(forms.ModelForm):
+    """Order form that only allows valid status transitions"""
+    class Meta:
+        model = Order
+        fields = '__all__'
+    
+    def clean_status(self):
+        new_status = self.cleaned_data['status']
+        old_status = self.initial.get('status')
+        if self.instance.pk and new_status != old_status:
+            if old_status not in ORDER_STATUS_TRANSITIONS.get(new_status, []):
+                raise forms.ValidationError(f'Cannot move a {old_status} order to {new_status}')
+        return new_status
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     """Admin for Order model"""
+    form = OrderAdminForm
     list_display = ['id', 'full_name', 'email', 'wilaya', 'status', 'total_price', 'created_at']
     list_filter = ['status', 'wilaya', 'created_at']
     search_fields = ['id', 'full_name', 'email', 'phone_number']
     ordering = ['-created_at']
     readonly_fields = ['id', 'total_price', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
+    actions = ['mark_processing', 'mark_completed', 'mark_canceled']
     
     fieldsets = (
         ('Order Information', {
@@ -105,18 +152,132 @@ class OrderAdmin(admin.ModelAdmin):
     
     def get_readonly_fields(self, request, obj=None):
         if obj:  # Editing an existing object
-            return self.readonly_fields + ('user', 'total_price')
+            return self.readonly_fields + ['user', 'total_price']
         return self.readonly_fields
+    
+    def save_model(self, request, obj, form, change):
+        if change and 'status' in form.changed_data:
+            # Save the other fields first, then apply the status change
+            # through the same path as the bulk actions
+            new_status = obj.status
+            obj.status = form.initial['status']
+            super().save_model(request, obj, form, change)
+            transition_orders([obj.pk], new_status)
+            obj.status = new_status
+        else:
+            super().save_model(request, obj, form, change)
+    
+    def _transition(self, request, queryset, new_status):
+        order_ids = list(queryset.values_list('id', flat=True))
+        try:
+            updated = transition_orders(order_ids, new_status, strict=False)
+        except OrderTransitionError as e:
+            self.message_user(request, str(e), messages.ERROR)
+            return
+        skipped = len(order_ids) - len(updated)
+        self.message_user(request, f'{len(updated)} orders moved to {new_status}.', messages.SUCCESS)
+        if skipped:
+            self.message_user(
+                request,
+                f'{skipped} orders skipped: only {", ".join(ORDER_STATUS_TRANSITIONS[new_status])} orders can be moved to {new_status}.',
+                messages.WARNING
+            )
+    
+    @admin.action(description='Mark selected orders as processing')
+    def mark_processing(self, request, queryset):
+        self._transition(request, queryset, 'processing')
+    
+    @admin.action(description='Mark selected orders as completed')
+    def mark_completed(self, request, queryset):
+        self._transition(request, queryset, 'completed')
+    
+    @admin.action(description='Mark selected orders as canceled (restores stock)')
+    def mark_canceled(self, request, queryset):
+        self._transition(request, queryset, 'canceled')
+
+@admin.register(StockChange)
+class StockChangeAdmin(admin.ModelAdmin):
+    """Read-only admin for the stock change log"""
+    list_display = ['created_at', 'book', 'delta', 'stock_after', 'available', 'reason']
+    list_filter = ['reason', 'created_at']
+    search_fields = ['book__name']
+    ordering = ['-id']
+    list_select_related = ['book__author']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     """Admin for OrderItem model"""
-    list_display = ['order', 'book', 'quantity', 'unit_price', 'subtotal']
+    list_display = ['order', 'book_name', 'author_name', 'quantity', 'unit_price', 'subtotal']
     list_filter = ['order__status']
-    search_fields = ['order__id', 'book__name']
+    search_fields = ['order__id', 'book_name']
     ordering = ['-order__created_at']
     readonly_fields = ['subtotal']
 
+class ArchivedOrderItemInline(admin.TabularInline):
+    """Read-only inline for ArchivedOrderItem"""
+    model = ArchivedOrderItem
+    extra = 0
+    fields = ['book_name', 'author_name', 'quantity', 'unit_price', 'subtotal']
+    readonly_fields = fields
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    """Read-only admin for orders moved out by archive_orders"""
+    list_display = ['id', 'full_name', 'email', 'wilaya', 'status', 'total_price', 'created_at', 'archived_at']
+    list_filter = ['status', 'wilaya']
+    search_fields = ['id', 'full_name', 'email', 'phone_number']
+    ordering = ['-created_at']
+    date_hierarchy = 'created_at'
+    inlines = [ArchivedOrderItemInline]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(AccountDeletion)
+class AccountDeletionAdmin(admin.ModelAdmin):
+    """Read-only admin for account deletion jobs"""
+    list_display = ['id', 'account_id', 'status', 'orders_anonymized', 'requested_at', 'finished_at']
+    list_filter = ['status']
+    search_fields = ['account_id']
+    ordering = ['-requested_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Admin for the background job queue"""
+    list_display = ['id', 'task', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'finished_at']
+    list_filter = ['status', 'task']
+    ordering = ['-id']
+    readonly_fields = [field.name for field in Job._meta.fields]
+    actions = ['retry']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.action(description='Run selected failed jobs again')
+    def retry(self, request, queryset):
+        retried = queryset.filter(status='failed').update(
+            status='queued', run_after=timezone.now(), attempts=0, finished_at=None
+        )
+        self.message_user(request, f'{retried} jobs queued again.', messages.SUCCESS)
+
 # Customize admin site
 admin.site.site_header = "Zajil Books Admin"
 admin.site.site_title = "Zajil Books Admin Portal"
@@ -0,0 +1,193 @@
+"""
+Incremental sales rollups.
+
+Orders are folded into ``DailySalesRollup`` rows once, in batches, by the
+``rollup_sales`` command. The ``sales_rollup`` watermark records the
+``created_at`` of the newest order already folded in. Every non-canceled
+order at or before the watermark is counted exactly once, so canceling
+such an order subtracts its contribution again.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum, Window
+from django.db.models.functions import RowNumber, TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem, DailySalesRollup, Watermark, WILAYA_CHOICES
+
+WATERMARK_NAME = 'sales_rollup'
+
+MAX_DAYS = 366  # longest date range ``sales_stats`` serves
+
+# (dimension, group-by field, label field) read from OrderItem
+DIMENSIONS = [
+    ('wilaya', 'order__wilaya', None),
+    ('category', 'book__category', None),
+    ('book', 'book_id', 'book__name'),
+]
+
+WILAYA_LABELS = dict(WILAYA_CHOICES)
+
+
+def _lock_watermark():
+    """Fetch the rollup watermark row, locking it for the current transaction"""
+    watermark, created = Watermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+    return watermark
+
+
+def _contributions(*item_sets):
+    """
+    Aggregate OrderItem (or ArchivedOrderItem) querysets into
+    {(dimension, date, key): (label, orders, items, revenue)}
+    """
+    contributions = {}
+    for items in item_sets:
+        items = items.annotate(day=TruncDate('order__created_at'))
+        for dimension, field, label_field in DIMENSIONS:
+            values = ['day', field] + ([label_field] if label_field else [])
+            rows = items.values(*values).annotate(
+                orders=Count('order_id', distinct=True),
+                quantity=Sum('quantity'),
+                revenue=Sum('subtotal'),
+            ).order_by()
+            for row in rows:
+                key = str(row[field])
+                if dimension == 'wilaya':
+                    label = WILAYA_LABELS.get(key, key)
+                elif label_field:
+                    label = row[label_field]
+                else:
+                    label = key
+                entry = (dimension, row['day'], key)
+                if entry in contributions:
+                    _, orders, quantity, revenue = contributions[entry]
+                    contributions[entry] = (label, orders + row['orders'], quantity + row['quantity'], revenue + row['revenue'])
+                else:
+                    contributions[entry] = (label, row['orders'], row['quantity'], row['revenue'])
+    return contributions
+
+
+def _apply(contributions, sign=1):
+    """Merge contributions into the rollup table with a single upsert"""
+    if not contributions:
+        return 0
+
+    days = {day for _, day, _ in contributions}
+    existing = {
+        (row.dimension, row.date, row.key): row
+        for row in DailySalesRollup.objects.filter(date__in=days)
+    }
+
+    rows = []
+    for (dimension, day, key), (label, orders, quantity, revenue) in contributions.items():
+        row = existing.get((dimension, day, key)) or DailySalesRollup(
+            dimension=dimension, date=day, key=key, revenue=Decimal('0.00')
+        )
+        row.label = label
+        row.orders_count += sign * orders
+        row.items_sold += sign * quantity
+        row.revenue += sign * revenue
+        rows.append(row)
+
+    DailySalesRollup.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['dimension', 'date', 'key'],
+        update_fields=['label', 'orders_count', 'items_sold', 'revenue'],
+    )
+    return len(rows)
+
+
+def rollup_new_orders(lag=timedelta(minutes=1)):
+    """
+    Fold orders created since the watermark into the rollups.
+
+    Orders younger than ``lag`` are left for the next run so that
+    transactions still in flight cannot slip behind the watermark.
+    Returns a ``(orders, rows)`` tuple of processed orders and touched rows.
+    """
+    with transaction.atomic():
+        watermark = _lock_watermark()
+        until = timezone.now() - lag
+        if watermark.value and watermark.value >= until:
+            return 0, 0
+
+        # Archived orders are normally behind the watermark already, but
+        # count after a rebuild
+        orders = Order.objects.filter(created_at__lte=until).exclude(status='canceled')
+        archived = ArchivedOrder.objects.filter(created_at__lte=until).exclude(status='canceled')
+        if watermark.value:
+            orders = orders.filter(created_at__gt=watermark.value)
+            archived = archived.filter(created_at__gt=watermark.value)
+
+        order_count = orders.count() + archived.count()
+        rows = _apply(_contributions(
+            OrderItem.objects.filter(order__in=orders),
+            ArchivedOrderItem.objects.filter(order__in=archived),
+        ))
+
+        watermark.value = until
+        watermark.save(update_fields=['value', 'updated_at'])
+    return order_count, rows
+
+
+def remove_canceled_orders(order_ids):
+    """
+    Subtract orders that were just canceled from the rollups.
+
+    Must be called in the same transaction as the status change. Orders
+    newer than the watermark are skipped, the next batch run excludes them.
+    """
+    with transaction.atomic():
+        watermark = _lock_watermark()
+        if not watermark.value:
+            return 0
+        items = OrderItem.objects.filter(order_id__in=order_ids, order__created_at__lte=watermark.value)
+        return _apply(_contributions(items), sign=-1)
+
+
+def rebuild():
+    """Drop all rollups and reset the watermark"""
+    with transaction.atomic():
+        watermark = _lock_watermark()
+        DailySalesRollup.objects.all().delete()
+        watermark.value = None
+        watermark.save(update_fields=['value', 'updated_at'])
+
+
+def sales_stats(dimension, start, end, limit=20, daily=False):
+    """Read aggregated sales for a date range from the rollup table (top ``limit`` per day when ``daily``)"""
+    rows = DailySalesRollup.objects.filter(date__gte=start, date__lte=end)
+
+    # Every order has exactly one wilaya, so its rows give the overall totals
+    totals = rows.filter(dimension='wilaya').aggregate(
+        orders=Sum('orders_count'), items=Sum('items_sold'), revenue=Sum('revenue')
+    )
+
+    results = rows.filter(dimension=dimension)
+    if daily:
+        # One row per (date, key) already; keep the top ``limit`` of each day
+        results = results.annotate(
+            rank=Window(RowNumber(), partition_by='date', order_by=F('revenue').desc()),
+            orders=F('orders_count'), items=F('items_sold'),
+        ).filter(rank__lte=limit).values('date', 'key', 'label', 'orders', 'items', 'revenue').order_by('-date', '-revenue')
+    else:
+        results = results.values('key').annotate(
+            label=Max('label'), orders=Sum('orders_count'), items=Sum('items_sold'), revenue=Sum('revenue')
+        ).order_by('-revenue')[:limit]
+
+    watermark = Watermark.objects.filter(name=WATERMARK_NAME).values_list('value', flat=True).first()
+    return {
+        'dimension': dimension,
+        'start': start,
+        'end': end,
+        'updated_until': watermark,
+        'totals': {
+            'orders': totals['orders'] or 0,
+            'items': totals['items'] or 0,
+            'revenue': totals['revenue'] or Decimal('0.00'),
+        },
+        'results': list(results),
+    }
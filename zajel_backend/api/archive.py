@@ -0,0 +1,127 @@
+"""
+Archival of finished orders.
+
+Completed and canceled orders older than ``ORDER_ARCHIVE_AFTER_DAYS`` are
+moved to ``ArchivedOrder``/``ArchivedOrderItem`` in batches: each batch is
+copied and then deleted from the hot tables in one transaction, so an
+order is always in exactly one place. ``Order`` and ``OrderItem`` (and
+their indexes) then only hold recent and in-flight orders, which is what
+checkout, the admin and the batch jobs work on.
+
+Customers still see their whole history: ``order_history`` and
+``get_order`` read both places, and ``history_version`` and
+``order_version`` tell cheaply whether any of it changed. The sales rollups and the co-purchase
+index read the archive too, and orders are only archived once those
+incremental jobs have processed them (see ``archive_cutoff``).
+"""
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Value
+from django.utils import timezone
+
+from . import analytics, recommendations
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem, Watermark
+
+ARCHIVABLE_STATUSES = ['completed', 'canceled']
+
+# Columns copied as they are, ids included so archived orders render
+# exactly as before; ArchivedOrder adds archived_at
+ORDER_FIELDS = [field.attname for field in Order._meta.concrete_fields]
+ITEM_FIELDS = [field.attname for field in OrderItem._meta.concrete_fields]
+
+# Incremental jobs reading orders by created_at
+JOB_WATERMARKS = [analytics.WATERMARK_NAME, recommendations.WATERMARK_NAME]
+
+
+def archive_cutoff(days=None):
+    """
+    Orders created before the returned time may be archived: older than
+    ``days`` and already folded in by every incremental job that has run.
+    """
+    days = settings.ORDER_ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    processed = Watermark.objects.filter(name__in=JOB_WATERMARKS, value__isnull=False).values_list('value', flat=True)
+    return min([cutoff, *processed])
+
+
+def archivable_orders(cutoff):
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=cutoff)
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to ``batch_size`` of the oldest archivable orders; returns the number moved"""
+    with transaction.atomic():
+        ids = list(
+            archivable_orders(cutoff).select_for_update(skip_locked=True)
+            .order_by('created_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+
+        orders = Order.objects.filter(id__in=ids).values(*ORDER_FIELDS)
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+        items = OrderItem.objects.filter(order_id__in=ids).values(*ITEM_FIELDS)
+        ArchivedOrderItem.objects.bulk_create([ArchivedOrderItem(**item) for item in items], batch_size=1000)
+
+        OrderItem.objects.filter(order_id__in=ids).delete()
+        Order.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(days=None, batch_size=None, limit=None):
+    """Archive batches until nothing is left (or ``limit`` orders moved); returns the number moved"""
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    cutoff = archive_cutoff(days)
+    moved = 0
+    while limit is None or moved < limit:
+        count = archive_batch(cutoff, batch_size if limit is None else min(batch_size, limit - moved))
+        if not count:
+            break
+        moved += count
+    return moved
+
+
+def order_history(user):
+    """All orders of ``user``, hot and archived, newest first"""
+    hot = Order.objects.with_details().filter(user_id=user.pk)
+    archived = ArchivedOrder.objects.with_details().filter(user_id=user.pk)
+    return list(heapq.merge(hot, archived, key=lambda order: order.created_at, reverse=True))
+
+
+def get_order(order_id, user):
+    """A hot or archived order of ``user``; raises ``Order.DoesNotExist``"""
+    try:
+        return Order.objects.with_details().get(id=order_id, user_id=user.pk)
+    except Order.DoesNotExist:
+        try:
+            return ArchivedOrder.objects.with_details().get(id=order_id, user_id=user.pk)
+        except ArchivedOrder.DoesNotExist:
+            raise Order.DoesNotExist(f'Order {order_id} not found')
+
+
+def order_version(order_id, user):
+    """``updated_at`` of the hot or archived order ``order_id`` of ``user``, or ``None`` if there is none"""
+    def version(model):
+        return model.objects.filter(id=order_id, user_id=user.pk).order_by().values_list('updated_at', flat=True)
+
+    return next(iter(version(Order).union(version(ArchivedOrder), all=True)), None)
+
+
+def history_version(user):
+    """
+    ``[(part, count, latest updated_at)]`` of the hot and the archived
+    orders of ``user``, in one statement answered from the (user,
+    updated_at) indexes. It changes whenever an order of the user is
+    placed, updated or archived, so it makes their order list's ETag.
+    """
+    def orders(model, part):
+        return (
+            model.objects.filter(user_id=user.pk).order_by().values('user_id')
+            .annotate(part=Value(part), count=Count('*'), latest=Max('updated_at'))
+            .values_list('part', 'count', 'latest')
+        )
+
+    return sorted(orders(Order, 'orders').union(orders(ArchivedOrder, 'archived orders'), all=True))
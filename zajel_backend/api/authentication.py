@@ -0,0 +1,92 @@
+"""
+API authentication.
+
+``AccessTokenAuthentication`` accepts the signed access tokens of
+``api.tokens`` (``Authorization: Bearer <token>``, or the older ``Token``
+keyword) without a database query: the request user is a ``TokenUser``
+that knows its id and only loads the user row when a view needs more.
+
+DRF's own database tokens are no longer issued. The ones already out
+keep working through ``ExpiringTokenAuthentication`` until
+``AUTH_TOKEN_TTL`` after they were issued, and ``sweep_expired tokens``
+then deletes them in batches by the indexed ``created`` column. Once that
+much time has passed since they stopped being issued, none can be valid
+and ``ExpiringTokenAuthentication`` is to be removed (see settings).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import User
+from .tokens import verify_access_token
+
+
+def token_cutoff(now=None):
+    """Database tokens created before this are expired"""
+    return (now or timezone.now()) - timedelta(seconds=settings.AUTH_TOKEN_TTL)
+
+
+def expired_tokens(now=None):
+    return Token.objects.filter(created__lt=token_cutoff(now))
+
+
+def _load_user(user_id):
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if user is None:
+        raise AuthenticationFailed('User inactive or deleted.')
+    return user
+
+
+class TokenUser(SimpleLazyObject):
+    """
+    The user of a verified access token. Its id and the authentication
+    checks of permissions, throttles and idempotency keys come from the
+    token; any other attribute loads the user (one query, on first use).
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        super().__init__(lambda: _load_user(user_id))
+        self.__dict__['pk'] = self.__dict__['id'] = user_id
+
+    def __bool__(self):
+        return True
+
+
+class AccessTokenAuthentication(BaseAuthentication):
+    """Signed access tokens, verified by their HMAC and the revocation denylist"""
+    keywords = (b'bearer', b'token')
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2 or auth[0].lower() not in self.keywords:
+            return None
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            return None
+        if token.count('.') != 3:
+            return None  # a database token, for ExpiringTokenAuthentication
+        user_id = verify_access_token(token)
+        if user_id is None:
+            raise AuthenticationFailed('Invalid or expired token.')
+        return TokenUser(user_id), token
+
+    def authenticate_header(self, request):
+        return 'Bearer'
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """``Authorization: Token <key>`` for database tokens issued less than ``AUTH_TOKEN_TTL`` ago"""
+
+    def authenticate_credentials(self, key):
+        user, token = super().authenticate_credentials(key)
+        if token.created < token_cutoff():
+            raise AuthenticationFailed('Token has expired.')
+        return user, token
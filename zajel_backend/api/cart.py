@@ -0,0 +1,238 @@
+"""
+Shopping carts.
+
+Anonymous visitors keep their cart in the session. Authenticated users
+get a persistent ``CartItem`` cart shared across devices; a session cart
+is merged into it when the visitor logs in. Both carts expose the same
+interface so views do not care which one they hold.
+"""
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .catalog import get_snapshot, in_stock_books
+from .models import Book, CartItem
+
+SESSION_KEY = 'cart'
+
+
+def _line(book, quantity):
+    subtotal = book.price * quantity
+    return {
+        'book_id': book.id,
+        'quantity': quantity,
+        'book_name': book.name,
+        'book_price': book.price,
+        'book_cover': book.cover_image.url if book.cover_image else None,
+        'subtotal': subtotal,
+        'available_stock': book.stock
+    }
+
+
+class BaseCart(ABC):
+    @abstractmethod
+    def update(self, quantities):
+        """Apply ``{book_id: quantity}``; a quantity of zero removes the line"""
+
+    @abstractmethod
+    def lines(self):
+        """
+        ``(book, quantity)`` pairs that can be bought: lines of unavailable
+        books are dropped from the cart, quantities above stock lowered to it
+        """
+
+    def summary(self):
+        """Hydrated cart contents as returned by the cart endpoints"""
+        items = [_line(book, quantity) for book, quantity in self.lines()]
+        return {
+            'items': items,
+            'total_items': sum(item['quantity'] for item in items),
+            'total_price': sum((item['subtotal'] for item in items), Decimal('0.00'))
+        }
+
+
+class SessionCart(BaseCart):
+    """Cart of an anonymous visitor, stored in the session"""
+
+    def __init__(self, request):
+        self.session = request.session
+
+    def _save(self, cart):
+        self.session[SESSION_KEY] = cart
+        self.session.modified = True
+
+    def quantities(self):
+        return {int(book_id): quantity for book_id, quantity in self.session.get(SESSION_KEY, {}).items()}
+
+    def quantity(self, book_id):
+        return self.session.get(SESSION_KEY, {}).get(str(book_id), 0)
+
+    def lines(self):
+        cart = self.session.get(SESSION_KEY, {})
+        books = in_stock_books([int(book_id) for book_id in cart])
+        lines = []
+        for book_id, quantity in list(cart.items()):
+            book = books.get(int(book_id))
+            if book is None:
+                # Remove item if the book is gone or out of stock
+                del cart[book_id]
+                continue
+            if book.stock < quantity:
+                quantity = cart[book_id] = book.stock
+            lines.append((book, quantity))
+        self._save(cart)
+        return lines
+
+    def add(self, book_id, quantity):
+        cart = self.session.get(SESSION_KEY, {})
+        cart[str(book_id)] = cart.get(str(book_id), 0) + quantity
+        self._save(cart)
+
+    def set(self, book_id, quantity):
+        cart = self.session.get(SESSION_KEY, {})
+        if quantity <= 0:
+            cart.pop(str(book_id), None)
+        else:
+            cart[str(book_id)] = quantity
+        self._save(cart)
+
+    def remove(self, book_id):
+        self.set(book_id, 0)
+
+    def update(self, quantities):
+        cart = self.session.get(SESSION_KEY, {})
+        for book_id, quantity in quantities.items():
+            if quantity <= 0:
+                cart.pop(str(book_id), None)
+            else:
+                cart[str(book_id)] = quantity
+        self._save(cart)
+
+    def clear(self):
+        self._save({})
+
+
+class DatabaseCart(BaseCart):
+    """Persistent cart of an authenticated user"""
+
+    def __init__(self, user):
+        self.user = user
+
+    def _upsert(self, quantities, increment):
+        """
+        Insert or update many lines in one statement.
+
+        ``increment`` adds to existing quantities instead of replacing them.
+        Quantities are capped at the book's stock, so merging two carts
+        never leaves a line that cannot be bought.
+        """
+        if not quantities:
+            return
+        qn = connection.ops.quote_name
+        table = qn(CartItem._meta.db_table)
+        quantity = qn('quantity')
+        least = 'MIN' if connection.vendor == 'sqlite' else 'LEAST'
+
+        def capped(value, book_id):
+            stock = f'(SELECT {qn("stock")} FROM {qn(Book._meta.db_table)} WHERE {qn("id")} = {book_id})'
+            return f'{least}({value}, COALESCE({stock}, {value}))'
+
+        new_quantity = f'{table}.{quantity} + excluded.{quantity}' if increment else f'excluded.{quantity}'
+        conflicting_book = f'excluded.{qn("book_id")}'
+        now = CartItem._meta.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+
+        rows = ', '.join([f'(%s, %s, {capped("%s", "%s")}, %s)'] * len(quantities))
+        params = []
+        for book_id, book_quantity in quantities.items():
+            params += [self.user.pk, book_id, book_quantity, book_id, book_quantity, now]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({qn("user_id")}, {qn("book_id")}, {quantity}, {qn("updated_at")}) '
+                f'VALUES {rows} '
+                f'ON CONFLICT ({qn("user_id")}, {qn("book_id")}) '
+                f'DO UPDATE SET {quantity} = {capped(new_quantity, conflicting_book)}, '
+                f'{qn("updated_at")} = excluded.{qn("updated_at")}',
+                params
+            )
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(user_id=self.user.pk).values_list('book_id', 'quantity'))
+
+    def quantity(self, book_id):
+        return CartItem.objects.filter(user_id=self.user.pk, book_id=book_id).values_list('quantity', flat=True).first() or 0
+
+    def lines(self):
+        items = CartItem.objects.filter(user_id=self.user.pk).order_by('id')
+        snapshot = get_snapshot()
+        if snapshot is None:
+            rows = [(item.id, item.book, item.quantity) for item in items.select_related('book')]
+        else:
+            rows = [
+                (item_id, snapshot.books.get(book_id), quantity)
+                for item_id, book_id, quantity in items.values_list('id', 'book_id', 'quantity')
+            ]
+
+        lines = []
+        dropped = []
+        capped = {}
+        for item_id, book, quantity in rows:
+            if book is None or not book.available:
+                dropped.append(item_id)
+                continue
+            if book.stock < quantity:
+                # Keep what can still be bought
+                quantity = capped[book.id] = book.stock
+            lines.append((book, quantity))
+        if dropped:
+            CartItem.objects.filter(id__in=dropped).delete()
+        self._upsert(capped, increment=False)
+        return lines
+
+    def add(self, book_id, quantity):
+        self._upsert({int(book_id): quantity}, increment=True)
+
+    def set(self, book_id, quantity):
+        if quantity <= 0:
+            self.remove(book_id)
+        else:
+            self._upsert({int(book_id): quantity}, increment=False)
+
+    def remove(self, book_id):
+        CartItem.objects.filter(user_id=self.user.pk, book_id=book_id).delete()
+
+    def update(self, quantities):
+        """Set many quantities at once, removing lines set to zero"""
+        removed = [book_id for book_id, quantity in quantities.items() if quantity <= 0]
+        with transaction.atomic():
+            self._upsert({book_id: quantity for book_id, quantity in quantities.items() if quantity > 0}, increment=False)
+            if removed:
+                CartItem.objects.filter(user_id=self.user.pk, book_id__in=removed).delete()
+
+    def clear(self):
+        CartItem.objects.filter(user_id=self.user.pk).delete()
+
+    def merge(self, quantities):
+        """Add another cart's quantities to this one in a single statement"""
+        # A session cart can outlive its books, or their stock
+        quantities = {int(book_id): quantity for book_id, quantity in quantities.items() if quantity > 0}
+        buyable = Book.objects.in_stock().filter(id__in=quantities).values_list('id', flat=True)
+        self._upsert({book_id: quantities[book_id] for book_id in buyable}, increment=True)
+
+
+def merge_session_cart(request, user):
+    """Move the session cart of a visitor who just logged in into their persistent cart"""
+    session_cart = request.session.pop(SESSION_KEY, None)
+    if session_cart:
+        DatabaseCart(user).merge(session_cart)
+
+
+def get_cart(request):
+    """The cart of the current visitor"""
+    if request.user.is_authenticated:
+        # Carts left in the session before logging in are merged lazily
+        merge_session_cart(request, request.user)
+        return DatabaseCart(request.user)
+    return SessionCart(request)
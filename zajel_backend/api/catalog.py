@@ -0,0 +1,188 @@
+"""
+Per-process snapshot of the hot catalog.
+
+Book lists, search and cart hydration only need a handful of fields per
+book, and the whole catalog fits comfortably in memory. With
+``CATALOG_SNAPSHOT_ENABLED`` each process keeps those fields in
+``__slots__`` records and reads them instead of querying the database.
+
+The snapshot is read-through: once it is older than
+``CATALOG_SNAPSHOT_MAX_AGE`` seconds the next reader refreshes it with the
+books and authors whose ``updated_at`` moved past the watermark (stock
+changes bump ``updated_at`` too), so staleness is bounded by that age.
+Checkout and stock adjustments always read the database.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+from .models import Author, Book
+
+BOOK_FIELDS = ['id', 'name', 'cover_image', 'author_id', 'publisher', 'price', 'category', 'available', 'stock', 'created_at', 'updated_at']
+
+
+class AuthorRecord:
+    """The fields of an author shown next to listed books"""
+    __slots__ = ('id', 'name', 'biography', 'name_lower')
+
+    def __init__(self, id, name, biography):
+        self.id = id
+        self.update(name, biography)
+
+    def update(self, name, biography):
+        self.name = name
+        self.biography = biography
+        self.name_lower = name.lower()
+
+
+class BookRecord:
+    """The fields of a book used by list serializers, search and carts"""
+    __slots__ = (
+        'id', 'name', 'cover_image', 'author', 'publisher', 'price',
+        'category', 'available', 'stock', 'created_at', 'name_lower'
+    )
+
+    def __init__(self, row, author):
+        self.id = row['id']
+        self.name = row['name']
+        # Behaves like the model field value, so serializers render the URL
+        field = Book._meta.get_field('cover_image')
+        self.cover_image = field.attr_class(None, field, row['cover_image'] or None)
+        self.author = author
+        self.publisher = row['publisher']
+        self.price = row['price']
+        self.category = row['category']
+        self.available = row['available']
+        self.stock = row['stock']
+        self.created_at = row['created_at']
+        self.name_lower = row['name'].lower()
+
+    @property
+    def in_stock(self):
+        return self.available and self.stock > 0
+
+
+class CatalogSnapshot:
+    """Books and authors keyed by id, with in-stock books in catalog order"""
+
+    def __init__(self):
+        self.books = {}
+        self.authors = {}
+        self.ordered = []  # every book, newest first like Book.Meta.ordering
+        self.book_watermark = None
+        self.author_watermark = None
+        self.refreshed_at = None
+
+    def refresh(self):
+        """
+        Apply rows changed since the last refresh.
+
+        Rows updated shortly before the watermark are read again, so a
+        transaction that committed late is not missed. Readers keep using the
+        previous dicts until the new ones are swapped in.
+        """
+        overlap = timedelta(seconds=settings.CATALOG_SNAPSHOT_OVERLAP)
+        started = time.monotonic()
+
+        authors = Author.objects.all()
+        if self.author_watermark:
+            authors = authors.filter(updated_at__gte=self.author_watermark - overlap)
+        new_authors = dict(self.authors)
+        for row in authors.values('id', 'name', 'biography', 'updated_at'):
+            record = new_authors.get(row['id'])
+            if record is None:
+                new_authors[row['id']] = AuthorRecord(row['id'], row['name'], row['biography'])
+            else:
+                # Books hold the record, so renames reach them in place
+                record.update(row['name'], row['biography'])
+            self.author_watermark = max(filter(None, [self.author_watermark, row['updated_at']]))
+
+        books = Book.objects.all()
+        if self.book_watermark:
+            books = books.filter(updated_at__gte=self.book_watermark - overlap)
+        new_books = dict(self.books)
+        rows = list(books.values(*BOOK_FIELDS))
+        # An author committed after the author query above can already have books
+        missing = {row['author_id'] for row in rows} - set(new_authors)
+        if missing:
+            for row in Author.objects.filter(id__in=missing).values('id', 'name', 'biography'):
+                new_authors[row['id']] = AuthorRecord(row['id'], row['name'], row['biography'])
+        for row in rows:
+            new_books[row['id']] = BookRecord(row, new_authors[row['author_id']])
+            self.book_watermark = max(filter(None, [self.book_watermark, row['updated_at']]))
+
+        # Deleted rows leave no updated_at behind; a count mismatch gives them away
+        deleted = Book.objects.count() != len(new_books)
+        if deleted:
+            existing = set(Book.objects.values_list('id', flat=True))
+            new_books = {book_id: record for book_id, record in new_books.items() if book_id in existing}
+
+        if rows or deleted:
+            self.ordered = sorted(new_books.values(), key=lambda record: (record.created_at, record.id), reverse=True)
+            self.books = new_books
+        self.authors = new_authors
+        self.refreshed_at = started
+
+    def in_stock(self):
+        return [record for record in self.ordered if record.in_stock]
+
+    def in_stock_books(self, book_ids):
+        """``{id: record}`` for the given ids that can be sold"""
+        result = {}
+        for book_id in book_ids:
+            record = self.books.get(int(book_id))
+            if record is not None and record.in_stock:
+                result[record.id] = record
+        return result
+
+    def search(self, query, limit):
+        """In-stock books whose name or author name contains ``query``, like ``icontains``"""
+        key = query.lower()
+        results = []
+        for record in self.ordered:
+            if record.in_stock and (key in record.name_lower or key in record.author.name_lower):
+                results.append(record)
+                if len(results) >= limit:
+                    break
+        return results
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    The process-wide snapshot, refreshed when older than
+    ``CATALOG_SNAPSHOT_MAX_AGE``, or ``None`` when snapshots are disabled.
+    """
+    global _snapshot
+    if not settings.CATALOG_SNAPSHOT_ENABLED:
+        return None
+
+    if _snapshot is None:
+        with _lock:
+            if _snapshot is None:
+                snapshot = CatalogSnapshot()
+                snapshot.refresh()
+                _snapshot = snapshot
+        return _snapshot
+
+    if time.monotonic() - _snapshot.refreshed_at >= settings.CATALOG_SNAPSHOT_MAX_AGE:
+        # One reader refreshes; the others carry on with the current data
+        if _lock.acquire(blocking=False):
+            try:
+                _snapshot.refresh()
+            finally:
+                _lock.release()
+    return _snapshot
+
+
+def in_stock_books(book_ids):
+    """``{id: book}`` of sellable books, from the snapshot when enabled"""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.in_stock_books(book_ids)
+    return Book.objects.in_stock().filter(id__in=book_ids).select_related('author').in_bulk()
@@ -0,0 +1,46 @@
+"""
+Response and static file compression.
+
+gzip is always available. Brotli is used when the optional ``brotli``
+package is installed; without it only gzip variants are produced.
+"""
+import gzip
+import io
+import re
+import secrets
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+ACCEPTS_BROTLI = re.compile(r'\bbr\b')
+
+
+def gzip_compress(data, level=6, max_random_bytes=0):
+    """
+    gzip ``data`` at ``level``.
+
+    ``max_random_bytes`` pads the gzip header with a random-length file
+    name, as Django's GZipMiddleware does, so response length does not
+    leak secrets through compression ratios (BREACH).
+    """
+    buffer = io.BytesIO()
+    filename = 'a' * secrets.randbelow(max_random_bytes) if max_random_bytes else ''
+    with gzip.GzipFile(filename=filename, mode='wb', compresslevel=level, fileobj=buffer, mtime=0) as file:
+        file.write(data)
+    return buffer.getvalue()
+
+
+def brotli_compress(data, quality=5):
+    return brotli.compress(data, quality=quality)
+
+
+def choose_encoding(accept_encoding):
+    """Best ``Content-Encoding`` the client accepts, or ``None``"""
+    if brotli is not None and ACCEPTS_BROTLI.search(accept_encoding):
+        return 'br'
+    if ACCEPTS_GZIP.search(accept_encoding):
+        return 'gzip'
+    return None
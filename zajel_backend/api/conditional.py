@@ -0,0 +1,35 @@
+"""
+Conditional GET for per-user resources.
+
+Views polled by the apps (orders, profile) compute a cheap version of
+what they would return, e.g. ``archive.history_version``, and turn it into
+an ETag with ``make_etag``. ``not_modified`` answers a request whose
+``If-None-Match`` still matches with a 304 before anything is loaded or
+serialized; otherwise the view builds its response and ``set_etag``
+marks it. The compression middleware weakens the ETag of compressed
+bodies, which If-None-Match (a weak comparison) still matches.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+def make_etag(*parts):
+    """A quoted ETag for the version ``parts`` (include the user: tags must not match across accounts)"""
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def not_modified(request, etag):
+    """A 304 response when ``request`` already has the ``etag`` version, else ``None``"""
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        return None
+    return set_etag(response, etag)
+
+
+def set_etag(response, etag):
+    # Private data: only the client's own cache keeps it, and revalidates every time
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
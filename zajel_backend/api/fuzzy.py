@@ -0,0 +1,293 @@
+"""
+Typo-tolerant search with an in-memory trigram index.
+
+Titles, author names and publishers are normalized (case, Arabic
+diacritics and letter variants such as أ/إ/آ → ا, ى → ي, ة → ه) and split
+into pg_trgm style trigrams. A query matches a book when enough of its
+trigrams occur in the book's text, so "محفوض" still finds "محفوظ".
+
+The index keeps one posting array per trigram and the trigrams of every
+book in a single flat array, which keeps a 100k-title catalog in a few
+tens of megabytes. Candidates come from the rarest query trigrams only:
+a book sharing at least ``need`` of ``n`` query trigrams must contain one
+of the ``n - need + 1`` rarest, so the long postings of common trigrams
+are skipped.
+
+Building the index takes seconds for a large catalog, so it is never done
+on a request: ``wsgi.preload`` builds it before workers fork, and
+otherwise the first search starts a background build (searches find
+nothing fuzzy until it is done). After that the index follows the catalog
+incrementally by ``updated_at``, like ``catalog.CatalogSnapshot``.
+"""
+import math
+import re
+import threading
+import time
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Q
+
+from .catalog import get_snapshot, in_stock_books
+from .models import Author, Book
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_LETTER_VARIANTS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+})
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize_text(text):
+    """Lower-case, drop diacritics and tatweel, fold letter variants and punctuation"""
+    text = _DIACRITICS.sub('', text.lower()).translate(_LETTER_VARIANTS)
+    return _SEPARATORS.sub(' ', text).strip()
+
+
+def _word_trigrams(word):
+    padded = f'  {word} '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def trigrams(text):
+    """Trigrams of every word, padded like pg_trgm: ``"  w", " wo", ..., "d "``"""
+    result = set()
+    for word in normalize_text(text).split():
+        result.update(_word_trigrams(word))
+    return result
+
+
+class TrigramIndex:
+    """Inverted trigram index over ``(book_id, name, author, publisher)`` rows"""
+
+    def __init__(self, rows=()):
+        self._trigram_ids = {}
+        self.postings = []
+        self.book_ids = array('q')
+        # Trigram ids of document i are doc_trigrams[offsets[i]:offsets[i + 1]]
+        self.doc_trigrams = array('I')
+        self.offsets = array('I', [0])
+        # Replaced or removed documents stay in the arrays, flagged here,
+        # until the next full build
+        self.alive = bytearray()
+        self.positions = {}
+        self.dead = 0
+
+        # Titles share words and books share authors and publishers, so
+        # trigram ids are worked out once per distinct field and word
+        field_ids = {}
+        word_ids = {}
+        for book_id, *fields in rows:
+            self._add(book_id, fields, field_ids, word_ids)
+
+    def _trigram_id(self, gram):
+        trigram_id = self._trigram_ids.get(gram)
+        if trigram_id is None:
+            trigram_id = len(self.postings)
+            self.postings.append(array('I'))
+            self._trigram_ids[gram] = trigram_id
+        return trigram_id
+
+    def _add(self, book_id, fields, field_ids, word_ids):
+        ids = set()
+        for field in fields:
+            if not field:
+                continue
+            cached = field_ids.get(field)
+            if cached is None:
+                cached = set()
+                for word in normalize_text(field).split():
+                    if word not in word_ids:
+                        word_ids[word] = [self._trigram_id(gram) for gram in _word_trigrams(word)]
+                    cached.update(word_ids[word])
+                cached = field_ids[field] = tuple(cached)
+            ids.update(cached)
+
+        current = self.positions.get(book_id)
+        if current is not None:
+            if ids == set(self.doc_trigrams[self.offsets[current]:self.offsets[current + 1]]):
+                return
+            self.remove(book_id)
+
+        # Searches run during incremental updates, so a position only
+        # appears in the postings once its document is complete
+        position = len(self.book_ids)
+        self.doc_trigrams.extend(ids)
+        self.offsets.append(len(self.doc_trigrams))
+        self.book_ids.append(book_id)
+        self.alive.append(1)
+        self.positions[book_id] = position
+        for trigram_id in ids:
+            self.postings[trigram_id].append(position)
+
+    def add(self, book_id, *fields):
+        """Index a book, replacing its previous text"""
+        self._add(book_id, fields, {}, {})
+
+    def remove(self, book_id):
+        position = self.positions.pop(book_id, None)
+        if position is not None:
+            self.alive[position] = 0
+            self.dead += 1
+
+    def __len__(self):
+        return len(self.positions)
+
+    def search(self, query, limit=10, threshold=0.5, max_candidates=5000):
+        """
+        Book ids ranked by the share of query trigrams they contain, then
+        by how little else they contain.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        query_ids = {self._trigram_ids[gram] for gram in grams if gram in self._trigram_ids}
+        need = max(1, math.ceil(threshold * len(grams)))
+        if len(query_ids) < need:
+            return []
+
+        candidates = set()
+        for posting in sorted((self.postings[trigram_id] for trigram_id in query_ids), key=len)[:len(query_ids) - need + 1]:
+            candidates.update(posting)
+            if len(candidates) >= max_candidates:
+                break
+
+        scored = []
+        offsets, doc_trigrams, alive = self.offsets, self.doc_trigrams, self.alive
+        for position in candidates:
+            if not alive[position]:
+                continue
+            start, end = offsets[position], offsets[position + 1]
+            shared = len(query_ids.intersection(doc_trigrams[start:end]))
+            if shared >= need:
+                union = len(grams) + (end - start) - shared
+                scored.append((-shared, -shared / union, position))
+        scored.sort()
+        return [self.book_ids[position] for _, _, position in scored[:limit]]
+
+
+def catalog_rows():
+    """
+    Searchable text of every in-stock book, and the ``(book, author)``
+    ``updated_at`` watermarks the rows are at least as new as.
+    """
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        watermarks = snapshot.book_watermark, snapshot.author_watermark
+        return [(book.id, book.name, book.author.name, book.publisher) for book in snapshot.in_stock()], watermarks
+    # Taken first: rows committed meanwhile are read again by the next refresh
+    watermarks = (
+        Book.objects.aggregate(value=Max('updated_at'))['value'],
+        Author.objects.aggregate(value=Max('updated_at'))['value'],
+    )
+    rows = Book.objects.in_stock().order_by('-created_at').values_list(
+        'id', 'name', 'author__name', 'publisher'
+    ).iterator(chunk_size=5000)
+    return rows, watermarks
+
+
+def build_index():
+    """A full index of the in-stock catalog"""
+    started = time.monotonic()
+    rows, (book_watermark, author_watermark) = catalog_rows()
+    index = TrigramIndex(rows)
+    index.book_watermark, index.author_watermark = book_watermark, author_watermark
+    index.refreshed_at = started
+    return index
+
+
+def refresh_index(index):
+    """
+    Apply the books changed since the index was last refreshed (or whose
+    author was renamed), re-reading a short overlap for late commits.
+    """
+    started = time.monotonic()
+    overlap = timedelta(seconds=settings.SEARCH_FUZZY_OVERLAP)
+    authors = Author.objects.all()
+    if index.author_watermark:
+        authors = authors.filter(updated_at__gte=index.author_watermark - overlap)
+    author_ids = []
+    for author_id, updated_at in authors.values_list('id', 'updated_at'):
+        author_ids.append(author_id)
+        index.author_watermark = max(filter(None, [index.author_watermark, updated_at]))
+
+    books = Book.objects.all()
+    if index.book_watermark:
+        books = books.filter(Q(updated_at__gte=index.book_watermark - overlap) | Q(author_id__in=author_ids))
+
+    rows = books.values_list('id', 'name', 'author__name', 'publisher', 'available', 'stock', 'updated_at')
+    for book_id, name, author, publisher, available, stock, updated_at in rows:
+        if available and stock > 0:
+            index.add(book_id, name, author, publisher)
+        else:
+            index.remove(book_id)
+        index.book_watermark = max(filter(None, [index.book_watermark, updated_at]))
+    index.refreshed_at = started
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _in_background(job, *args):
+    """Run ``job`` on a background thread unless another index job is running"""
+    if not _lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            job(*args)
+        finally:
+            _lock.release()
+            connection.close()
+
+    threading.Thread(target=run, name='fuzzy-index', daemon=True).start()
+
+
+def build():
+    """Build the process-wide index now (e.g. in ``wsgi.preload`` before workers fork)"""
+    global _index
+    _index = build_index()
+
+
+def _refresh(index):
+    # Searches keep reading the index while it is updated in place
+    refresh_index(index)
+    if index.dead > len(index) // 4:
+        build()
+
+
+def get_index():
+    """
+    The process-wide index, or ``None`` while its first build runs in the
+    background. Once older than ``SEARCH_FUZZY_REFRESH_INTERVAL`` the next
+    reader starts a background refresh with the catalog changes since;
+    when replaced and removed books make up a quarter of it, that refresh
+    rebuilds it instead.
+    """
+    index = _index
+    if index is None:
+        _in_background(build)
+    elif time.monotonic() - index.refreshed_at >= settings.SEARCH_FUZZY_REFRESH_INTERVAL:
+        _in_background(_refresh, index)
+    return index
+
+
+def fuzzy_search(query, limit=10):
+    """In-stock books similar to ``query``, best match first; ``None`` until the index is built"""
+    index = get_index()
+    if index is None:
+        return None
+    book_ids = index.search(
+        query, limit=limit,
+        threshold=settings.SEARCH_FUZZY_THRESHOLD,
+        max_candidates=settings.SEARCH_FUZZY_MAX_CANDIDATES,
+    )
+    if not book_ids:
+        return []
+    # The index can trail the catalog, so stock is checked again here
+    books = in_stock_books(book_ids)
+    return [books[book_id] for book_id in book_ids if book_id in books]
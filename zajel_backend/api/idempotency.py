@@ -0,0 +1,123 @@
+"""
+Idempotency-Key support for unsafe API endpoints.
+
+The first request with a given key runs normally and its response is
+stored. Retries with the same key and body get the stored response back
+without running the view again, so a flaky network cannot create a
+second order. Keys are scoped to the endpoint and the user (or session).
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 100
+
+
+def _scope(request):
+    if request.user.is_authenticated:
+        owner = f'user:{request.user.pk}'
+    else:
+        # Anonymous carts live in the session, so a first-time visitor
+        # needs a session key before their key can be scoped to it
+        if not request.session.session_key:
+            request.session.create()
+        owner = f'session:{request.session.session_key}'
+    return f'{request.method} {request.path} {owner}'[:150]
+
+
+def _fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _claim(scope, key, request_hash):
+    """
+    Reserve the key for this request.
+
+    Returns ``None`` when the caller should run the view, otherwise the
+    existing record.
+    """
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(scope=scope, key=key, expires_at__gt=now).first()
+    if record is not None:
+        return record
+
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(scope=scope, key=key, request_hash=request_hash, expires_at=expires_at)
+        return None
+    except IntegrityError:
+        pass
+
+    # Expired keys that the sweeper has not removed yet count as unused
+    reclaimed = IdempotencyKey.objects.filter(scope=scope, key=key, expires_at__lte=now).update(
+        request_hash=request_hash, status_code=None, response_body=b'', created_at=now, expires_at=expires_at
+    )
+    if reclaimed:
+        return None
+    return IdempotencyKey.objects.filter(scope=scope, key=key).first()
+
+
+def idempotent(handler):
+    """Decorator for APIView handlers that honours the Idempotency-Key header"""
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        scope = _scope(request)
+        request_hash = _fingerprint(request)
+        record = _claim(scope, key, request_hash)
+
+        if record is not None:
+            if record.request_hash != request_hash:
+                return Response(
+                    {'error': f'{HEADER} was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status_code is None:
+                return Response(
+                    {'error': f'A request with this {HEADER} is still being processed'},
+                    status=status.HTTP_409_CONFLICT,
+                    headers={'Retry-After': '1'}
+                )
+            response = HttpResponse(bytes(record.response_body), status=record.status_code, content_type='application/json')
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(scope=scope, key=key).delete()
+            raise
+
+        if response.status_code >= 500 or not isinstance(response, Response):
+            # Let the client retry failures for real
+            IdempotencyKey.objects.filter(scope=scope, key=key).delete()
+        else:
+            IdempotencyKey.objects.filter(scope=scope, key=key).update(
+                status_code=response.status_code,
+                response_body=JSONRenderer().render(response.data)
+            )
+        return response
+    return wrapper
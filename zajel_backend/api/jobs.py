@@ -0,0 +1,288 @@
+"""
+Database-backed background jobs.
+
+``enqueue`` stores a ``Job`` row naming a task registered with ``@task``
+(see ``api.tasks``) and its JSON payload, in the caller's transaction, so
+a job exists exactly when the data it works on was committed. Workers
+started by ``run_workers`` claim due jobs in batches: with
+``SELECT ... FOR UPDATE SKIP LOCKED`` where the database supports it, so
+concurrent workers never wait on each other's rows, and otherwise (SQLite)
+with one conditional UPDATE that only flips jobs still queued, which the
+single writer makes atomic.
+
+A job that raises is retried after an exponential backoff with jitter
+until ``max_attempts``, then marked failed with its traceback. Jobs left
+running by a worker that died are requeued after
+``JOB_QUEUE_LOCK_TIMEOUT``. With ``JOB_QUEUE_EAGER`` jobs run in the
+enqueuing process right after commit instead, for development.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Registered tasks: name -> (function, max_attempts or None), filled in
+# when TASK_MODULE is imported
+TASKS = {}
+TASK_MODULE = 'api.tasks'
+
+
+def task(name=None, max_attempts=None):
+    """Register the decorated function as a task called with the job payload as keyword arguments"""
+    def register(function):
+        TASKS[name or function.__name__] = (function, max_attempts)
+        return function
+    return register
+
+
+def get_task(name):
+    import_module(TASK_MODULE)
+    return TASKS.get(name, (None, None))
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    """Queue task ``name`` to run with ``payload`` (JSON) in ``delay`` seconds; returns the job"""
+    function, task_max_attempts = get_task(name)
+    if function is None:
+        raise ValueError(f'Unknown task {name}')
+    job = Job.objects.create(
+        task=name,
+        payload=payload or {},
+        max_attempts=max_attempts or task_max_attempts or settings.JOB_QUEUE_MAX_ATTEMPTS,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+    if settings.JOB_QUEUE_EAGER and not delay:
+        transaction.on_commit(lambda: run_now(job.pk))
+    return job
+
+
+def _claim_token(worker):
+    return f'{worker[:80]}:{uuid.uuid4().hex[:12]}'
+
+
+def _lock(queryset, token, now):
+    return queryset.update(status='running', locked_by=token, locked_at=now, attempts=F('attempts') + 1)
+
+
+def claim(worker, limit=1):
+    """Lock up to ``limit`` due jobs for ``worker``; returns them oldest first"""
+    token = _claim_token(worker)
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_after__lte=now).order_by('run_after', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            if not ids:
+                return []
+            _lock(Job.objects.filter(id__in=ids), token, now)
+        else:
+            # The status condition is checked again by the UPDATE itself, so
+            # of two workers picking the same ids only the first one wins
+            if not _lock(Job.objects.filter(id__in=due.values('id')[:limit], status='queued'), token, now):
+                return []
+    return list(Job.objects.filter(locked_by=token, status='running').order_by('run_after', 'id'))
+
+
+def run_now(job_id):
+    """Claim and run one queued job in this process (eager mode)"""
+    token = _claim_token(f'{socket.gethostname()}:{os.getpid()}/eager')
+    if _lock(Job.objects.filter(pk=job_id, status='queued'), token, timezone.now()):
+        run_job(Job.objects.get(pk=job_id))
+
+
+def retry_delay(attempt):
+    """Seconds before retry ``attempt`` (1-based): doubling from ``JOB_QUEUE_RETRY_DELAY``, capped, with jitter"""
+    delay = min(settings.JOB_QUEUE_RETRY_DELAY * 2 ** (attempt - 1), settings.JOB_QUEUE_RETRY_DELAY_MAX)
+    return random.uniform(delay / 2, delay)
+
+
+def run_job(job):
+    """Run a claimed job and record the outcome; returns ('succeeded' | 'retrying' | 'failed', seconds)"""
+    started = time.perf_counter()
+    function, _ = get_task(job.task)
+    error = None
+    if function is None:
+        error = f'Unknown task {job.task}'
+    else:
+        try:
+            function(**job.payload)
+        except Exception:
+            logger.exception('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts)
+            error = traceback.format_exc()
+    seconds = time.perf_counter() - started
+
+    # Only the claim that ran the job may finish it: a job requeued as
+    # stale meanwhile belongs to another worker
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    now = timezone.now()
+    if error is None:
+        outcome = 'succeeded'
+        mine.update(status='succeeded', finished_at=now, locked_by='', locked_at=None, last_error='')
+    elif function is not None and job.attempts < job.max_attempts:
+        outcome = 'retrying'
+        mine.update(
+            status='queued', run_after=now + timedelta(seconds=retry_delay(job.attempts)),
+            locked_by='', locked_at=None, last_error=error
+        )
+    else:
+        outcome = 'failed'
+        mine.update(status='failed', finished_at=now, locked_by='', locked_at=None, last_error=error)
+    return outcome, seconds
+
+
+def requeue_stale():
+    """Return jobs whose worker stopped without finishing them to the queue; returns how many"""
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status='running', locked_at__lt=now - timedelta(seconds=settings.JOB_QUEUE_LOCK_TIMEOUT)
+    )
+    error = 'Worker stopped while running the job'
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, locked_by='', locked_at=None, last_error=error
+    )
+    requeued = stale.update(status='queued', run_after=now, locked_by='', locked_at=None, last_error=error)
+    return failed + requeued
+
+
+def work(index, stop, events, batch_size, poll_interval, once):
+    """
+    Worker loop: claim and run jobs until ``stop`` is set (or, with
+    ``once``, until nothing is due), putting ``(task, outcome, seconds)``
+    on ``events`` for every job.
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}/{index}'
+    try:
+        while not stop.is_set():
+            jobs = claim(worker, batch_size)
+            if not jobs:
+                requeue_stale()
+                if once:
+                    break
+                stop.wait(poll_interval)
+                continue
+            for job in jobs:
+                outcome, seconds = run_job(job)
+                events.put((job.task, outcome, seconds))
+    except Exception:
+        logger.exception('Worker %s stopped', worker)
+        raise
+    finally:
+        connections.close_all()
+
+
+def _work_in_process(*args):
+    # Ctrl-C, and SIGTERM from timeout or systemd, reach the whole process
+    # group; the parent stops the workers through ``stop`` once they have
+    # finished the job at hand
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    work(*args)
+
+
+class JobMetrics:
+    """Per-task outcome counts and run times of the jobs a pool has run"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.outcomes = defaultdict(Counter)
+        self.seconds = defaultdict(float)
+
+    def record(self, task_name, outcome, seconds):
+        self.outcomes[task_name][outcome] += 1
+        self.seconds[task_name] += seconds
+
+    @property
+    def total(self):
+        return sum(sum(counts.values()) for counts in self.outcomes.values())
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        lines = [f'{self.total} jobs in {elapsed:.1f}s ({self.total / elapsed if elapsed else 0:.1f} jobs/s)']
+        for task_name, counts in sorted(self.outcomes.items()):
+            runs = sum(counts.values())
+            lines.append(
+                f'  {task_name}: {counts["succeeded"]} succeeded, {counts["retrying"]} retrying, '
+                f'{counts["failed"]} failed, {self.seconds[task_name] / runs * 1000:.1f} ms avg'
+            )
+        return '\n'.join(lines)
+
+
+class WorkerPool:
+    """Run ``workers`` worker loops in threads or forked processes and collect their metrics"""
+
+    def __init__(self, workers=1, mode='thread', batch_size=1, poll_interval=None, once=False):
+        if mode == 'process' and 'fork' not in multiprocessing.get_all_start_methods():
+            mode = 'thread'
+        self.workers = workers
+        self.mode = mode
+        self.batch_size = batch_size
+        self.poll_interval = settings.JOB_QUEUE_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.once = once
+        self.metrics = JobMetrics()
+        if mode == 'process':
+            context = multiprocessing.get_context('fork')
+            self._stop, self._events = context.Event(), context.Queue()
+        else:
+            self._stop, self._events = threading.Event(), queue.Queue()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, report=None, report_interval=None):
+        """Run until stopped (or drained, with ``once``), calling ``report(metrics)`` every ``report_interval`` seconds"""
+        args = (self._stop, self._events, self.batch_size, self.poll_interval, self.once)
+        if self.mode == 'process':
+            # Forked workers must open their own database connections
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            runners = [context.Process(target=_work_in_process, args=(index, *args)) for index in range(self.workers)]
+        else:
+            runners = [
+                threading.Thread(target=work, args=(index, *args), name=f'job-worker-{index}', daemon=True)
+                for index in range(self.workers)
+            ]
+        for runner in runners:
+            runner.start()
+
+        last_report = time.perf_counter()
+        try:
+            while any(runner.is_alive() for runner in runners):
+                self._collect(timeout=0.5)
+                if report and report_interval and time.perf_counter() - last_report >= report_interval:
+                    report(self.metrics)
+                    last_report = time.perf_counter()
+        except KeyboardInterrupt:
+            self.stop()
+        for runner in runners:
+            runner.join()
+        self._collect(timeout=0.1)
+        return self.metrics
+
+    def _collect(self, timeout):
+        wait = timeout
+        while True:
+            try:
+                event = self._events.get(timeout=wait)
+            except queue.Empty:
+                return
+            self.metrics.record(*event)
+            wait = 0.01
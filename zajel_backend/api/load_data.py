@@ -0,0 +1,298 @@
+"""
+Synthetic catalog, customers and orders for performance testing.
+
+Everything is derived from a seed: each kind of row is generated in fixed
+size chunks, and chunk ``i`` always uses ``Random('<seed>-<kind>-<i>')``,
+so the same options (and the same ``until`` date) produce the same data
+whatever the number of worker processes. Rows are written with
+``bulk_create``, one chunk per transaction.
+
+Distributions:
+
+* book popularity is Zipfian (exponent ``zipf``) over a seeded shuffle of
+  the catalog, so bestsellers are not simply the lowest ids;
+* customers and orders cover all 58 wilayas, weighted towards the large
+  ones;
+* titles, authors and customer names are Arabic.
+
+Stock levels and the stock change log are left alone.
+"""
+import multiprocessing
+import random
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+
+from .models import User, Author, Book, Order, OrderItem, WILAYA_CHOICES, BOOK_CATEGORY_CHOICES
+
+EMAIL_DOMAIN = 'load.zajil.test'
+
+FIRST_NAMES = [
+    'محمد', 'أحمد', 'عبد القادر', 'ياسمينة', 'مالك', 'آسيا', 'رشيد', 'واسيني', 'أمين', 'فضيلة',
+    'الطاهر', 'مولود', 'عبد الحميد', 'ربيعة', 'سمير', 'نور الدين', 'ليلى', 'كمال', 'زهور', 'إيمان',
+]
+LAST_NAMES = [
+    'بن هدوقة', 'وطار', 'الأعرج', 'فرعون', 'معمري', 'جبار', 'خضرا', 'بوجدرة', 'الزاوي', 'حداد',
+    'قسوم', 'مستغانمي', 'ديب', 'بوشعيب', 'عمراني', 'سعدي', 'بلعيد', 'شريف', 'مرزوق', 'زروقي',
+]
+TITLE_HEADS = [
+    'أسرار', 'رحلة إلى', 'ذاكرة', 'ظلال', 'حكايات', 'أيام', 'ليالي', 'صمت', 'نور', 'طريق',
+    'بيت', 'رسائل', 'أحلام', 'تاريخ', 'أسطورة', 'زمن', 'صوت', 'مرايا', 'أطياف', 'عودة إلى',
+]
+TITLE_TAILS = [
+    'الصحراء', 'البحر', 'المدينة', 'الغريب', 'الشمال', 'الجنوب', 'الياسمين', 'الرمال', 'الأندلس', 'القصبة',
+    'النخيل', 'الحنين', 'الليل', 'الفجر', 'الجبل', 'الوطن', 'المطر', 'الزيتون', 'الأطلس', 'الهقار',
+]
+PUBLISHERS = ['دار القصبة', 'منشورات الاختلاف', 'دار الشروق', 'دار الآداب', 'دار الساقي', 'المؤسسة الوطنية للكتاب']
+
+# Relative weight of the most populous wilayas; every other wilaya counts 1
+WILAYA_WEIGHTS = {
+    '16': 12, '31': 6, '25': 4, '19': 4, '09': 4, '05': 3, '06': 3, '15': 3,
+    '35': 3, '13': 3, '23': 2, '42': 2, '22': 2, '07': 2, '34': 2, '26': 2,
+}
+WILAYAS = [code for code, name in WILAYA_CHOICES]
+WILAYA_NAMES = dict(WILAYA_CHOICES)
+WILAYA_CUM_WEIGHTS = list(accumulate(WILAYA_WEIGHTS.get(code, 1) for code in WILAYAS))
+
+ORDER_STATUSES = ['completed', 'processing', 'pending', 'canceled']
+ORDER_STATUS_CUM_WEIGHTS = list(accumulate([70, 10, 10, 10]))
+GUEST_ORDER_SHARE = 0.3
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let ``bulk_create`` keep the values set on ``auto_now``/``auto_now_add`` fields"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def chunk_random(seed, kind, index):
+    return random.Random(f'{seed}-{kind}-{index}')
+
+
+def person_name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def wilaya(rng):
+    return rng.choices(WILAYAS, cum_weights=WILAYA_CUM_WEIGHTS)[0]
+
+
+def book_title(index):
+    """Distinct head/tail pairs first, then numbered volumes of them"""
+    pairs = len(TITLE_HEADS) * len(TITLE_TAILS)
+    head, tail = divmod(index % pairs, len(TITLE_TAILS))
+    title = f'{TITLE_HEADS[head]} {TITLE_TAILS[tail]}'
+    volume = index // pairs
+    return f'{title} {volume + 1}' if volume else title
+
+
+# Chunk generators; each runs in a worker process (or in-process) and
+# returns the number of rows written
+
+def create_authors(seed, index, start, count, **shared):
+    rng = chunk_random(seed, 'authors', index)
+    authors = [
+        Author(name=person_name(rng), biography=f'كاتب من {WILAYA_NAMES[wilaya(rng)]}.')
+        for _ in range(count)
+    ]
+    Author.objects.bulk_create(authors)
+    return count
+
+
+def create_books(seed, index, start, count, author_ids, **shared):
+    rng = chunk_random(seed, 'books', index)
+    books = []
+    for position in range(start, start + count):
+        stock = 0 if rng.random() < 0.1 else rng.randint(1, 200)
+        books.append(Book(
+            name=book_title(position),
+            description='وصف تجريبي لاختبار الأداء.',
+            author_id=rng.choice(author_ids),
+            publisher=rng.choice(PUBLISHERS),
+            # Prices in dinars, skewed towards cheap paperbacks
+            price=Decimal(min(int(rng.lognormvariate(7, 0.5)) // 50 * 50 + 50, 20000)),
+            publishing_date=date(1950, 1, 1) + timedelta(days=rng.randrange(27000)),
+            category=rng.choice(BOOK_CATEGORY_CHOICES)[0],
+            stock=stock,
+            available=stock > 0,
+        ))
+    Book.objects.bulk_create(books)
+    return count
+
+
+def create_users(seed, index, start, count, password, until, offset, **shared):
+    rng = chunk_random(seed, 'users', index)
+    users = []
+    for position in range(start, start + count):
+        code = wilaya(rng)
+        users.append(User(
+            email=f'user{offset + position}@{EMAIL_DOMAIN}',
+            password=password,
+            full_name=person_name(rng),
+            wilaya=code,
+            address=f'{rng.randint(1, 200)} شارع الاستقلال',
+            postal_code=f'{code}000',
+            phone_number=f'0{rng.choice("567")}{rng.randrange(10 ** 8):08d}',
+            date_joined=until - timedelta(seconds=rng.randrange(3 * 365 * 86400)),
+            last_profile_update=until,
+        ))
+    User.objects.bulk_create(users)
+    return count
+
+
+def create_orders(seed, index, start, count, catalog, user_ids, until, days, max_items, **shared):
+    """
+    ``catalog`` is ``[(book_id, price, name, author_name), ...]`` in
+    popularity order; orders fall in ``days`` before ``until``
+    """
+    rng = chunk_random(seed, 'orders', index)
+    cum_weights = _zipf_weights(len(catalog), shared['zipf'])
+    orders, items = [], []
+    for _ in range(count):
+        lines = {}
+        for book in rng.choices(catalog, cum_weights=cum_weights, k=min(int(rng.expovariate(0.7)) + 1, max_items)):
+            lines[book] = lines.get(book, 0) + rng.choice([1, 1, 1, 2, 3])
+        created_at = until - timedelta(seconds=rng.randrange(days * 86400))
+        code = wilaya(rng)
+        order = Order(
+            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            user_id=None if not user_ids or rng.random() < GUEST_ORDER_SHARE else rng.choice(user_ids),
+            full_name=person_name(rng),
+            email=f'customer{rng.randrange(10 ** 7)}@{EMAIL_DOMAIN}',
+            phone_number=f'0{rng.choice("567")}{rng.randrange(10 ** 8):08d}',
+            address=f'{rng.randint(1, 200)} شارع الاستقلال',
+            wilaya=code,
+            postal_code=f'{code}000',
+            status=rng.choices(ORDER_STATUSES, cum_weights=ORDER_STATUS_CUM_WEIGHTS)[0],
+            total_price=sum(book[1] * quantity for book, quantity in lines.items()),
+            created_at=created_at,
+            updated_at=created_at,
+        )
+        orders.append(order)
+        items.extend(
+            OrderItem(
+                order_id=order.id, book_id=book_id, quantity=quantity, unit_price=price, subtotal=price * quantity,
+                book_name=name, author_name=author_name
+            )
+            for (book_id, price, name, author_name), quantity in lines.items()
+        )
+
+    with explicit_timestamps(Order._meta.get_field('created_at'), Order._meta.get_field('updated_at')):
+        with transaction.atomic():
+            Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create(items, batch_size=5000)
+    return count
+
+
+_zipf_cache = {}
+
+
+def _zipf_weights(size, exponent):
+    """Cumulative weights of ranks ``1..size`` under Zipf's law"""
+    if (size, exponent) not in _zipf_cache:
+        _zipf_cache[size, exponent] = list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+    return _zipf_cache[size, exponent]
+
+
+# Data every chunk of a run needs (catalog, user ids, ...), handed to each
+# worker once instead of with every chunk
+_shared = {}
+
+
+def _setup_worker(shared):
+    _shared.clear()
+    _shared.update(shared)
+
+
+def _run_chunk(job):
+    function, args = job
+    return function(*args, **_shared)
+
+
+class LoadDataGenerator:
+    """Generate ``kind`` rows in chunks of ``chunk_size`` across ``workers`` processes"""
+
+    def __init__(self, seed=42, workers=1, chunk_size=5000, zipf=1.1, progress=None):
+        self.seed = seed
+        self.workers = workers if 'fork' in multiprocessing.get_all_start_methods() else 1
+        self.chunk_size = chunk_size
+        self.zipf = zipf
+        self.progress = progress or (lambda kind, done, total: None)
+
+    def run(self, kind, function, total, workers=None, **shared):
+        workers = self.workers if workers is None else workers
+        shared['zipf'] = self.zipf
+        jobs = [
+            (function, (self.seed, index, start, min(self.chunk_size, total - start)))
+            for index, start in enumerate(range(0, total, self.chunk_size))
+        ]
+        done = 0
+        self.progress(kind, done, total)
+        if workers <= 1:
+            _setup_worker(shared)
+            for job in jobs:
+                done += _run_chunk(job)
+                self.progress(kind, done, total)
+            return done
+
+        # Forked workers inherit the configured Django and the shared data
+        # (copy-on-write), but must open their own database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_setup_worker, initargs=(shared,)) as pool:
+            for count in pool.map(_run_chunk, jobs):
+                done += count
+                self.progress(kind, done, total)
+        return done
+
+    def generate(self, authors, books, users, orders, until, days=365, max_items=5, password='loadtest123'):
+        """
+        Add the given numbers of rows. With 0 authors or books, new rows
+        use the existing catalog instead.
+
+        Authors and books are written by this process so their ids follow
+        generation order (books and orders pick them by position); users
+        and orders are written by the worker pool.
+        """
+        first_author = Author.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.run('authors', create_authors, authors, workers=1)
+        author_ids = list(
+            Author.objects.filter(id__gt=first_author if authors else 0).values_list('id', flat=True).order_by('id')
+        )
+
+        first_book = Book.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.run('books', create_books, books, workers=1, author_ids=author_ids)
+        catalog = list(
+            Book.objects.filter(id__gt=first_book if books else 0).values_list('id', 'price', 'name', 'author__name').order_by('id')
+        )
+        random.Random(f'{self.seed}-popularity').shuffle(catalog)
+
+        load_users = User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+        self.run(
+            'users', create_users, users,
+            password=make_password(password), until=until, offset=load_users.count()
+        )
+        # Parallel chunks commit in any order, so order users by generation position
+        user_ids = [
+            user_id for position, user_id in sorted(
+                (int(email[4:email.index('@')]), user_id)
+                for user_id, email in load_users.values_list('id', 'email')
+            )
+        ]
+        self.run(
+            'orders', create_orders, orders,
+            catalog=catalog, user_ids=user_ids, until=until, days=days, max_items=max_items
+        )
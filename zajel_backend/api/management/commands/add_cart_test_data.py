@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from api.models import Book, User, Order, OrderItem
+from api.models import Book, User
+from api.cart import DatabaseCart
 from decimal import Decimal
 
 class Command(BaseCommand):
@@ -35,72 +36,26 @@ class Command(BaseCommand):
             else:
                 self.stdout.write(f'Using existing user: {user.full_name}')
             
-            # Create a test order (cart) for the user
-            order, created = Order.objects.get_or_create(
-                user=user,
-                status='pending',
-                defaults={
-                    'full_name': user.full_name,
-                    'email': user.email,
-                    'phone_number': user.phone_number,
-                    'address': user.address,
-                    'wilaya': user.wilaya,
-                    'postal_code': user.postal_code,
-                    'total_price': Decimal('0.00'),
-                }
-            )
-            
-            if created:
-                self.stdout.write(f'Created test order: {order.id}')
-            else:
-                self.stdout.write(f'Using existing order: {order.id}')
-            
-            # Add some items to the cart
+            # Fill the user's persistent cart
+            cart = DatabaseCart(user)
             items_to_add = [
-                {'book': book, 'quantity': 2, 'unit_price': book.price},
+                {'book': book, 'quantity': 2},
             ]
             
             # Add a second book if available
             second_book = Book.objects.filter(id__gt=book.id).first()
             if second_book:
-                items_to_add.append({
-                    'book': second_book, 
-                    'quantity': 1, 
-                    'unit_price': second_book.price
-                })
+                items_to_add.append({'book': second_book, 'quantity': 1})
             
             total_price = Decimal('0.00')
             
             for item_data in items_to_add:
                 book_obj = item_data['book']
                 quantity = item_data['quantity']
-                unit_price = item_data['unit_price']
-                subtotal = quantity * unit_price
-                total_price += subtotal
+                total_price += quantity * book_obj.price
                 
-                order_item, created = OrderItem.objects.get_or_create(
-                    order=order,
-                    book=book_obj,
-                    defaults={
-                        'quantity': quantity,
-                        'unit_price': unit_price,
-                        'subtotal': subtotal,
-                    }
-                )
-                
-                if created:
-                    self.stdout.write(f'Added {quantity}x {book_obj.name} to cart')
-                else:
-                    # Update existing item
-                    order_item.quantity = quantity
-                    order_item.unit_price = unit_price
-                    order_item.subtotal = subtotal
-                    order_item.save()
-                    self.stdout.write(f'Updated {quantity}x {book_obj.name} in cart')
-            
-            # Update order total
-            order.total_price = total_price
-            order.save()
+                cart.set(book_obj.id, quantity)
+                self.stdout.write(f'Set {quantity}x {book_obj.name} in cart')
             
             self.stdout.write(
                 self.style.SUCCESS(
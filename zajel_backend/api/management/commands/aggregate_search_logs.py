@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from api import search_log
+
+class Command(BaseCommand):
+    help = 'Fold new search logs into per-query stats and report top and zero-result queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag', type=int, default=60,
+            help='Leave logs younger than this many seconds for the next run'
+        )
+        parser.add_argument(
+            '--top', type=int, default=20,
+            help='How many top and zero-result queries to print'
+        )
+
+    def handle(self, *args, **options):
+        logs, queries = search_log.aggregate(lag=timedelta(seconds=options['lag']))
+        self.stdout.write(
+            self.style.SUCCESS(f'Aggregated {logs} searches into {queries} query stats')
+        )
+
+        if not options['top']:
+            return
+
+        self.stdout.write('\nTop queries:')
+        for stat in search_log.top_queries(options['top']):
+            self.stdout.write(
+                f'  {stat.searches:>7}  {stat.normalized}  '
+                f'({stat.last_result_count} results, {stat.average_latency_ms:.1f} ms avg)'
+            )
+
+        self.stdout.write('\nQueries returning nothing:')
+        for stat in search_log.zero_result_queries(options['top']):
+            self.stdout.write(f'  {stat.zero_result_searches:>7}  {stat.normalized}')
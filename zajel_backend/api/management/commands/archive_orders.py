@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api import archive
+
+class Command(BaseCommand):
+    help = 'Move completed and canceled orders older than a cutoff into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+            help='Archive finished orders created more than this many days ago'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.ORDER_ARCHIVE_BATCH_SIZE,
+            help='Orders copied and deleted per transaction'
+        )
+        parser.add_argument('--limit', type=int, help='Stop after moving this many orders')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that would move')
+
+    def handle(self, *args, **options):
+        cutoff = archive.archive_cutoff(options['days'])
+        if options['dry_run']:
+            count = archive.archivable_orders(cutoff).count()
+            self.stdout.write(f'{count} orders created before {cutoff:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        started = time.perf_counter()
+        moved = archive.archive_orders(options['days'], options['batch_size'], options['limit'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} orders created before {cutoff:%Y-%m-%d %H:%M} in {elapsed:.1f}s'
+        ))
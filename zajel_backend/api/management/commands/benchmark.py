@@ -0,0 +1,256 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+def timed(func, iterations):
+    """Average wall time of ``func()`` in microseconds"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+class Command(BaseCommand):
+    help = 'Micro-benchmarks for performance-sensitive code paths'
+
+    targets = ['throttle', 'search', 'search-log', 'fuzzy', 'catalog', 'compression']
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=self.targets, help='What to benchmark')
+        parser.add_argument('--iterations', type=int, default=100000, help='Calls per measurement')
+
+    def handle(self, *args, **options):
+        getattr(self, f'bench_{options["target"].replace("-", "_")}')(options['iterations'])
+
+    def report(self, label, microseconds):
+        self.stdout.write(f'{label:<45} {microseconds:8.2f} µs/call')
+
+    def bench_throttle(self, iterations):
+        """Per-request overhead of TokenBucketThrottle.allow_request"""
+        from django.contrib.auth.models import AnonymousUser
+        from api.throttling import LocalBucketStore, TokenBucketThrottle
+        import api.throttling as throttling
+
+        class UnlimitedView:
+            throttle_scope = None
+
+        class LimitedView:
+            throttle_scope = 'benchmark'
+
+        # Large enough that the bucket never runs dry, small enough to refill
+        throttling._rates['benchmark'] = throttling.parse_rate(f'{iterations * 10}/s')
+        throttling._rates['benchmark-tight'] = (1, 1e-9)
+        original_store = throttling._store
+        throttling._store = LocalBucketStore()
+
+        factory = APIRequestFactory()
+        request = Request(factory.get('/api/search/?q=x', REMOTE_ADDR='10.0.0.1'))
+        request.user = AnonymousUser()
+        throttle = TokenBucketThrottle()
+
+        try:
+            self.report('no scope (fast path)', timed(lambda: throttle.allow_request(request, UnlimitedView), iterations))
+            self.report('single client, allowed', timed(lambda: throttle.allow_request(request, LimitedView), iterations))
+
+            LimitedView.throttle_scope = 'benchmark-tight'
+            throttle.allow_request(request, LimitedView)
+            self.report('single client, denied', timed(lambda: throttle.allow_request(request, LimitedView), iterations))
+
+            LimitedView.throttle_scope = 'benchmark'
+            requests = []
+            for i in range(10000):
+                many = Request(factory.get('/api/search/?q=x', REMOTE_ADDR=f'10.{i // 65536}.{i // 256 % 256}.{i % 256}'))
+                many.user = AnonymousUser()
+                requests.append(many)
+            counter = iter(range(iterations))
+            self.report(
+                '10k distinct clients, allowed',
+                timed(lambda: throttle.allow_request(requests[next(counter) % 10000], LimitedView), iterations)
+            )
+        finally:
+            throttling._store = original_store
+            throttling._rates.pop('benchmark', None)
+            throttling._rates.pop('benchmark-tight', None)
+
+    def bench_search(self, iterations):
+        """Database queries and latency per typed word, with and without the prefix cache"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext, override_settings
+        from api.models import Book
+        from api.search import PrefixCache, search_books
+        import api.search as search
+
+        words = [name.split()[0] for name in Book.objects.in_stock().values_list('name', flat=True)[:200] if name.split()]
+        if not words:
+            self.stdout.write(self.style.WARNING('No in-stock books to search for'))
+            return
+        keystrokes = [word[:i] for word in words for i in range(1, len(word) + 1)]
+
+        original_cache = search._cache
+        try:
+            for label, enabled in [('uncached', False), ('prefix cache', True)]:
+                search._cache = PrefixCache(
+                    max_entries=settings.SEARCH_CACHE_MAX_ENTRIES,
+                    ttl=settings.SEARCH_CACHE_TTL,
+                    candidate_limit=settings.SEARCH_CACHE_CANDIDATE_LIMIT,
+                )
+                with override_settings(SEARCH_CACHE_ENABLED=enabled), CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for query in keystrokes:
+                        search_books(query)
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'{label:<15} {len(queries) / len(words):6.2f} queries/word '
+                    f'{elapsed / len(keystrokes) * 1e6:10.1f} µs/keystroke'
+                )
+        finally:
+            search._cache = original_cache
+
+    def bench_search_log(self, iterations):
+        """Request-side cost of recording a search, and of the bulk flush"""
+        from django.db import transaction
+        from api.search_log import SearchLogBuffer
+
+        buffer = SearchLogBuffer(max_size=iterations, flush_interval=3600)
+        # Keep the writer thread out of the measurement
+        buffer._thread = True
+        self.report('record() into the buffer', timed(lambda: buffer.record('نجيب', 'نجيب', 10, 1.5), iterations))
+        self.report('record() with a full buffer', timed(lambda: buffer.record('نجيب', 'نجيب', 10, 1.5), iterations))
+
+        # Measure the bulk insert without keeping the fake searches
+        with transaction.atomic():
+            start = time.perf_counter()
+            written = buffer.flush()
+            self.report(f'flush() of {written} rows, per row', (time.perf_counter() - start) / max(written, 1) * 1e6)
+            transaction.set_rollback(True)
+
+    def bench_fuzzy(self, iterations):
+        """Fuzzy search latency and recall on a synthetic 100k-title catalog with typos"""
+        import random
+        from api.fuzzy import TrigramIndex
+
+        rng = random.Random(0)
+        arabic = 'ابتثجحخدذرزسشصضطظعغفقكلمنهوي'
+        latin = 'abcdefghijklmnopqrstuvwxyz'
+
+        def word(alphabet):
+            return ''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 9)))
+
+        vocabulary = [word(arabic) for _ in range(15000)] + [word(latin) for _ in range(5000)]
+        authors = [f'{rng.choice(vocabulary)} {rng.choice(vocabulary)}' for _ in range(5000)]
+        publishers = [f'دار {rng.choice(vocabulary)}' for _ in range(300)]
+        rows = [
+            (i, ' '.join(rng.choices(vocabulary, k=rng.randint(2, 5))), rng.choice(authors), rng.choice(publishers))
+            for i in range(100000)
+        ]
+
+        start = time.perf_counter()
+        index = TrigramIndex(rows)
+        build = time.perf_counter() - start
+        size = sum(a.itemsize * len(a) for a in [index.book_ids, index.doc_trigrams, index.offsets, *index.postings])
+        self.stdout.write(f'built index of {len(index)} titles in {build:.2f} s, {size / 2 ** 20:.1f} MiB of arrays')
+
+        def typo(text):
+            position = rng.randrange(len(text))
+            return text[:position] + rng.choice(arabic if text[0] in arabic else latin) + text[position + 1:]
+
+        queries = []
+        for _ in range(min(iterations, 2000)):
+            book_id, name, author, publisher = rng.choice(rows)
+            words = name.split()
+            queries.append((book_id, f'{typo(words[0])} {words[1]}'))
+
+        timings = []
+        found = 0
+        for book_id, query in queries:
+            start = time.perf_counter()
+            results = index.search(query)
+            timings.append(time.perf_counter() - start)
+            found += book_id in results
+        timings.sort()
+        self.report('query with one typo, mean', sum(timings) / len(timings) * 1e6)
+        self.report('query with one typo, p95', timings[int(len(timings) * 0.95)] * 1e6)
+        self.stdout.write(f'recall@10: {found / len(queries):.1%}')
+
+        # An incremental refresh re-indexes the books changed since the last one
+        changed = rng.sample(rows, 100)
+        start = time.perf_counter()
+        for book_id, name, author, publisher in changed:
+            index.add(book_id, typo(name), author, publisher)
+        self.report('re-indexing a changed title', (time.perf_counter() - start) / len(changed) * 1e6)
+
+    def bench_catalog(self, iterations):
+        """Hydrating and serializing a page of books from the database vs the catalog snapshot"""
+        from api.catalog import CatalogSnapshot
+        from api.models import Book
+        from api.serializers import BookListSerializer
+
+        book_ids = list(Book.objects.in_stock().values_list('id', flat=True)[:20])
+        if not book_ids:
+            self.stdout.write(self.style.WARNING('No in-stock books to load'))
+            return
+        iterations = min(iterations, 2000)
+
+        start = time.perf_counter()
+        snapshot = CatalogSnapshot()
+        snapshot.refresh()
+        self.stdout.write(f'full snapshot load of {len(snapshot.books)} books: {(time.perf_counter() - start) * 1000:.1f} ms')
+        self.report('incremental refresh, nothing changed', timed(snapshot.refresh, min(iterations, 200)))
+
+        def from_database():
+            books = Book.objects.in_stock().filter(id__in=book_ids).select_related('author').in_bulk()
+            return BookListSerializer(list(books.values()), many=True).data
+
+        def from_snapshot():
+            return BookListSerializer(list(snapshot.in_stock_books(book_ids).values()), many=True).data
+
+        self.report(f'{len(book_ids)} books from the database', timed(from_database, iterations))
+        self.report(f'{len(book_ids)} books from the snapshot', timed(from_snapshot, iterations))
+
+    def bench_compression(self, iterations):
+        """Bytes on the wire and CPU time per JSON response for each compression setting"""
+        from decimal import Decimal
+        from rest_framework.renderers import JSONRenderer
+        from api.compression import brotli, brotli_compress, gzip_compress
+
+        def book(i):
+            return {
+                'id': i, 'name': f'رواية الحرافيش {i}', 'cover_image': f'/media/book_covers/{i:02x}/{i:016x}.jpg',
+                'author': {'id': i % 50, 'name': 'نجيب محفوظ', 'biography': 'روائي مصري حائز على جائزة نوبل للآداب'},
+                'publisher': 'دار الشروق', 'price': Decimal('1500.00') + i, 'category': 'روايات',
+                'available': True, 'stock': i % 20 + 1,
+            }
+
+        def order(items):
+            return {
+                'id': 1, 'full_name': 'محمد أمين', 'email': 'client@example.com', 'wilaya': '16', 'status': 'pending',
+                'items': [
+                    {'id': i, 'book': book(i), 'quantity': 1 + i % 3, 'unit_price': '1500.00', 'subtotal': '3000.00'}
+                    for i in range(items)
+                ],
+            }
+
+        payloads = [
+            ('single book', book(1)),
+            ('catalog page (20 books)', {'count': 1000, 'next': None, 'previous': None, 'results': [book(i) for i in range(20)]}),
+            ('order with 100 items', order(100)),
+        ]
+        codecs = [(f'gzip -{level}', lambda data, level=level: gzip_compress(data, level)) for level in (1, 6, 9)]
+        if brotli is not None:
+            codecs += [(f'brotli q{quality}', lambda data, quality=quality: brotli_compress(data, quality)) for quality in (1, 5, 11)]
+        else:
+            self.stdout.write(self.style.WARNING('brotli is not installed; only gzip is measured'))
+
+        iterations = min(iterations, 500)
+        for label, payload in payloads:
+            data = JSONRenderer().render(payload)
+            self.stdout.write(f'\n{label}: {len(data)} bytes uncompressed')
+            for codec, compress in codecs:
+                size = len(compress(data))
+                start = time.process_time()
+                for _ in range(iterations):
+                    compress(data)
+                cpu = (time.process_time() - start) / iterations * 1e6
+                self.stdout.write(f'  {codec:<12} {size:8} bytes ({size / len(data):6.1%}) {cpu:10.1f} µs CPU')
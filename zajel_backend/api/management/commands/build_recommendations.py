@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from api import recommendations
+
+class Command(BaseCommand):
+    help = 'Update the co-purchase index with orders created since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=recommendations.TOP_K,
+            help='Number of related books kept per book'
+        )
+        parser.add_argument(
+            '--lag', type=int, default=60,
+            help='Leave orders younger than this many seconds for the next run'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Drop the index and rebuild it from the full order history'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Counting co-purchased books...')
+        orders, books = recommendations.build_index(
+            top_k=options['top_k'],
+            lag=timedelta(seconds=options['lag']),
+            rebuild=options['rebuild'],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Processed {orders} orders, refreshed recommendations for {books} books')
+        )
@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from api import jobs
+
+class Command(BaseCommand):
+    help = 'Queue a background job, e.g. a batch command from cron for run_workers to carry out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', help='Registered task name (see api/tasks.py)')
+        parser.add_argument('--payload', type=json.loads, default={}, help='Keyword arguments as a JSON object')
+        parser.add_argument('--delay', type=int, default=0, help='Seconds before the job may run')
+        parser.add_argument('--max-attempts', type=int, help='Runs before a failing job is given up')
+
+    def handle(self, *args, **options):
+        try:
+            job = jobs.enqueue(options['task'], options['payload'], options['delay'], options['max_attempts'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Queued {job}'))
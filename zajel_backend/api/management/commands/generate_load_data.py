@@ -0,0 +1,67 @@
+import os
+import time
+from datetime import datetime, time as day_start
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from api.load_data import LoadDataGenerator
+from api.models import Book
+
+class Command(BaseCommand):
+    help = 'Generate a large deterministic dataset of authors, books, users and orders for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--users', type=int, default=50000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=42, help='Same seed and options give the same data')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Processes writing users and orders (default: CPU count; 1 on SQLite, which has one writer)'
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per bulk_create transaction')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the book popularity distribution')
+        parser.add_argument('--days', type=int, default=365, help='Spread orders over this many days')
+        parser.add_argument('--max-items', type=int, default=5, help='Most distinct books in one order')
+        parser.add_argument(
+            '--until', type=datetime.fromisoformat,
+            help='Latest order date, YYYY-MM-DD (default: today); fix it to reproduce a dataset exactly'
+        )
+        parser.add_argument('--password', default='loadtest123', help='Password of every generated user')
+
+    def handle(self, *args, **options):
+        if options['orders'] and not options['books'] and not Book.objects.exists():
+            raise CommandError('No books to order; generate some with --books')
+        workers = options['workers']
+        if workers is None:
+            workers = 1 if connection.vendor == 'sqlite' else os.cpu_count()
+
+        until = options['until'] or datetime.combine(timezone.localdate(), day_start())
+        if timezone.is_naive(until):
+            until = timezone.make_aware(until)
+
+        started = {}
+        def progress(kind, done, total):
+            if not done:
+                started[kind] = time.perf_counter()
+                return
+            elapsed = time.perf_counter() - started[kind]
+            self.stdout.write(f'  {kind}: {done}/{total} ({done / max(elapsed, 1e-9):,.0f} rows/s)')
+
+        generator = LoadDataGenerator(
+            seed=options['seed'], workers=workers, chunk_size=options['chunk_size'],
+            zipf=options['zipf'], progress=progress,
+        )
+        self.stdout.write(f'Generating with {workers} worker(s), seed {options["seed"]}...')
+        begin = time.perf_counter()
+        generator.generate(
+            authors=options['authors'], books=options['books'], users=options['users'], orders=options['orders'],
+            until=until, days=options['days'], max_items=options['max_items'], password=options['password'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {options["authors"]} authors, {options["books"]} books, {options["users"]} users '
+            f'and {options["orders"]} orders in {time.perf_counter() - begin:.1f}s'
+        ))
+        self.stdout.write('Run rollup_sales --rebuild and build_recommendations --rebuild to index the new orders.')
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.media import COVER_DIRECTORY, hashed_name, is_hashed_name
+from api.models import Book
+
+class Command(BaseCommand):
+    help = 'Move covers uploaded before content hashing to content-hashed names'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only list the covers that would be renamed'
+        )
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Leave the old files in place (e.g. while caches still point at them)'
+        )
+
+    def handle(self, *args, **options):
+        renamed = missing = 0
+        books = Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True).only('id', 'cover_image')
+
+        for book in books.iterator(chunk_size=500):
+            old_name = book.cover_image.name
+            if is_hashed_name(old_name):
+                continue
+            storage = book.cover_image.storage
+            if not storage.exists(old_name):
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'Missing file for book {book.id}: {old_name}'))
+                continue
+
+            with storage.open(old_name) as file:
+                new_name = hashed_name(COVER_DIRECTORY, file, old_name)
+                if options['dry_run']:
+                    self.stdout.write(f'{old_name} -> {new_name}')
+                    renamed += 1
+                    continue
+                new_name = storage.save(new_name, file)
+
+            # Bump updated_at so catalog snapshots pick up the new name
+            Book.objects.filter(id=book.id).update(cover_image=new_name, updated_at=timezone.now())
+            if not options['keep_old']:
+                storage.delete(old_name)
+            renamed += 1
+
+        verb = 'Would rename' if options['dry_run'] else 'Renamed'
+        self.stdout.write(
+            self.style.SUCCESS(f'{verb} {renamed} covers ({missing} missing files)')
+        )
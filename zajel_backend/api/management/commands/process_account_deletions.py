@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api import accounts
+
+class Command(BaseCommand):
+    help = 'Run account deletions that are pending, failed or were interrupted by a restart'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.ACCOUNT_DELETION_BATCH_SIZE,
+            help='Orders anonymized per UPDATE and sessions scanned per query'
+        )
+
+    def handle(self, *args, **options):
+        job_ids = list(accounts.claimable_jobs().order_by('requested_at').values_list('id', flat=True))
+        ran = failed = 0
+        for job_id in job_ids:
+            try:
+                ran += accounts.run_deletion(job_id, options['batch_size'])
+            except Exception as e:
+                ran += 1
+                failed += 1
+                self.stderr.write(f'Deletion {job_id} failed: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Ran {ran} account deletions ({failed} failed)'))
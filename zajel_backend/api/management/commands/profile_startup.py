@@ -0,0 +1,112 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: load the project's WSGI application, then
+# serve one request through it
+CHILD = '''
+import importlib, json, sys, time
+started = time.perf_counter()
+module, attribute = sys.argv[2].rsplit('.', 1)
+application = getattr(importlib.import_module(module), attribute)
+booted = time.perf_counter()
+
+from io import BytesIO
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+    'HTTP_HOST': 'localhost', 'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr,
+    'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': False,
+    'wsgi.multiprocess': True, 'wsgi.run_once': False,
+}
+statuses = []
+response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+b''.join(response)
+response.close()
+served = time.perf_counter()
+print(json.dumps({'boot': booted - started, 'first_request': served - booted, 'status': statuses[0], 'modules': len(sys.modules)}))
+'''
+
+def parse_importtime(output):
+    """``-X importtime`` lines -> list of (module, self_us, cumulative_us, depth)"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+class Command(BaseCommand):
+    help = 'Report import cost per module and time to first request of a fresh process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/wilayas/', help='Request served as the first request')
+        parser.add_argument('--top', type=int, default=25, help='How many modules to list')
+        parser.add_argument('--runs', type=int, default=3, help='Fresh processes to average over')
+        parser.add_argument('--profile', choices=['full', 'api'], help='Deployment profile to boot (default: current)')
+        parser.add_argument('--preload', action='store_true', help='Boot with WSGI_PRELOAD enabled')
+        parser.add_argument(
+            '--sort', choices=['self', 'cumulative'], default='cumulative',
+            help='Order modules by their own import time or including what they import'
+        )
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+        if options['profile']:
+            env['ZAJEL_DEPLOYMENT_PROFILE'] = options['profile']
+        if options['preload']:
+            env['ZAJEL_WSGI_PRELOAD'] = '1'
+        runs = []
+        totals = {}
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            child = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', CHILD, options['path'], settings.WSGI_APPLICATION],
+                capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+            )
+            wall = time.perf_counter() - started
+            if child.returncode:
+                raise CommandError(f'Startup failed:\n{child.stderr[-2000:]}')
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            result['wall'] = wall
+            runs.append(result)
+            for name, self_us, cumulative_us, depth in parse_importtime(child.stderr):
+                entry = totals.setdefault(name, [0, 0, depth])
+                entry[0] += self_us
+                entry[1] += cumulative_us
+
+        count = len(runs)
+        def average(key):
+            return sum(run[key] for run in runs) / count
+
+        self.stdout.write(f'Profile: {env.get("ZAJEL_DEPLOYMENT_PROFILE", settings.DEPLOYMENT_PROFILE)}, preload: {"on" if env.get("ZAJEL_WSGI_PRELOAD") == "1" else "off"}')
+        self.stdout.write(f'Modules loaded:            {runs[-1]["modules"]}')
+        self.stdout.write(f'Process start to response: {average("wall") * 1000:8.1f} ms (includes interpreter start)')
+        self.stdout.write(f'WSGI application boot:     {average("boot") * 1000:8.1f} ms')
+        self.stdout.write(f'First request ({options["path"]} -> {runs[-1]["status"]}): {average("first_request") * 1000:8.1f} ms')
+
+        if not options['top']:
+            return
+
+        packages = {}
+        for name, (self_us, cumulative_us, depth) in totals.items():
+            package = name.split('.')[0]
+            if package == 'django' and name.count('.') >= 2:
+                package = '.'.join(name.split('.')[:3])
+            packages[package] = packages.get(package, 0) + self_us
+
+        self.stdout.write('\nImport time by package (self, ms):')
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'  {self_us / count / 1000:8.1f}  {package}')
+
+        key = 0 if options['sort'] == 'self' else 1
+        self.stdout.write(f'\nSlowest modules ({options["sort"]}, ms):')
+        for name, entry in sorted(totals.items(), key=lambda item: -item[1][key])[:options['top']]:
+            self.stdout.write(f'  {entry[0] / count / 1000:8.1f} self {entry[1] / count / 1000:8.1f} cumulative  {name}')
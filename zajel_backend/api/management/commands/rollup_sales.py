@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from api import analytics
+
+class Command(BaseCommand):
+    help = 'Fold orders created since the last run into the daily sales rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag', type=int, default=60,
+            help='Leave orders younger than this many seconds for the next run'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Drop all rollups and recompute them from the full order history'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write('Dropping existing rollups...')
+            analytics.rebuild()
+
+        orders, rows = analytics.rollup_new_orders(lag=timedelta(seconds=options['lag']))
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rolled up {orders} orders into {rows} rollup rows')
+        )
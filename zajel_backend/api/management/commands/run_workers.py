@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from api.jobs import WorkerPool
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue with a pool of worker threads or processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Worker threads or processes')
+        parser.add_argument(
+            '--mode', choices=['thread', 'process'], default='thread',
+            help='Threads suit jobs waiting on I/O (email, database); processes suit CPU-bound jobs'
+        )
+        parser.add_argument('--batch-size', type=int, default=1, help='Jobs a worker claims at once')
+        parser.add_argument('--poll-interval', type=float, help='Seconds an idle worker waits (default: JOB_QUEUE_POLL_INTERVAL)')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is due instead of waiting for more')
+        parser.add_argument('--report-interval', type=float, default=60, help='Seconds between throughput reports')
+
+    def handle(self, *args, **options):
+        pool = WorkerPool(
+            workers=options['workers'],
+            mode=options['mode'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+        )
+        # Finish the jobs at hand on SIGTERM (and Ctrl-C), then exit
+        signal.signal(signal.SIGTERM, lambda signum, frame: pool.stop())
+        self.stdout.write(f'Running {pool.workers} {pool.mode} workers')
+        metrics = pool.run(
+            report=lambda metrics: self.stdout.write(metrics.summary()),
+            report_interval=options['report_interval'],
+        )
+        self.stdout.write(self.style.SUCCESS(metrics.summary()))
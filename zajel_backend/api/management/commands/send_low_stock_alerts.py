@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Book, Watermark
+from api import stock
+
+class Command(BaseCommand):
+    help = 'Email one batched alert for books whose stock dropped low since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threshold', type=int, default=settings.LOW_STOCK_THRESHOLD,
+            help='Alert when stock drops to or below this level'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            watermark, created = Watermark.objects.select_for_update().get_or_create(name='low_stock_alerts')
+            alerts, cursor = stock.low_stock_changes(watermark.position, options['threshold'])
+
+            if alerts:
+                books = Book.objects.filter(id__in=alerts).select_related('author').order_by('stock')
+                lines = [
+                    f"- {book.name} by {book.author.name}: {alerts[book.id]} left"
+                    + ("" if book.available else " (unavailable)")
+                    for book in books
+                ]
+                send_mail(
+                    f'Low stock alert - {len(lines)} books',
+                    'The following books are running low:\n\n' + '\n'.join(lines),
+                    settings.DEFAULT_FROM_EMAIL,
+                    [settings.ADMIN_EMAIL],
+                    fail_silently=False
+                )
+
+            watermark.position = cursor
+            watermark.save(update_fields=['position', 'updated_at'])
+
+        self.stdout.write(self.style.SUCCESS(f'Sent alerts for {len(alerts)} books'))
@@ -0,0 +1,137 @@
+import signal
+import time
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.models import IdempotencyKey, Job, RefreshToken, SearchQueryLog, TokenRevocation, Watermark
+from api import search_log
+from api.authentication import expired_tokens
+
+def expired_idempotency_keys(now):
+    return IdempotencyKey.objects.filter(expires_at__lt=now)
+
+def expired_search_logs(now):
+    # Only logs already folded into the search stats may go
+    aggregated_until = Watermark.objects.filter(name=search_log.WATERMARK_NAME).values_list('value', flat=True).first()
+    cutoff = now - timedelta(days=settings.SEARCH_LOG_RETENTION_DAYS)
+    if aggregated_until is None:
+        return SearchQueryLog.objects.none()
+    return SearchQueryLog.objects.filter(created_at__lt=min(cutoff, aggregated_until))
+
+def finished_jobs(now):
+    return Job.objects.filter(
+        status__in=['succeeded', 'failed'], finished_at__lt=now - timedelta(days=settings.JOB_QUEUE_RETENTION_DAYS)
+    )
+
+def expired_sessions(now):
+    # Sessions kept elsewhere (cache, signed cookies) expire on their own
+    if settings.SESSION_ENGINE not in ('django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db'):
+        return None
+    from django.contrib.sessions.models import Session
+    return Session.objects.filter(expire_date__lt=now)
+
+def expired_refresh_tokens(now):
+    return RefreshToken.objects.filter(expires_at__lt=now)
+
+def old_token_revocations(now):
+    # Revocations only matter while the access tokens they refuse are unexpired
+    return TokenRevocation.objects.filter(created_at__lt=now - timedelta(seconds=settings.ACCESS_TOKEN_TTL))
+
+# Sweep targets: name -> function returning the expired rows (None when
+# the target does not apply)
+TARGETS = {
+    'idempotency-keys': expired_idempotency_keys,
+    'search-logs': expired_search_logs,
+    'finished-jobs': finished_jobs,
+    'sessions': expired_sessions,
+    'tokens': expired_tokens,
+    'refresh-tokens': expired_refresh_tokens,
+    'token-revocations': old_token_revocations,
+}
+
+class Command(BaseCommand):
+    help = 'Delete expired rows in small batches, once or continuously next to live traffic'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'targets', nargs='*',
+            help=f'What to sweep: {", ".join(TARGETS)} (default: everything)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows deleted per statement'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Seconds to sleep between batches'
+        )
+        parser.add_argument(
+            '--continuous', action='store_true',
+            help='Keep sweeping until stopped (SIGTERM or Ctrl-C finish the current batch first)'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=60.0,
+            help='Seconds between sweeps in continuous mode'
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['targets']) - set(TARGETS)
+        if unknown:
+            raise CommandError(f'Unknown targets: {", ".join(sorted(unknown))}')
+
+        self.stopping = False
+        if options['continuous']:
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        while True:
+            for name in options['targets'] or TARGETS:
+                started = time.perf_counter()
+                deleted = self.sweep(TARGETS[name], options['batch_size'], options['pause'])
+                if deleted is None:
+                    continue
+                if deleted or not options['continuous']:
+                    elapsed = time.perf_counter() - started
+                    rate = deleted / elapsed if elapsed else 0
+                    self.stdout.write(self.style.SUCCESS(
+                        f'{name}: deleted {deleted} rows in {elapsed:.1f}s ({rate:.0f} rows/s)'
+                    ))
+                if self.stopping:
+                    return
+            if not options['continuous']:
+                return
+            deadline = time.monotonic() + options['interval']
+            while not self.stopping and time.monotonic() < deadline:
+                time.sleep(min(1.0, deadline - time.monotonic()))
+            if self.stopping:
+                return
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def sweep(self, expired, batch_size, pause):
+        """
+        Delete expired rows by primary key, one bounded batch at a time;
+        returns the number deleted, or None when the target does not apply.
+        The delete repeats the expiry condition, so a row renewed since it
+        was selected (e.g. a session saved by a request) is kept.
+        """
+        now = timezone.now()
+        if expired(now) is None:
+            return None
+        deleted = 0
+        while not self.stopping:
+            queryset = expired(now)
+            ids = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            count = queryset.filter(pk__in=ids).delete()[0]
+            if not count:
+                break  # the whole batch was renewed meanwhile; pick up the rest next time
+            deleted += count
+            if pause:
+                time.sleep(pause)
+        return deleted
@@ -0,0 +1,38 @@
+"""
+Content-hashed media names.
+
+Uploaded covers are stored under a name derived from their bytes, e.g.
+``book_covers/3f/3f9a0c1d2e4b5a69.jpg``. A new image always gets a new
+URL, so browsers and CDNs may cache media forever (see ``serve_media``).
+"""
+import hashlib
+import os
+import re
+
+COVER_DIRECTORY = 'book_covers'
+HASH_LENGTH = 16
+HASHED_NAME = re.compile(rf'(^|/)([0-9a-f]{{2}})/\2[0-9a-f]{{{HASH_LENGTH - 2}}}(_[A-Za-z0-9]+)?\.[A-Za-z0-9]+$')
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(directory, file, filename):
+    """``<directory>/<hh>/<hash><ext>`` for the contents of ``file``"""
+    digest = content_hash(file)
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{directory}/{digest[:2]}/{digest}{extension}'
+
+
+def is_hashed_name(name):
+    """Whether a stored name was produced by ``hashed_name`` (and so never changes content)"""
+    return bool(HASHED_NAME.search(name))
+
+
+def cover_upload_to(instance, filename):
+    return hashed_name(COVER_DIRECTORY, instance.cover_image, filename)
@@ -0,0 +1,48 @@
+"""Project middleware"""
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .compression import brotli_compress, choose_encoding, gzip_compress
+
+
+class JSONCompressionMiddleware:
+    """
+    Compress API responses of ``API_COMPRESSION_CONTENT_TYPES`` that are at
+    least ``API_COMPRESSION_MIN_SIZE`` bytes, with Brotli when available
+    and accepted, otherwise gzip. Streaming responses are left alone.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in settings.API_COMPRESSION_CONTENT_TYPES:
+            return response
+        if len(response.content) < settings.API_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli_compress(response.content, settings.API_BROTLI_QUALITY)
+        else:
+            compressed = gzip_compress(response.content, settings.API_COMPRESSION_LEVEL, max_random_bytes=100)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The bytes differ from the uncompressed variant
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
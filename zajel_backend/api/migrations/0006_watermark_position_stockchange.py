@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_copurchasecount_relatedbook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watermark',
+            name='position',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('stock_after', models.IntegerField()),
+                ('available', models.BooleanField()),
+                ('reason', models.CharField(choices=[('checkout', 'Checkout'), ('cancellation', 'Cancellation'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_changes', to='api.book')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
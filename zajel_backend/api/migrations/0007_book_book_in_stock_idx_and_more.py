@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:16
+
+from django.db import migrations, models
+
+
+def hide_sold_out_books(apps, schema_editor):
+    Book = apps.get_model('api', 'Book')
+    Book.objects.filter(stock__lte=0, available=True).update(available=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_watermark_position_stockchange'),
+    ]
+
+    operations = [
+        migrations.RunPython(hide_sold_out_books, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('available', True), ('stock__gt', 0)), fields=['-created_at'], name='book_in_stock_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(('available', False), ('stock__gt', 0), _connector='OR'), name='book_available_requires_stock'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_cartitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueryLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=200)),
+                ('normalized', models.CharField(max_length=200)),
+                ('result_count', models.PositiveSmallIntegerField()),
+                ('latency_ms', models.FloatField()),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchQueryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('normalized', models.CharField(max_length=200, unique=True)),
+                ('searches', models.PositiveIntegerField(default=0)),
+                ('zero_result_searches', models.PositiveIntegerField(default=0)),
+                ('total_latency_ms', models.FloatField(default=0)),
+                ('last_result_count', models.PositiveSmallIntegerField(default=0)),
+                ('last_searched_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-searches'], name='search_stat_searches_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:31
+
+import api.media
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_author_updated_at_book_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, upload_to=api.media.cover_upload_to),
+        ),
+    ]
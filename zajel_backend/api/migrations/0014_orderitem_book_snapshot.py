@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:47
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_books(apps, schema_editor):
+    Book = apps.get_model('api', 'Book')
+    for model_name in ('OrderItem', 'ArchivedOrderItem'):
+        items = apps.get_model('api', model_name).objects.all()
+        book = Book.objects.filter(id=OuterRef('book_id'))
+        items.update(
+            book_name=Subquery(book.values('name')[:1]),
+            author_name=Subquery(book.values('author__name')[:1]),
+        )
+        for book_id, cover in Book.objects.exclude(cover_image='').exclude(cover_image=None).values_list('id', 'cover_image'):
+            items.filter(book_id=book_id).update(cover_url=default_storage.url(cover))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_archivedorder_archivedorderitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='author_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='book_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='cover_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='author_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='book_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='cover_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.RunPython(snapshot_books, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:05
+
+from django.db import migrations, models
+
+# The authtoken app has no index on Token.created, which sweep_expired
+# filters on; it is added here because the model is not ours to change
+TOKEN_CREATED_INDEX = models.Index(fields=['created'], name='authtoken_created_idx')
+
+
+def add_token_created_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('authtoken', 'Token'), TOKEN_CREATED_INDEX)
+
+
+def remove_token_created_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('authtoken', 'Token'), TOKEN_CREATED_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_job'),
+        ('authtoken', '0003_tokenproxy'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_token_created_index, remove_token_created_index),
+    ]
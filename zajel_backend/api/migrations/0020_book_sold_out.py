@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:35
+
+from django.db import migrations, models
+
+
+def flag_sold_out_books(apps, schema_editor):
+    # Until now every unavailable book without stock was re-enabled on restock
+    Book = apps.get_model('api', 'Book')
+    Book.objects.filter(stock__lte=0, available=False).update(sold_out=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_order_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='sold_out',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(flag_sold_out_books, migrations.RunPython.noop),
+    ]
@@ -4,6 +4,8 @@ from django.core.validators import MinValueValidator
 from decimal import Decimal
 import uuid
 
+from .media import cover_upload_to
+
 # Algerian Wilayas choices
 WILAYA_CHOICES = [
     ('01', 'Adrar'), ('02', 'Chlef'), ('03', 'Laghouat'), ('04', 'Oum El Bouaghi'),
@@ -41,6 +43,36 @@ ORDER_STATUS_CHOICES = [
     ('canceled', 'Canceled'),
 ]
 
+# Stock change reasons
+STOCK_CHANGE_REASON_CHOICES = [
+    ('checkout', 'Checkout'),
+    ('cancellation', 'Cancellation'),
+    ('adjustment', 'Adjustment'),
+]
+
+# Account deletion job states
+ACCOUNT_DELETION_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+]
+
+# Background job states
+JOB_STATUS_CHOICES = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('succeeded', 'Succeeded'),
+    ('failed', 'Failed'),
+]
+
+# Sales rollup dimensions
+ROLLUP_DIMENSION_CHOICES = [
+    ('wilaya', 'Wilaya'),
+    ('category', 'Category'),
+    ('book', 'Book'),
+]
+
 class UserManager(BaseUserManager):
     use_in_migrations = True
 
@@ -102,6 +134,7 @@ class Author(models.Model):
     """Author model for books"""
     name = models.CharField(max_length=255)
     biography = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -109,10 +142,15 @@ class Author(models.Model):
     class Meta:
         ordering = ['name']
 
+class BookQuerySet(models.QuerySet):
+    def in_stock(self):
+        """Books that can be sold right now (matches the book_in_stock_idx partial index)"""
+        return self.filter(available=True, stock__gt=0)
+
 class Book(models.Model):
     """Book model for the bookstore"""
     name = models.CharField(max_length=255)
-    cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True)
+    cover_image = models.ImageField(upload_to=cover_upload_to, blank=True, null=True)
     description = models.TextField()
     author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='books')
     publisher = models.CharField(max_length=255)
@@ -121,14 +159,48 @@ class Book(models.Model):
     category = models.CharField(max_length=50, choices=BOOK_CATEGORY_CHOICES, default='روايات')
     available = models.BooleanField(default=True)
     stock = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Hidden automatically because the stock ran out, not by staff
+    sold_out = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = BookQuerySet.as_manager()
+    
+    def save(self, *args, **kwargs):
+        # A sold-out book is never available; set-based updates keep the
+        # same rule in api.stock.adjust_stock, which also makes a book that
+        # sold out available again when restocked (admin stock edits go
+        # through it)
+        if self.stock <= 0:
+            self.sold_out = self.available or self.sold_out
+            self.available = False
+        else:
+            self.sold_out = False
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.name} by {self.author.name}"
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['-created_at'],
+                name='book_in_stock_idx',
+                condition=models.Q(available=True, stock__gt=0)
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(available=False) | models.Q(stock__gt=0),
+                name='book_available_requires_stock'
+            ),
+        ]
+
+class OrderQuerySet(models.QuerySet):
+    def with_details(self):
+        """Orders with everything OrderSerializer renders, in two queries"""
+        return self.select_related('user').prefetch_related('items')
 
 class Order(models.Model):
     """Order model for customer orders"""
@@ -145,11 +217,17 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = OrderQuerySet.as_manager()
+    
     def __str__(self):
         return f"Order {self.id} - {self.full_name}"
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Covers the count and latest update behind order history ETags
+            models.Index(fields=['user', 'updated_at'], name='order_user_updated_idx'),
+        ]
 
 class OrderItem(models.Model):
     """OrderItem model for individual items in an order"""
@@ -158,15 +236,259 @@ class OrderItem(models.Model):
     quantity = models.IntegerField(validators=[MinValueValidator(1)])
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    # The book as it was at checkout: order pages and emails render from
+    # these without joining Book/Author and stay historically accurate
+    book_name = models.CharField(max_length=255, blank=True)
+    author_name = models.CharField(max_length=255, blank=True)
+    cover_url = models.CharField(max_length=500, blank=True)
+    
+    def take_snapshot(self, book):
+        """Copy what order pages show of ``book`` (with its author loaded)"""
+        self.book_name = book.name
+        self.author_name = book.author.name
+        self.cover_url = book.cover_image.url if book.cover_image else ''
     
     def save(self, *args, **kwargs):
         # Calculate subtotal automatically
         from decimal import Decimal
         self.subtotal = Decimal(int(self.quantity)) * self.unit_price
+        if not self.book_name:
+            self.take_snapshot(self.book)
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"{self.quantity}x {self.book.name} in Order {self.order.pk}"
+        return f"{self.quantity}x {self.book_name} in Order {self.order_id}"
+    
+    class Meta:
+        unique_together = ['order', 'book']
+
+
+class ArchivedOrder(models.Model):
+    """Completed or canceled order moved out of the hot tables by api.archive (same fields as Order)"""
+    id = models.UUIDField(primary_key=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_orders')
+    full_name = models.CharField(max_length=255)
+    email = models.EmailField()
+    phone_number = models.CharField(max_length=20)
+    address = models.TextField()
+    wilaya = models.CharField(max_length=2, choices=WILAYA_CHOICES)
+    postal_code = models.CharField(max_length=10)
+    status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = OrderQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"Archived order {self.id} - {self.full_name}"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='archived_order_user_idx'),
+            models.Index(fields=['user', 'updated_at'], name='archived_order_updated_idx'),
+        ]
+
+class ArchivedOrderItem(models.Model):
+    """Item of an ArchivedOrder (same fields as OrderItem)"""
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    book_name = models.CharField(max_length=255, blank=True)
+    author_name = models.CharField(max_length=255, blank=True)
+    cover_url = models.CharField(max_length=500, blank=True)
+    
+    def __str__(self):
+        return f"{self.quantity}x {self.book_name} in archived order {self.order_id}"
     
     class Meta:
         unique_together = ['order', 'book']
+
+
+class Watermark(models.Model):
+    """Progress marker for incremental batch jobs"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(null=True, blank=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.value or self.position}"
+
+class DailySalesRollup(models.Model):
+    """Daily sales aggregates per wilaya, category or book"""
+    dimension = models.CharField(max_length=10, choices=ROLLUP_DIMENSION_CHOICES)
+    date = models.DateField()
+    key = models.CharField(max_length=50)
+    label = models.CharField(max_length=255)
+    orders_count = models.IntegerField(default=0)
+    items_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    
+    def __str__(self):
+        return f"{self.dimension}:{self.label} on {self.date}"
+    
+    class Meta:
+        ordering = ['-date']
+        unique_together = ['dimension', 'date', 'key']
+
+class CoPurchaseCount(models.Model):
+    """Number of orders in which two books were bought together"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.book_id} + {self.other_id}: {self.count}"
+    
+    class Meta:
+        unique_together = ['book', 'other']
+
+class RelatedBook(models.Model):
+    """Precomputed top co-purchased books for a book"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.IntegerField()
+    
+    def __str__(self):
+        return f"{self.book_id} -> {self.related_id} (#{self.rank})"
+    
+    class Meta:
+        ordering = ['rank']
+        unique_together = ['book', 'rank']
+
+class StockChange(models.Model):
+    """Append-only log of stock movements, read as an incremental feed"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='stock_changes')
+    delta = models.IntegerField()
+    stock_after = models.IntegerField()
+    available = models.BooleanField()
+    reason = models.CharField(max_length=20, choices=STOCK_CHANGE_REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.book_id}: {self.delta:+d} -> {self.stock_after}"
+    
+    class Meta:
+        ordering = ['id']
+
+class IdempotencyKey(models.Model):
+    """Stored outcome of a request sent with an Idempotency-Key header"""
+    scope = models.CharField(max_length=150)
+    key = models.CharField(max_length=100)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # null while in flight
+    response_body = models.BinaryField(blank=True, default=b'')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+    
+    class Meta:
+        unique_together = ['scope', 'key']
+
+class CartItem(models.Model):
+    """A line in an authenticated user's persistent cart"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.quantity}x {self.book_id} for {self.user_id}"
+    
+    class Meta:
+        unique_together = ['user', 'book']
+
+class SearchQueryLog(models.Model):
+    """One live search request, written in batches by the search log buffer"""
+    query = models.CharField(max_length=200)
+    normalized = models.CharField(max_length=200)
+    result_count = models.PositiveSmallIntegerField()
+    latency_ms = models.FloatField()
+    created_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"{self.normalized} ({self.result_count})"
+
+class SearchQueryStat(models.Model):
+    """Aggregated search counts per normalized query"""
+    normalized = models.CharField(max_length=200, unique=True)
+    searches = models.PositiveIntegerField(default=0)
+    zero_result_searches = models.PositiveIntegerField(default=0)
+    total_latency_ms = models.FloatField(default=0)
+    last_result_count = models.PositiveSmallIntegerField(default=0)
+    last_searched_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.normalized}: {self.searches}"
+    
+    @property
+    def average_latency_ms(self):
+        return self.total_latency_ms / self.searches if self.searches else 0
+    
+    class Meta:
+        indexes = [models.Index(fields=['-searches'], name='search_stat_searches_idx')]
+
+class AccountDeletion(models.Model):
+    """Background deletion of a customer account, run by api.accounts"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    account_id = models.BigIntegerField(db_index=True)  # not a foreign key: the user row goes last
+    status = models.CharField(max_length=20, choices=ACCOUNT_DELETION_STATUS_CHOICES, default='pending')
+    orders_anonymized = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Deletion of account {self.account_id} ({self.status})"
+
+class Job(models.Model):
+    """A unit of background work in the database-backed queue (api.jobs)"""
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=JOB_STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField()  # not claimed before this (set to now, or later for retries)
+    locked_by = models.CharField(max_length=100, blank=True)  # worker and claim that is running it
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_claim_idx'),
+            models.Index(fields=['locked_by'], name='job_locked_by_idx'),
+        ]
+
+class RefreshToken(models.Model):
+    """Long-lived token exchanged for new access tokens (api.tokens); only its hash is stored"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='refresh_tokens')
+    token_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    rotated_at = models.DateTimeField(null=True, blank=True)  # set once exchanged; presenting it again means it leaked
+    
+    def __str__(self):
+        return f"Refresh token of {self.user_id} until {self.expires_at:%Y-%m-%d}"
+
+class TokenRevocation(models.Model):
+    """Access tokens of a user issued before ``revoked_before`` are no longer accepted"""
+    user_id = models.BigIntegerField()  # not a foreign key: revocations outlive deleted accounts
+    revoked_before = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return f"Tokens of {self.user_id} before {self.revoked_before}"
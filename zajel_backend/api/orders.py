@@ -0,0 +1,77 @@
+"""
+Set-based order status transitions shared by the admin API and OrderAdmin.
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Order, OrderItem
+from .stock import adjust_stock
+from . import analytics, recommendations
+
+# Allowed source statuses for each target status
+ORDER_STATUS_TRANSITIONS = {
+    'processing': ['pending'],
+    'completed': ['processing'],
+    'canceled': ['pending', 'processing'],
+}
+
+
+class OrderTransitionError(Exception):
+    """Raised when some orders cannot move to the requested status"""
+
+    def __init__(self, message, order_ids=()):
+        super().__init__(message)
+        self.order_ids = list(order_ids)
+
+
+def restore_stock(order_ids):
+    """Give the stock of the given orders back with one update per book"""
+    quantities = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values('book_id')
+        .annotate(quantity=Sum('quantity'))
+        .order_by('book_id')
+    )
+    adjust_stock({row['book_id']: row['quantity'] for row in quantities}, 'cancellation')
+
+
+def transition_orders(order_ids, new_status, strict=True):
+    """
+    Move orders to ``new_status`` with a single UPDATE.
+
+    With ``strict`` the whole batch is rejected when any order is missing or
+    not in an allowed source status. Otherwise those orders are skipped.
+    Returns the list of order ids that were updated.
+    """
+    if new_status not in ORDER_STATUS_TRANSITIONS:
+        raise OrderTransitionError(f'Orders cannot be moved to {new_status}')
+    allowed = ORDER_STATUS_TRANSITIONS[new_status]
+
+    with transaction.atomic():
+        current = dict(
+            Order.objects.select_for_update()
+            .filter(id__in=order_ids)
+            .values_list('id', 'status')
+        )
+        valid = [order_id for order_id, order_status in current.items() if order_status in allowed]
+
+        if strict and len(valid) != len(set(order_ids)):
+            rejected = [order_id for order_id, order_status in current.items() if order_status not in allowed]
+            missing = [order_id for order_id in order_ids if order_id not in current]
+            raise OrderTransitionError(
+                f'Only {", ".join(allowed)} orders can be moved to {new_status}',
+                order_ids=rejected + missing,
+            )
+        if not valid:
+            return []
+
+        if new_status == 'canceled':
+            restore_stock(valid)
+            analytics.remove_canceled_orders(valid)
+            recommendations.remove_canceled_orders(valid)
+
+        Order.objects.filter(id__in=valid, status__in=allowed).update(
+            status=new_status, updated_at=timezone.now()
+        )
+    return valid
@@ -0,0 +1,211 @@
+"""
+Per-request SQL inspection for development and CI.
+
+``QueryInspector`` hooks every database connection of the current thread
+and groups the statements it sees by normalized SQL (literals and IN lists
+folded) and by the project call site that issued them. The same statement
+coming from the same place ``QUERY_INSPECTOR_THRESHOLD`` or more times in
+one request is the signature of an N+1 and is flagged, unless the call
+site is listed in ``QUERY_INSPECTOR_ALLOW``.
+
+``QueryInspectorMiddleware`` applies it to every request, adds
+``X-Query-Count`` / ``X-Query-Time`` headers, logs flagged groups and, with
+``QUERY_INSPECTOR_STRICT``, raises ``NPlusOneDetected`` so the test suite
+fails. ``inspect_queries`` does the same around any block of test code.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+VALUES_LIST = re.compile(r'VALUES\s*(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+')
+WHITESPACE = re.compile(r'\s+')
+
+PROJECT_ROOT = str(settings.BASE_DIR) + os.sep
+THIS_FILE = os.path.abspath(__file__)
+
+
+class NPlusOneDetected(AssertionError):
+    """Raised in strict mode when a request repeats a statement from one call site"""
+
+
+def normalize_sql(sql):
+    """Fold literals and placeholder lists so statements differing only in values group together"""
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    sql = VALUES_LIST.sub(r'VALUES \1', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def call_site(depth):
+    """Innermost ``depth`` project frames as ``path:line in function``, outside third-party code"""
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < depth:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_ROOT) and filename != THIS_FILE and 'site-packages' not in filename:
+            frames.append(f'{filename[len(PROJECT_ROOT):]}:{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return tuple(frames)
+
+
+class QueryInspector:
+    """Record the statements run on this thread's connections while active"""
+
+    def __init__(self, threshold=None, stack_depth=None):
+        self.threshold = threshold or settings.QUERY_INSPECTOR_THRESHOLD
+        self.stack_depth = stack_depth or settings.QUERY_INSPECTOR_STACK_DEPTH
+        self.queries = []  # (alias, normalized sql, call site, seconds)
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((
+                context['connection'].alias, normalize_sql(sql), call_site(self.stack_depth),
+                time.perf_counter() - started
+            ))
+
+    def __enter__(self):
+        self._hooks = ExitStack()
+        for alias in connections:
+            self._hooks.enter_context(connections[alias].execute_wrapper(self))
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self._started
+        self._hooks.close()
+
+    @property
+    def query_time(self):
+        return sum(query[3] for query in self.queries)
+
+    def groups(self):
+        """Statements grouped by (alias, normalized sql, call site), most frequent first"""
+        groups = {}
+        for alias, sql, site, seconds in self.queries:
+            group = groups.setdefault((alias, sql, site), {
+                'database': alias, 'sql': sql, 'call_site': list(site), 'count': 0, 'time_ms': 0.0
+            })
+            group['count'] += 1
+            group['time_ms'] += seconds * 1000
+        return sorted(groups.values(), key=lambda group: (-group['count'], -group['time_ms']))
+
+    def repeated(self):
+        return [group for group in self.groups() if self._flagged(group)]
+
+    def _flagged(self, group):
+        if group['count'] < self.threshold:
+            return False
+        if group['call_site']:
+            path, _, function = group['call_site'][0].partition(' in ')
+            return f'{path.rsplit(":", 1)[0]}:{function}' not in settings.QUERY_INSPECTOR_ALLOW
+        return True
+
+    def report(self, endpoint=None):
+        groups = self.groups()
+        return {
+            'endpoint': endpoint,
+            'queries': len(self.queries),
+            'query_time_ms': round(self.query_time * 1000, 3),
+            'elapsed_ms': round(self.elapsed * 1000, 3),
+            'threshold': self.threshold,
+            'repeated': [group for group in groups if self._flagged(group)],
+            'groups': groups,
+        }
+
+    def describe(self, endpoint=None):
+        lines = [f'{endpoint or "Block"} ran {len(self.queries)} queries; repeated from one call site:']
+        for group in self.repeated():
+            lines.append(f'  {group["count"]}x {group["sql"][:200]}')
+            lines.extend(f'      at {frame}' for frame in group['call_site'])
+        return '\n'.join(lines)
+
+    def check(self, endpoint=None):
+        if self.repeated():
+            raise NPlusOneDetected(self.describe(endpoint))
+
+
+@contextmanager
+def inspect_queries(strict=True, threshold=None):
+    """
+    Test helper: inspect the queries of a block and, if ``strict``, fail
+    when it repeats a statement from one call site::
+
+        with inspect_queries() as inspector:
+            self.client.get('/api/orders/')
+        self.assertLess(len(inspector.queries), 10)
+    """
+    with QueryInspector(threshold) as inspector:
+        yield inspector
+    if strict:
+        inspector.check()
+
+
+# Worst request seen per endpoint in this process, written to QUERY_INSPECTOR_REPORT_DIR
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return f'{request.method} {match.view_name if match else request.path}'
+
+
+def write_report(report):
+    """Keep the report of the endpoint's most expensive request so far"""
+    endpoint = report['endpoint']
+    with _endpoints_lock:
+        seen = _endpoints.setdefault(endpoint, {'requests': 0, 'worst': None})
+        seen['requests'] += 1
+        if seen['worst'] is not None and seen['worst']['queries'] >= report['queries']:
+            return
+        seen['worst'] = report
+        requests = seen['requests']
+
+    os.makedirs(settings.QUERY_INSPECTOR_REPORT_DIR, exist_ok=True)
+    filename = re.sub(r'[^A-Za-z0-9_.-]+', '_', endpoint).strip('_') + '.json'
+    with open(os.path.join(settings.QUERY_INSPECTOR_REPORT_DIR, filename), 'w') as file:
+        json.dump(dict(report, requests=requests), file, indent=2)
+
+
+class QueryInspectorMiddleware:
+    """Inspect the SQL of every request (enabled by ``QUERY_INSPECTOR_ENABLED``)"""
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTOR_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryInspector() as inspector:
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(len(inspector.queries))
+        response['X-Query-Time'] = f'{inspector.query_time * 1000:.1f}ms'
+
+        endpoint = endpoint_name(request)
+        if settings.QUERY_INSPECTOR_REPORT_DIR:
+            write_report(inspector.report(endpoint))
+        if inspector.repeated():
+            if settings.QUERY_INSPECTOR_STRICT:
+                raise NPlusOneDetected(inspector.describe(endpoint))
+            logger.warning(inspector.describe(endpoint))
+        return response
@@ -0,0 +1,152 @@
+"""
+"Customers also bought" index.
+
+``CoPurchaseCount`` keeps sparse pair counts (both directions) for every
+two books that appeared in the same order. ``RelatedBook`` holds the top-K
+of those counts per book so the book detail endpoint needs a single
+indexed lookup. The ``copurchase`` watermark lets each run read only the
+orders created since the previous one.
+"""
+from collections import Counter
+from datetime import timedelta
+from itertools import combinations, groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem, CoPurchaseCount, RelatedBook, Watermark
+
+WATERMARK_NAME = 'copurchase'
+TOP_K = 10
+
+# Larger baskets add little signal but a quadratic number of pairs
+MAX_BASKET_SIZE = 50
+
+BATCH_SIZE = 500
+
+
+def _chunks(values, size=BATCH_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _count_pairs(*item_sets):
+    """Stream order items (hot and archived) once and count book pairs per order"""
+    pairs = Counter()
+    for items in item_sets:
+        items = items.order_by('order_id').values_list('order_id', 'book_id').iterator(chunk_size=2000)
+        for order_id, rows in groupby(items, key=lambda row: row[0]):
+            basket = sorted({book_id for _, book_id in rows})[:MAX_BASKET_SIZE]
+            for a, b in combinations(basket, 2):
+                pairs[a, b] += 1
+                pairs[b, a] += 1
+    return pairs
+
+
+def _merge_counts(pairs):
+    """Add new pair counts (negative ones subtract) to the stored ones"""
+    by_book = {}
+    for (book_id, other_id), count in pairs.items():
+        by_book.setdefault(book_id, {})[other_id] = count
+
+    for chunk in _chunks(by_book):
+        existing = CoPurchaseCount.objects.filter(book_id__in=chunk).values_list('book_id', 'other_id', 'count')
+        for book_id, other_id, count in existing:
+            if other_id in by_book[book_id]:
+                by_book[book_id][other_id] += count
+
+        CoPurchaseCount.objects.bulk_create(
+            [
+                CoPurchaseCount(book_id=book_id, other_id=other_id, count=count)
+                for book_id in chunk
+                for other_id, count in by_book[book_id].items()
+            ],
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['book', 'other'],
+            update_fields=['count'],
+        )
+    return list(by_book)
+
+
+def _refresh_top_k(book_ids, top_k):
+    """Recompute the RelatedBook rows of the given books"""
+    for chunk in _chunks(book_ids):
+        counts = (
+            CoPurchaseCount.objects.filter(book_id__in=chunk)
+            .order_by('book_id', '-count', 'other_id')
+            .values_list('book_id', 'other_id', 'count')
+        )
+        rows = []
+        for book_id, group in groupby(counts, key=lambda row: row[0]):
+            for rank, (_, other_id, count) in enumerate(group):
+                if rank >= top_k:
+                    break
+                rows.append(RelatedBook(book_id=book_id, related_id=other_id, rank=rank + 1, score=count))
+
+        RelatedBook.objects.filter(book_id__in=chunk).delete()
+        RelatedBook.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def build_index(top_k=TOP_K, lag=timedelta(minutes=1), rebuild=False):
+    """
+    Fold orders created since the watermark into the co-purchase index.
+
+    Returns a ``(orders, books)`` tuple of processed orders and books whose
+    recommendations were refreshed.
+    """
+    with transaction.atomic():
+        watermark, created = Watermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        if rebuild:
+            CoPurchaseCount.objects.all().delete()
+            RelatedBook.objects.all().delete()
+            watermark.value = None
+
+        until = timezone.now() - lag
+        orders = Order.objects.filter(created_at__lte=until).exclude(status='canceled')
+        archived = ArchivedOrder.objects.filter(created_at__lte=until).exclude(status='canceled')
+        if watermark.value:
+            orders = orders.filter(created_at__gt=watermark.value)
+            archived = archived.filter(created_at__gt=watermark.value)
+
+        order_count = orders.count() + archived.count()
+        touched = _merge_counts(_count_pairs(
+            OrderItem.objects.filter(order__in=orders),
+            ArchivedOrderItem.objects.filter(order__in=archived),
+        ))
+        _refresh_top_k(touched, top_k)
+
+        watermark.value = until
+        watermark.save(update_fields=['value', 'updated_at'])
+    return order_count, len(touched)
+
+
+def remove_canceled_orders(order_ids, top_k=TOP_K):
+    """
+    Subtract orders that were just canceled from the pair counts, so the
+    index keeps matching a rebuild (which skips canceled orders).
+
+    Must be called in the same transaction as the status change. Orders
+    newer than the watermark are skipped, the next run excludes them.
+    """
+    with transaction.atomic():
+        watermark, created = Watermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        if not watermark.value:
+            return 0
+        pairs = _count_pairs(OrderItem.objects.filter(order_id__in=order_ids, order__created_at__lte=watermark.value))
+        if not pairs:
+            return 0
+        touched = _merge_counts({pair: -count for pair, count in pairs.items()})
+        CoPurchaseCount.objects.filter(book_id__in=touched, count__lte=0).delete()
+        _refresh_top_k(touched, top_k)
+    return len(touched)
+
+
+def related_books(book_id):
+    """Recommended books for a book, best first"""
+    entries = (
+        RelatedBook.objects.filter(book_id=book_id, related__available=True, related__stock__gt=0)
+        .select_related('related__author')
+    )
+    return [entry.related for entry in entries]
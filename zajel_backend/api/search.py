@@ -0,0 +1,188 @@
+"""
+Prefix result cache for live search.
+
+Search-as-you-type sends ``q=ن``, ``q=نج``, ``q=نجي``... and every match of a
+longer query is also a match of its prefix. Once a prefix's complete
+candidate list is small enough to keep, longer queries are answered by
+filtering it in memory instead of querying the database again. Entries are
+short-lived and evicted least recently used first; each process keeps its
+own cache and re-warms popular prefixes in the background every
+``SEARCH_CACHE_WARM_INTERVAL`` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .catalog import get_snapshot
+from .models import Book, SearchQueryStat
+
+RESULT_LIMIT = 10
+
+# Popular queries warm their prefixes up to this many characters
+WARM_PREFIX_LENGTH = 3
+
+
+def normalize_query(query):
+    """Trim and collapse whitespace so equivalent queries share a cache entry"""
+    return ' '.join(query.split())
+
+
+def _matches(query, limit):
+    """The first ``limit`` in-stock books whose title or author contains ``query``"""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.search(query, limit)
+    return list(Book.objects.in_stock().filter(
+        Q(name__icontains=query) | Q(author__name__icontains=query)
+    ).select_related('author')[:limit])
+
+
+class PrefixCache:
+    """
+    LRU cache of search candidates keyed by lower-cased query.
+
+    An entry holds ``(haystack, book)`` pairs in result order, or ``None``
+    when the query matched more than ``candidate_limit`` books and is too
+    broad to narrow from.
+    """
+
+    def __init__(self, max_entries, ttl, candidate_limit):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.candidate_limit = candidate_limit
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, now):
+        """Returns ``(found, candidates)``"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, candidates = entry
+            if expires <= now:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, candidates
+
+    def _put(self, key, candidates, now):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, candidates)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, query, limit=RESULT_LIMIT):
+        books = _matches(query, max(self.candidate_limit, limit) + 1)
+        if len(books) > self.candidate_limit:
+            return books[:limit], None
+        # icontains on name OR author name; the separator keeps a query
+        # from matching across the two fields
+        candidates = [(f'{book.name}\n{book.author.name}'.lower(), book) for book in books]
+        return books[:limit], candidates
+
+    def search(self, query, limit=RESULT_LIMIT):
+        """Books matching ``query``, answered from a cached prefix when possible"""
+        key = query.lower()
+        now = time.monotonic()
+
+        for length in range(len(key), 0, -1):
+            found, candidates = self._get(key[:length], now)
+            if not found:
+                continue
+            if candidates is not None:
+                self.hits += 1
+                narrowed = candidates if length == len(key) else [c for c in candidates if key in c[0]]
+                return [book for _, book in narrowed[:limit]]
+            if length == len(key):
+                # Known to be too broad; skip the candidate fetch
+                self.misses += 1
+                return _matches(query, limit)
+            break
+
+        self.misses += 1
+        results, candidates = self._fetch(query, limit)
+        self._put(key, candidates, now)
+        return results
+
+    def warm(self, prefixes):
+        """Load candidate lists for the given prefixes ahead of real traffic"""
+        now = time.monotonic()
+        for prefix in prefixes:
+            prefix = normalize_query(prefix)
+            if prefix:
+                self._put(prefix.lower(), self._fetch(prefix)[1], now)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_warmed_at = None
+
+
+def popular_prefixes():
+    """
+    Prefixes to warm the cache with: the configured ones, then the leading
+    characters of the most searched queries, where typing starts.
+    """
+    prefixes = dict.fromkeys(settings.SEARCH_CACHE_WARM_PREFIXES)
+    top = SearchQueryStat.objects.filter(last_result_count__gt=0).order_by('-searches').values_list('normalized', flat=True)
+    for query in top[:settings.SEARCH_CACHE_WARM_TOP_QUERIES]:
+        for length in range(1, min(len(query), WARM_PREFIX_LENGTH) + 1):
+            prefixes.setdefault(query[:length])
+    return list(prefixes)
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PrefixCache(
+                    max_entries=settings.SEARCH_CACHE_MAX_ENTRIES,
+                    ttl=settings.SEARCH_CACHE_TTL,
+                    candidate_limit=settings.SEARCH_CACHE_CANDIDATE_LIMIT,
+                )
+    return _cache
+
+
+def _warm(cache):
+    try:
+        cache.warm(popular_prefixes())
+    finally:
+        connection.close()
+
+
+def _maybe_warm(cache):
+    """Refresh popular prefixes in the background once per warm interval"""
+    global _warmed_at
+    now = time.monotonic()
+    if _warmed_at is not None and now - _warmed_at < settings.SEARCH_CACHE_WARM_INTERVAL:
+        return
+    with _cache_lock:
+        if _warmed_at is not None and now - _warmed_at < settings.SEARCH_CACHE_WARM_INTERVAL:
+            return
+        _warmed_at = now
+    threading.Thread(target=_warm, args=(cache,), daemon=True).start()
+
+
+def search_books(query, limit=RESULT_LIMIT):
+    """In-stock books whose title or author contains ``query``"""
+    query = normalize_query(query)
+    if not query:
+        return []
+    if not settings.SEARCH_CACHE_ENABLED:
+        return _matches(query, limit)
+    cache = get_cache()
+    _maybe_warm(cache)
+    return cache.search(query, limit)
@@ -0,0 +1,174 @@
+"""
+Search telemetry.
+
+``record`` only appends to an in-memory buffer; a background thread
+writes the buffer to ``SearchQueryLog`` in bulk inserts every
+``SEARCH_LOG_FLUSH_INTERVAL`` seconds, so logging adds no database work
+to the search request. When the buffer is full new entries are dropped
+and counted rather than blocking. The ``aggregate_search_logs`` command
+folds the raw log into ``SearchQueryStat`` for reporting and for warming
+the search prefix cache.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import SearchQueryLog, SearchQueryStat, Watermark
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'search_stats'
+BATCH_SIZE = 500
+
+
+class SearchLogBuffer:
+    """Bounded in-memory buffer drained by a background writer thread"""
+
+    def __init__(self, max_size, flush_interval):
+        self.flush_interval = flush_interval
+        self._entries = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def record(self, query, normalized, result_count, latency_ms):
+        entry = (query, normalized, result_count, latency_ms, timezone.now())
+        with self._lock:
+            if len(self._entries) == self._entries.maxlen:
+                self.dropped += 1
+                return
+            self._entries.append(entry)
+            if self._thread is None:
+                self._start()
+        if len(self._entries) >= BATCH_SIZE:
+            self._wakeup.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='search-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write search logs')
+            finally:
+                connection.close()
+
+    def _drain(self):
+        with self._lock:
+            entries = list(self._entries)
+            self._entries.clear()
+        return entries
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        entries = self._drain()
+        if entries:
+            SearchQueryLog.objects.bulk_create(
+                [
+                    SearchQueryLog(
+                        query=query[:200], normalized=normalized[:200], result_count=result_count,
+                        latency_ms=latency_ms, created_at=created_at
+                    )
+                    for query, normalized, result_count, latency_ms, created_at in entries
+                ],
+                batch_size=BATCH_SIZE,
+            )
+        return len(entries)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = SearchLogBuffer(settings.SEARCH_LOG_BUFFER_SIZE, settings.SEARCH_LOG_FLUSH_INTERVAL)
+    return _buffer
+
+
+def record(query, normalized, result_count, latency_ms):
+    """Queue one search for logging"""
+    if settings.SEARCH_LOG_ENABLED:
+        get_buffer().record(query, normalized, result_count, latency_ms)
+
+
+def aggregate(lag=timedelta(minutes=1)):
+    """
+    Fold search logs written since the watermark into ``SearchQueryStat``.
+
+    Logs younger than ``lag`` are left for the next run, since buffered
+    entries reach the table some seconds after they were recorded.
+    Returns a ``(logs, queries)`` tuple of processed logs and touched stats.
+    """
+    with transaction.atomic():
+        watermark, created = Watermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        until = timezone.now() - lag
+        if watermark.value and watermark.value >= until:
+            return 0, 0
+
+        logs = SearchQueryLog.objects.filter(created_at__lte=until)
+        if watermark.value:
+            logs = logs.filter(created_at__gt=watermark.value)
+
+        totals = {}
+        log_count = 0
+        for normalized, result_count, latency_ms, created_at in (
+            logs.order_by('created_at')
+            .values_list('normalized', 'result_count', 'latency_ms', 'created_at')
+            .iterator(chunk_size=2000)
+        ):
+            log_count += 1
+            searches, zero, latency, last_count, last_at = totals.get(normalized, (0, 0, 0.0, 0, None))
+            totals[normalized] = (
+                searches + 1, zero + (result_count == 0), latency + latency_ms, result_count, created_at
+            )
+
+        normalized_queries = list(totals)
+        for i in range(0, len(normalized_queries), BATCH_SIZE):
+            chunk = normalized_queries[i:i + BATCH_SIZE]
+            existing = SearchQueryStat.objects.in_bulk(chunk, field_name='normalized')
+            rows = []
+            for normalized in chunk:
+                searches, zero, latency, last_count, last_at = totals[normalized]
+                row = existing.get(normalized) or SearchQueryStat(normalized=normalized)
+                row.searches += searches
+                row.zero_result_searches += zero
+                row.total_latency_ms += latency
+                row.last_result_count = last_count
+                row.last_searched_at = last_at
+                rows.append(row)
+            SearchQueryStat.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['normalized'],
+                update_fields=['searches', 'zero_result_searches', 'total_latency_ms', 'last_result_count', 'last_searched_at'],
+            )
+
+        watermark.value = until
+        watermark.save(update_fields=['value', 'updated_at'])
+    return log_count, len(totals)
+
+
+def top_queries(limit=20):
+    return SearchQueryStat.objects.order_by('-searches')[:limit]
+
+
+def zero_result_queries(limit=20):
+    """Most frequent queries whose latest search found nothing"""
+    return SearchQueryStat.objects.filter(last_result_count=0).order_by('-zero_result_searches')[:limit]
@@ -2,8 +2,11 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils import timezone
-from .models import User, Author, Book, Order, OrderItem, WILAYA_CHOICES, ORDER_STATUS_CHOICES
+from .models import User, Author, Book, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, AccountDeletion, WILAYA_CHOICES, ORDER_STATUS_CHOICES
+from .recommendations import related_books
+from .stock import adjust_stock, InsufficientStock
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     """Serializer for user registration"""
@@ -49,6 +52,10 @@ class UserLoginSerializer(serializers.Serializer):
         
         return attrs
 
+class TokenRefreshSerializer(serializers.Serializer):
+    """Serializer for exchanging a refresh token"""
+    refresh_token = serializers.CharField()
+
 class UserProfileSerializer(serializers.ModelSerializer):
     """Serializer for user profile"""
     class Meta:
@@ -83,41 +90,73 @@ class ChangePasswordSerializer(serializers.Serializer):
             raise serializers.ValidationError("Current password is incorrect")
         return value
 
+class AccountDeletionSerializer(serializers.ModelSerializer):
+    """Serializer for the status of an account deletion job"""
+    class Meta:
+        model = AccountDeletion
+        fields = ['id', 'status', 'orders_anonymized', 'requested_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
 class AuthorSerializer(serializers.ModelSerializer):
     """Serializer for Author model"""
     class Meta:
         model = Author
         fields = ['id', 'name', 'biography']
 
+class BookListSerializer(serializers.ModelSerializer):
+    """Simplified serializer for book listing"""
+    author = AuthorSerializer(read_only=True)
+    
+    class Meta:
+        model = Book
+        fields = ['id', 'name', 'cover_image', 'author', 'publisher', 'price', 'category', 'available', 'stock']
+
 class BookSerializer(serializers.ModelSerializer):
     """Serializer for Book model"""
     author = AuthorSerializer(read_only=True)
     author_id = serializers.IntegerField(write_only=True)
+    related_books = serializers.SerializerMethodField()
     
     class Meta:
         model = Book
         fields = ['id', 'name', 'cover_image', 'description', 'author', 'author_id', 
                  'publisher', 'price', 'publishing_date', 'category', 'available', 'stock', 
-                 'created_at', 'updated_at']
+                 'created_at', 'updated_at', 'related_books']
         read_only_fields = ['created_at', 'updated_at']
-
-class BookListSerializer(serializers.ModelSerializer):
-    """Simplified serializer for book listing"""
-    author = AuthorSerializer(read_only=True)
     
-    class Meta:
-        model = Book
-        fields = ['id', 'name', 'cover_image', 'author', 'publisher', 'price', 'category', 'available', 'stock']
+    def get_related_books(self, obj):
+        """Customers who bought this book also bought"""
+        return BookListSerializer(related_books(obj.id), many=True, context=self.context).data
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    """Serializer for OrderItem model"""
-    book = BookListSerializer(read_only=True)
+    """Serializer for OrderItem model; the book shows what was bought, from the snapshot taken at checkout"""
+    book = serializers.SerializerMethodField()
     book_id = serializers.IntegerField(write_only=True)
     
     class Meta:
         model = OrderItem
         fields = ['id', 'book', 'book_id', 'quantity', 'unit_price', 'subtotal']
         read_only_fields = ['unit_price', 'subtotal']
+    
+    def get_book(self, obj):
+        # The BookList shape clients know, filled from the snapshot alone so
+        # rendering an order never reads the books table; what the snapshot
+        # does not keep (author id, publisher, category, stock) is null
+        cover_url = obj.cover_url or None
+        request = self.context.get('request')
+        if cover_url and request is not None:
+            cover_url = request.build_absolute_uri(cover_url)
+        return {
+            'id': obj.book_id,
+            'name': obj.book_name,
+            'cover_image': cover_url,
+            'author': {'id': None, 'name': obj.author_name, 'biography': None},
+            'publisher': None,
+            'price': self.fields['unit_price'].to_representation(obj.unit_price),
+            'category': None,
+            'available': None,
+            'stock': None,
+        }
 
 class OrderSerializer(serializers.ModelSerializer):
     """Serializer for Order model"""
@@ -133,6 +172,18 @@ class OrderSerializer(serializers.ModelSerializer):
                  'total_price', 'created_at', 'updated_at', 'items']
         read_only_fields = ['id', 'total_price', 'created_at', 'updated_at']
 
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+    """Serializer for ArchivedOrderItem model"""
+    class Meta(OrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+class ArchivedOrderSerializer(OrderSerializer):
+    """Serializer for ArchivedOrder model, rendered like a live order"""
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+    
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
 class OrderCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating orders"""
     items = OrderItemSerializer(many=True)
@@ -146,45 +197,73 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         items_data = validated_data.pop('items')
         user = self.context['request'].user if self.context['request'].user.is_authenticated else None
         
-        # Calculate total price
-        total_price = sum(item['quantity'] * item['unit_price'] for item in items_data)
+        # Prices always come from the catalog, never from the client
+        books = Book.objects.select_related('author').in_bulk([item['book_id'] for item in items_data])
+        missing = [item['book_id'] for item in items_data if item['book_id'] not in books]
+        if missing:
+            raise serializers.ValidationError(f"Book with id {missing[0]} not found")
         
-        # Create order
-        order = Order.objects.create(
-            user=user,
-            total_price=total_price,
-            **validated_data
-        )
+        items = [
+            OrderItem(
+                book_id=item['book_id'],
+                quantity=item['quantity'],
+                unit_price=books[item['book_id']].price,
+                subtotal=item['quantity'] * books[item['book_id']].price
+            )
+            for item in items_data
+        ]
+        for item in items:
+            item.take_snapshot(books[item.book_id])
         
-        # Create order items and update book stock
-        for item_data in items_data:
-            book = Book.objects.get(id=item_data['book_id'])
-            if book.stock < item_data['quantity']:
-                raise serializers.ValidationError(f"Insufficient stock for {book.name}")
-            
-            OrderItem.objects.create(
-                order=order,
-                book=book,
-                quantity=item_data['quantity'],
-                unit_price=item_data['unit_price']
+        with transaction.atomic():
+            order = Order.objects.create(
+                user=user,
+                total_price=sum(item.subtotal for item in items),
+                **validated_data
             )
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
             
-            # Update book stock
-            book.stock -= item_data['quantity']
-            book.save()
+            # Decrement stock and log the changes, rolling back on shortage
+            try:
+                adjust_stock({item.book_id: -item.quantity for item in items}, 'checkout')
+            except InsufficientStock as e:
+                raise serializers.ValidationError(f"Insufficient stock for {books[e.book_id].name}")
+            except Book.DoesNotExist as e:
+                raise serializers.ValidationError(str(e))
         
         return order
 
+class OrderBulkStatusSerializer(serializers.Serializer):
+    """Serializer for bulk order status transitions"""
+    order_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=1000)
+    status = serializers.ChoiceField(choices=ORDER_STATUS_CHOICES)
+
 class CartItemSerializer(serializers.Serializer):
     """Serializer for cart items"""
     book_id = serializers.IntegerField()
-    quantity = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, default=1)
     book_name = serializers.CharField(read_only=True)
     book_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     book_cover = serializers.CharField(read_only=True)
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     available_stock = serializers.IntegerField(read_only=True)
 
+class CartItemUpdateSerializer(CartItemSerializer):
+    """Serializer for cart quantity updates; a quantity of zero removes the line"""
+    quantity = serializers.IntegerField(min_value=0)
+
+class CartOperationSerializer(serializers.Serializer):
+    """Serializer for one operation of a batch cart update"""
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    book_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+class CartBatchSerializer(serializers.Serializer):
+    """Serializer for batch cart updates"""
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
 class CartSerializer(serializers.Serializer):
     """Serializer for shopping cart"""
     items = CartItemSerializer(many=True)
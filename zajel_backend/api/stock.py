@@ -0,0 +1,114 @@
+"""
+Set-based stock updates.
+
+All stock movements go through ``adjust_stock`` so that every change is
+written to the ``StockChange`` log in the same transaction. The log id
+doubles as the cursor of the stock change feed.
+
+Availability follows stock in the same UPDATE: a book that sells out
+becomes unavailable and is flagged ``sold_out``, and restocking it makes
+it available again. Books hidden by staff are left alone.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import Book, StockChange
+
+
+class InsufficientStock(Exception):
+    """Raised when a decrement would take a book's stock below zero"""
+
+    def __init__(self, book_id):
+        super().__init__(f'Insufficient stock for book {book_id}')
+        self.book_id = book_id
+
+
+def adjust_stock(deltas, reason):
+    """
+    Apply ``{book_id: delta}`` with one guarded F() update per book.
+
+    Books are updated in id order to keep lock ordering stable between
+    concurrent checkouts. Raises ``InsufficientStock`` when a decrement
+    cannot be satisfied and ``Book.DoesNotExist`` for a missing book, and
+    rolls back either way.
+    """
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if not deltas:
+        return []
+
+    with transaction.atomic():
+        for book_id in sorted(deltas):
+            delta = deltas[book_id]
+            books = Book.objects.filter(id=book_id)
+            # SET expressions see the old row, so ``stock`` below is the
+            # stock before this change
+            if delta < 0:
+                books = books.filter(stock__gte=-delta)
+                available = Case(When(stock=-delta, then=Value(False)), default=F('available'))
+                sold_out = Case(When(stock=-delta, then=F('available')), default=Value(False))
+            else:
+                available = Case(When(stock__lte=0, sold_out=True, then=Value(True)), default=F('available'))
+                sold_out = Value(False)
+            if not books.update(stock=F('stock') + delta, available=available, sold_out=sold_out, updated_at=timezone.now()):
+                if delta > 0 or not Book.objects.filter(id=book_id).exists():
+                    raise Book.DoesNotExist(f'Book {book_id} does not exist')
+                raise InsufficientStock(book_id)
+
+        current = Book.objects.filter(id__in=deltas).values_list('id', 'stock', 'available')
+        return StockChange.objects.bulk_create([
+            StockChange(book_id=book_id, delta=deltas[book_id], stock_after=stock, available=available, reason=reason)
+            for book_id, stock, available in current
+        ])
+
+
+def changes_since(cursor, limit=100):
+    """Stock changes after ``cursor``, oldest first"""
+    changes = StockChange.objects.filter(id__gt=cursor).order_by('id')[:limit]
+    return [
+        {
+            'id': change.id,
+            'book_id': change.book_id,
+            'delta': change.delta,
+            'stock': change.stock_after,
+            'available': change.available,
+            'reason': change.reason,
+            'created_at': change.created_at,
+        }
+        for change in changes
+    ]
+
+
+def latest_cursor():
+    """Id of the newest stock change, or 0"""
+    return StockChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def low_stock_changes(cursor, threshold=None):
+    """
+    Books whose stock dropped to or below ``threshold`` after ``cursor``.
+
+    Only the change that crossed the threshold is reported, so a book that
+    keeps selling while already low does not alert again. Returns a
+    ``{book_id: stock}`` dict of books to alert on and the new cursor.
+    """
+    if threshold is None:
+        threshold = settings.LOW_STOCK_THRESHOLD
+
+    alerts = {}
+    new_cursor = cursor
+    changes = (
+        StockChange.objects.filter(id__gt=cursor)
+        .order_by('id')
+        .values_list('id', 'book_id', 'delta', 'stock_after')
+        .iterator(chunk_size=2000)
+    )
+    for change_id, book_id, delta, stock_after in changes:
+        new_cursor = change_id
+        stock_before = stock_after - delta
+        if stock_after <= threshold < stock_before:
+            alerts[book_id] = stock_after
+        elif stock_after > threshold:
+            alerts.pop(book_id, None)
+    return alerts, new_cursor
@@ -0,0 +1,51 @@
+"""
+Static files storage with hashed names and precompressed variants.
+
+``collectstatic`` writes ``app.3f9a0c1d2e4b.css`` next to ``app.css`` (as
+ManifestStaticFilesStorage does) plus ``app.3f9a0c1d2e4b.css.gz`` and,
+with the optional ``brotli`` package, ``.br``. The front web server
+serves the variants directly (nginx ``gzip_static`` / ``brotli_static``),
+so nothing is compressed per request.
+"""
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+from .compression import brotli, brotli_compress, gzip_compress
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf'}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            if os.path.splitext(hashed_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self._write_variants(hashed_name)
+
+    def _write_variants(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        if len(content) < settings.STATIC_PRECOMPRESS_MIN_SIZE:
+            return
+
+        # Built once, so use the strongest settings
+        variants = {'.gz': gzip_compress(content, level=9)}
+        if brotli is not None:
+            variants['.br'] = brotli_compress(content, quality=11)
+
+        for suffix, compressed in variants.items():
+            if len(compressed) >= len(content):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
@@ -0,0 +1,84 @@
+"""
+Tasks run by the background job queue (api.jobs).
+
+Payloads are JSON, so tasks take ids rather than model instances and load
+what they need themselves. A task may run more than once (after a retry
+or a worker crash), so each one does a single thing that is safe to
+repeat: the two order emails are separate tasks so a failure of one does
+not resend the other.
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+from django.core.management import call_command
+
+from . import accounts
+from .jobs import task
+from .models import Order
+
+
+@task()
+def send_order_notification(order_id):
+    """Tell the shop about a new order"""
+    order = Order.objects.prefetch_related('items').get(id=order_id)
+    message = f"""
+        New order received:
+
+        Order ID: {order.id}
+        Customer: {order.full_name}
+        Email: {order.email}
+        Phone: {order.phone_number}
+        Address: {order.address}
+        Wilaya: {order.get_wilaya_display()}
+        Postal Code: {order.postal_code}
+        Total: ${order.total_price}
+
+        Items:
+        """
+    for item in order.items.all():
+        message += f"- {item.book_name} x{item.quantity} = ${item.subtotal}\n"
+
+    send_mail(f'Order Confirmation - {order.id}', message, settings.DEFAULT_FROM_EMAIL, [settings.ADMIN_EMAIL])
+
+
+@task()
+def send_order_confirmation(order_id):
+    """Confirm an order to the customer"""
+    order = Order.objects.get(id=order_id)
+    message = f"""
+            Thank you for your order!
+
+            Order ID: {order.id}
+            Total: ${order.total_price}
+
+            We will process your order and contact you soon.
+            """
+    send_mail('Order Confirmation - Zajil Books', message, settings.DEFAULT_FROM_EMAIL, [order.email])
+
+
+@task()
+def delete_account(job_id):
+    accounts.run_deletion(job_id)
+
+
+# Batch commands that can be queued (e.g. from cron with enqueue_job)
+# instead of run inline; the payload holds the command's options, and
+# positional arguments as ``args``
+COMMAND_TASKS = [
+    'rollup_sales',
+    'build_recommendations',
+    'aggregate_search_logs',
+    'archive_orders',
+    'hash_cover_names',
+    'send_low_stock_alerts',
+    'sweep_expired',
+]
+
+
+def command_task(name):
+    def run_command(args=(), **options):
+        call_command(name, *args, **options)
+    return run_command
+
+
+for name in COMMAND_TASKS:
+    task(name)(command_task(name))
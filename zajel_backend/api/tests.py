@@ -1,3 +1,1304 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import test
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import analytics, archive, catalog, compression, fuzzy, jobs, load_data, media, orders, recommendations, search, search_log, stock, throttling, tokens
+from .management.commands.profile_startup import parse_importtime
+from .query_inspector import inspect_queries
+from .models import (
+    User, Author, Book, CartItem, CoPurchaseCount, Job, AccountDeletion, Order, OrderItem, ArchivedOrder,
+    ArchivedOrderItem, StockChange, SearchQueryLog, SearchQueryStat, Watermark, IdempotencyKey, RefreshToken,
+)
+
+
+# The search log writer is a background thread; SearchLogTests turn it back on
+@override_settings(QUERY_INSPECTOR_ENABLED=True, QUERY_INSPECTOR_STRICT=True, SEARCH_LOG_ENABLED=False)
+class APITestCase(test.APITestCase):
+    """Test case whose requests fail on an N+1 (see api.query_inspector)"""
+
+    def setUp(self):
+        # Rate limit buckets live in the process, so start every test with fresh ones
+        throttling.get_store().clear()
+
+
+def create_user(email='reader@example.com', password='correct-horse-9'):
+    return User.objects.create_user(
+        email=email, password=password, full_name='Reader', wilaya='16',
+        address='1 Rue Didouche', postal_code='16000', phone_number='0555000000'
+    )
+
+
+def create_staff():
+    return User.objects.create_superuser(
+        email='staff@example.com', password='correct-horse-9', full_name='Staff', wilaya='16',
+        address='1 Rue Didouche', postal_code='16000', phone_number='0555000001'
+    )
+
+
+def create_book(stock=10, price='12.50', name='Book', author='Author'):
+    author = Author.objects.create(name=author)
+    return Book.objects.create(
+        name=name, description='', author=author, publisher='Publisher',
+        price=Decimal(price), publishing_date=date(2020, 1, 1), stock=stock
+    )
+
+
+def create_order(user, books=()):
+    order = Order.objects.create(
+        user=user, full_name='Reader', email=user.email, phone_number='0555000000',
+        address='1 Rue Didouche', wilaya='16', postal_code='16000', total_price=Decimal('10.00')
+    )
+    for book in books:
+        OrderItem.objects.create(order=order, book=book, quantity=1, unit_price=book.price)
+    return order
+
+
+CHECKOUT = {
+    'full_name': 'Reader', 'email': 'reader@example.com', 'phone_number': '0555000000',
+    'address': '1 Rue Didouche', 'wilaya': '16', 'postal_code': '16000',
+}
+
+
+def bearer_client(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens.issue_tokens(user)['token']}")
+    return client
+
+
+class AccountDeletionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+
+    def test_delete_with_access_token_queues_the_deletion(self):
+        client = bearer_client(self.user)
+        response = client.delete(reverse('delete-account'))
+
+        self.assertEqual(response.status_code, 202)
+        job = AccountDeletion.objects.get(account_id=self.user.pk)
+        self.assertEqual(Job.objects.filter(task='delete_account', payload={'job_id': str(job.pk)}).count(), 1)
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+        # The access token was revoked with the account
+        self.assertEqual(client.get(reverse('user-profile')).status_code, 401)
+
+    def test_delete_with_session_logs_out(self):
+        client = APIClient()
+        client.force_login(self.user)
+        response = client.delete(reverse('delete-account'))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Job.objects.filter(task='delete_account').count(), 1)
+        self.assertNotIn('_auth_user_id', client.session)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = bearer_client(self.user)
+        self.order = create_order(self.user)
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_resources_are_not_modified(self):
+        for url in [reverse('order-list'), reverse('order-detail', args=[self.order.id]), reverse('user-profile')]:
+            with self.subTest(url=url):
+                response = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+    def test_order_items_keep_the_book_list_shape(self):
+        book = create_book(stock=5)
+        OrderItem.objects.create(order=self.order, book=book, quantity=1, unit_price=book.price)
+        Book.objects.filter(pk=book.pk).update(name='Renamed', price=Decimal('99.00'))
+
+        item = self.client.get(reverse('order-detail', args=[self.order.id])).json()['items'][0]
+        self.assertEqual(
+            set(item['book']),
+            {'id', 'name', 'cover_image', 'author', 'publisher', 'price', 'category', 'available', 'stock'}
+        )
+        # Only the snapshot taken at checkout is shown
+        self.assertEqual(
+            (item['book']['id'], item['book']['name'], item['book']['author']['name'], item['book']['price']),
+            (book.id, 'Book', 'Author', '12.50'),
+        )
+        self.assertIsNone(item['book']['stock'])
+
+    def test_book_change_keeps_order_etags(self):
+        book = create_book(stock=5)
+        OrderItem.objects.create(order=self.order, book=book, quantity=1, unit_price=book.price)
+        stock.adjust_stock({book.id: -1}, reason='checkout')
+        Book.objects.filter(pk=book.pk).update(name='Renamed', updated_at=timezone.now())
+        for url in [reverse('order-list'), reverse('order-detail', args=[self.order.id])]:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_order_change_invalidates_order_etags(self):
+        urls = [reverse('order-list'), reverse('order-detail', args=[self.order.id])]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        orders.transition_orders([self.order.id], 'processing')
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_missing_order_is_not_found_before_revalidation(self):
+        other = create_order(create_user('other@example.com'))
+        for order_id in [other.id, '00000000-0000-4000-8000-000000000000']:
+            with self.subTest(order_id=order_id):
+                response = self.client.get(reverse('order-detail', args=[order_id]), HTTP_IF_NONE_MATCH='*')
+                self.assertEqual(response.status_code, 404)
+
+    def test_revalidation_does_not_load_the_user(self):
+        url = reverse('order-detail', args=[self.order.id])
+        etag = self.client.get(url)['ETag']
+        tokens.denylist.refresh()  # so its periodic reload does not land in the measured request
+        with inspect_queries() as inspector:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(len(inspector.queries), 1, inspector.describe(url))
+
+    def test_profile_change_invalidates_the_profile_etag(self):
+        User.objects.filter(pk=self.user.pk).update(last_profile_update=timezone.now() - timedelta(days=8))
+        url = reverse('user-profile')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.put(url, {'full_name': 'New Name'}, format='json').status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['full_name'], 'New Name')
+
+
+class CartMergeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.book = create_book(stock=3)
+        CartItem.objects.create(user=self.user, book=self.book, quantity=2)
+
+    def test_login_merge_is_capped_at_stock(self):
+        client = APIClient()
+        self.assertEqual(client.post(reverse('cart'), {'book_id': self.book.id, 'quantity': 2}, format='json').status_code, 200)
+        response = client.post(reverse('user-login'), {'email': self.user.email, 'password': 'correct-horse-9'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        cart = client.get(reverse('cart')).json()
+        self.assertEqual([(item['book_id'], item['quantity']) for item in cart['items']], [(self.book.id, 3)])
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+
+    def test_login_merge_skips_books_that_are_gone_or_sold_out(self):
+        client = APIClient()
+        gone, sold_out = create_book(stock=2), create_book(stock=2)
+        for book in (self.book, gone, sold_out):
+            client.post(reverse('cart'), {'book_id': book.id, 'quantity': 1}, format='json')
+        gone.delete()
+        Book.objects.filter(pk=sold_out.pk).update(stock=0, available=False)
+
+        response = client.post(reverse('user-login'), {'email': self.user.email, 'password': 'correct-horse-9'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(CartItem.objects.filter(user=self.user).values_list('book_id', 'quantity')), [(self.book.id, 3)])
+
+    def test_invalid_quantities_are_refused(self):
+        client = bearer_client(self.user)
+        for method, quantity in [('post', 'two'), ('post', -1), ('post', 0), ('put', -1), ('put', 'two')]:
+            with self.subTest(method=method, quantity=quantity):
+                response = getattr(client, method)(reverse('cart'), {'book_id': self.book.id, 'quantity': quantity}, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 2)
+
+        self.assertEqual(client.put(reverse('cart'), {'book_id': self.book.id, 'quantity': 0}, format='json').status_code, 200)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_lines_lower_quantities_above_stock(self):
+        Book.objects.filter(pk=self.book.pk).update(stock=1)
+        cart = bearer_client(self.user).get(reverse('cart')).json()
+        self.assertEqual([item['quantity'] for item in cart['items']], [1])
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 1)
+
+
+class AdminStockTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(create_staff())
+
+    def edit_stock(self, book, stock, available=False):
+        data = {
+            'name': book.name, 'author': book.author_id, 'publisher': book.publisher, 'description': 'About',
+            'price': book.price, 'stock': stock, 'publishing_date': book.publishing_date,
+        }
+        if available:
+            data['available'] = 'on'
+        return self.client.post(reverse('admin:api_book_change', args=[book.pk]), data)
+
+    def test_restocking_a_sold_out_book_makes_it_available(self):
+        book = create_book(stock=0)
+        self.assertFalse(book.available)
+        self.assertEqual(self.edit_stock(book, 5).status_code, 302)
+
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.available), (5, True))
+        change = StockChange.objects.get(book=book)
+        self.assertEqual((change.delta, change.stock_after, change.available), (5, 5, True))
+
+    def test_delta_is_taken_from_the_current_stock(self):
+        book = create_book(stock=10)
+        Book.objects.filter(pk=book.pk).update(stock=7)  # sold meanwhile
+        self.assertEqual(self.edit_stock(book, 12, available=True).status_code, 302)
+
+        book.refresh_from_db()
+        self.assertEqual(book.stock, 12)
+        self.assertEqual(StockChange.objects.get(book=book).delta, 5)
+
+
+class RecommendationTests(APITestCase):
+    def test_canceled_orders_are_subtracted_from_pair_counts(self):
+        user = create_user()
+        books = [create_book(), create_book()]
+        first, second = create_order(user, books), create_order(user, books)
+        recommendations.build_index(lag=timedelta(0))
+        self.assertEqual(CoPurchaseCount.objects.get(book=books[0], other=books[1]).count, 2)
+
+        orders.transition_orders([first.id], 'canceled')
+        self.assertEqual(CoPurchaseCount.objects.get(book=books[0], other=books[1]).count, 1)
+        self.assertEqual([book.id for book in recommendations.related_books(books[0].id)], [books[1].id])
+
+        orders.transition_orders([second.id], 'canceled')
+        self.assertFalse(CoPurchaseCount.objects.exists())
+        self.assertEqual(recommendations.related_books(books[0].id), [])
+
+
+
+class QueryBudgetTests(APITestCase):
+    """Query counts of the hot endpoints; the suite also fails on any N+1 (QUERY_INSPECTOR_STRICT)"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = bearer_client(self.user)
+        self.books = [create_book() for _ in range(6)]
+        for book in self.books:
+            CartItem.objects.create(user=self.user, book=book, quantity=1)
+        self.orders = [create_order(self.user, self.books) for _ in range(6)]
+        # Reload the per-process token denylist now, so its periodic reload
+        # does not land in a measured request
+        tokens.denylist.refresh()
+
+    def assertQueries(self, budget, method, url, **kwargs):
+        with inspect_queries() as inspector:
+            response = getattr(self.client, method)(url, format='json', **kwargs)
+        self.assertLess(response.status_code, 300)
+        self.assertLessEqual(len(inspector.queries), budget, inspector.describe(url))
+        return response
+
+    def test_read_endpoints(self):
+        budgets = [
+            (4, reverse('order-list')),
+            (3, reverse('order-detail', args=[self.orders[0].id])),
+            (1, reverse('cart')),
+            (2, reverse('book-list')),
+            (2, reverse('book-detail', args=[self.books[0].id])),
+            (1, reverse('user-profile')),
+        ]
+        for budget, url in budgets:
+            with self.subTest(url=url):
+                self.assertQueries(budget, 'get', url)
+
+    def test_order_list_does_not_grow_with_orders(self):
+        url = reverse('order-list')
+        with inspect_queries() as inspector:
+            self.client.get(url)
+        self.orders += [create_order(self.user, self.books) for _ in range(6)]
+        self.assertQueries(len(inspector.queries), 'get', url)
+
+    def test_checkout(self):
+        # Besides the one guarded UPDATE per book (see stock.adjust_stock)
+        self.assertQueries(16 + len(self.books), 'post', reverse('checkout'), data=CHECKOUT)
+
+
+class SalesStatsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(create_staff())
+        self.user = create_user()
+        self.books = [create_book(price=price) for price in ('10.00', '20.00', '30.00')]
+        self.today = timezone.now().date()
+        yesterday = create_order(self.user, self.books)
+        Order.objects.filter(pk=yesterday.pk).update(created_at=timezone.now() - timedelta(days=1))
+        create_order(self.user, self.books[:2])
+        analytics.rollup_new_orders(lag=timedelta(0))
+
+    def stats(self, **params):
+        params.setdefault('start', self.today - timedelta(days=6))
+        params.setdefault('end', self.today)
+        return self.client.get(reverse('admin-stats'), params)
+
+    def keys(self, response):
+        return [(row.get('date'), row['key']) for row in response.json()['results']]
+
+    def test_totals_and_top_keys(self):
+        response = self.stats(dimension='book', limit=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['totals'], {'orders': 2, 'items': 5, 'revenue': 90})
+        self.assertEqual(self.keys(response), [(None, str(self.books[1].id)), (None, str(self.books[2].id))])
+
+    def test_daily_results_are_limited_per_day(self):
+        response = self.stats(dimension='book', daily='1', limit=1)
+        self.assertEqual(self.keys(response), [
+            (str(self.today), str(self.books[1].id)),
+            (str(self.today - timedelta(days=1)), str(self.books[2].id)),
+        ])
+
+    def test_invalid_ranges_are_refused(self):
+        for params in [
+            {'start': self.today - timedelta(days=366)},
+            {'start': self.today + timedelta(days=1)},
+            {'limit': 'ten'},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.stats(**params).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.stats().status_code, 403)
+
+    def test_rollup_catches_up_from_the_watermark(self):
+        order = create_order(self.user, self.books[2:])
+        self.assertEqual(self.stats().json()['totals']['orders'], 2)
+
+        self.assertEqual(analytics.rollup_new_orders(lag=timedelta(0))[0], 1)
+        self.assertEqual(analytics.rollup_new_orders(lag=timedelta(0))[0], 0)
+        self.assertEqual(self.stats().json()['totals'], {'orders': 3, 'items': 6, 'revenue': 120})
+
+        orders.transition_orders([order.id], 'canceled')
+        self.assertEqual(self.stats().json()['totals'], {'orders': 2, 'items': 5, 'revenue': 90})
+
+
+class BulkStatusTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(create_staff())
+        self.user = create_user()
+        self.book = create_book(stock=10)
+        self.orders = [create_order(self.user, [self.book]) for _ in range(3)]
+
+    def statuses(self):
+        return sorted(Order.objects.values_list('status', flat=True))
+
+    def bulk_status(self, orders, new_status):
+        data = {'order_ids': [str(order.id) for order in orders], 'status': new_status}
+        return self.client.post(reverse('admin-order-bulk-status'), data, format='json')
+
+    def test_moves_every_order(self):
+        response = self.bulk_status(self.orders, 'processing')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(self.statuses(), ['processing'] * 3)
+
+    def test_rejects_the_whole_batch_on_one_invalid_order(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(status='completed')
+        response = self.bulk_status(self.orders, 'canceled')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['order_ids'], [str(self.orders[0].id)])
+        self.assertEqual(self.statuses(), ['completed', 'pending', 'pending'])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 10)
+
+    def test_unknown_status_is_refused(self):
+        self.assertEqual(self.bulk_status(self.orders, 'shipped').status_code, 400)
+        self.assertEqual(self.statuses(), ['pending'] * 3)
+
+    def test_single_order_status(self):
+        url = reverse('admin-order-set-status', args=[self.orders[0].id])
+        self.assertEqual(self.client.post(url, {'status': 'canceled'}, format='json').status_code, 200)
+        self.assertEqual(self.client.post(url, {'status': 'processing'}, format='json').status_code, 400)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 11)
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.bulk_status(self.orders, 'processing').status_code, 403)
+
+    def test_admin_action_skips_orders_that_cannot_move(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(status='completed')
+        response = self.client.post(reverse('admin:api_order_changelist'), {
+            'action': 'mark_canceled', '_selected_action': [str(order.id) for order in self.orders],
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.statuses(), ['canceled', 'canceled', 'completed'])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 12)
+
+
+class StockFeedTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = [create_book(stock=10), create_book(stock=10)]
+        stock.adjust_stock({self.books[0].id: -2, self.books[1].id: -9}, reason='checkout')
+        stock.adjust_stock({self.books[0].id: -1}, reason='checkout')
+
+    def test_feed_pages_from_the_cursor(self):
+        url = reverse('stock-changes')
+        first = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual(sorted(change['stock'] for change in first['changes']), [1, 8])
+
+        rest = self.client.get(url, {'since': first['cursor'], 'limit': -5}).json()
+        self.assertEqual([(change['book_id'], change['stock']) for change in rest['changes']], [(self.books[0].id, 7)])
+        self.assertEqual(self.client.get(url, {'since': rest['cursor']}).json(), {'cursor': rest['cursor'], 'changes': []})
+        self.assertEqual(self.client.get(url, {'limit': 'all'}).status_code, 400)
+
+    def test_stream_needs_asgi(self):
+        self.assertEqual(self.client.get(reverse('stock-stream')).status_code, 501)
+
+    @override_settings(STOCK_STREAM_MAX_EVENTS=2)
+    async def test_stream_is_bounded(self):
+        response = await self.async_client.get(reverse('stock-stream'), {'since': 0})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body.count('event: stock'), 2)
+        self.assertNotIn(f'id: {await sync_to_async(stock.latest_cursor)()}\n', body)
+
+    def test_low_stock_alert_is_sent_once(self):
+        call_command('send_low_stock_alerts', threshold=3, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('1 left', mail.outbox[0].body)
+
+        stock.adjust_stock({self.books[1].id: -1}, reason='checkout')
+        call_command('send_low_stock_alerts', threshold=3, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class StockTests(APITestCase):
+    def test_failed_decrement_rolls_back_the_whole_adjustment(self):
+        first, second = create_book(stock=5), create_book(stock=1)
+        with self.assertRaises(stock.InsufficientStock) as raised:
+            stock.adjust_stock({first.id: -2, second.id: -2}, reason='checkout')
+        self.assertEqual(raised.exception.book_id, second.id)
+
+        self.assertEqual(sorted(Book.objects.values_list('stock', flat=True)), [1, 5])
+        self.assertFalse(StockChange.objects.exists())
+
+    def test_selling_out_and_restocking_toggle_availability(self):
+        book = create_book(stock=2)
+        stock.adjust_stock({book.id: -2}, reason='checkout')
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.available), (0, False))
+
+        stock.adjust_stock({book.id: 3}, reason='adjustment')
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.available), (3, True))
+
+    def test_restocking_keeps_books_hidden_by_staff_hidden(self):
+        book = create_book(stock=2)
+        Book.objects.filter(pk=book.pk).update(available=False)
+        stock.adjust_stock({book.id: -2}, reason='checkout')
+        stock.adjust_stock({book.id: 3}, reason='adjustment')
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.available), (3, False))
+
+        hidden = create_book(stock=0)
+        Book.objects.filter(pk=hidden.pk).update(sold_out=False)  # hidden by staff, not by selling out
+        stock.adjust_stock({hidden.id: 1}, reason='adjustment')
+        hidden.refresh_from_db()
+        self.assertFalse(hidden.available)
+
+    def test_missing_book_is_not_reported_as_short(self):
+        book = create_book(stock=1)
+        for delta in (-1, 1):
+            with self.subTest(delta=delta), self.assertRaises(Book.DoesNotExist):
+                stock.adjust_stock({book.id: 1, book.id + 1: delta}, reason='adjustment')
+        book.refresh_from_db()
+        self.assertEqual(book.stock, 1)
+
+    def test_checkout_cannot_oversell(self):
+        book = create_book(stock=1)
+        user = create_user()
+        CartItem.objects.create(user=user, book=book, quantity=2)
+        response = bearer_client(user).post(reverse('checkout'), CHECKOUT, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        book.refresh_from_db()
+        self.assertEqual(book.stock, 1)
+
+    def test_canceling_an_order_restores_its_stock(self):
+        book = create_book(stock=3)
+        user = create_user()
+        CartItem.objects.create(user=user, book=book, quantity=2)
+        order_id = bearer_client(user).post(reverse('checkout'), CHECKOUT, format='json').json()['order_id']
+        book.refresh_from_db()
+        self.assertEqual(book.stock, 1)
+
+        orders.transition_orders([order_id], 'canceled')
+        book.refresh_from_db()
+        self.assertEqual(book.stock, 3)
+        self.assertEqual(list(StockChange.objects.filter(book=book).values_list('delta', flat=True).order_by('id')), [-2, 2])
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = bearer_client(self.user)
+        self.book = create_book(stock=5)
+        CartItem.objects.create(user=self.user, book=self.book, quantity=2)
+
+    def test_retried_checkout_is_replayed(self):
+        first = self.client.post(reverse('checkout'), CHECKOUT, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(first.status_code, 201)
+        CartItem.objects.create(user=self.user, book=self.book, quantity=1)
+
+        retry = self.client.post(reverse('checkout'), CHECKOUT, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['order_id'], first.json()['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 3)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.client.post(reverse('checkout'), CHECKOUT, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        other = dict(CHECKOUT, address='2 Rue Larbi Ben M\'hidi')
+        response = self.client.post(reverse('checkout'), other, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retried_cart_add_is_not_applied_twice(self):
+        data = {'book_id': self.book.id, 'quantity': 1}
+        for _ in range(2):
+            response = self.client.post(reverse('cart'), data, format='json', HTTP_IDEMPOTENCY_KEY='add-1')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+
+    def test_keys_are_scoped_to_the_user(self):
+        self.client.post(reverse('checkout'), CHECKOUT, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        other = create_user(email='other@example.com')
+        CartItem.objects.create(user=other, book=self.book, quantity=1)
+        response = bearer_client(other).post(reverse('checkout'), CHECKOUT, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class CartBatchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = [create_book(stock=5) for _ in range(3)]
+
+    def batch(self, client, *operations):
+        return client.post(reverse('cart-batch'), {'operations': list(operations)}, format='json')
+
+    def test_operations_apply_in_order(self):
+        for cart, client in [('session', APIClient()), ('database', bearer_client(create_user()))]:
+            with self.subTest(cart=cart):
+                self.batch(client, {'op': 'set', 'book_id': self.books[2].id, 'quantity': 1})
+                response = self.batch(
+                    client,
+                    {'op': 'add', 'book_id': self.books[0].id, 'quantity': 2},
+                    {'op': 'add', 'book_id': self.books[0].id},
+                    {'op': 'set', 'book_id': self.books[1].id, 'quantity': 4},
+                    {'op': 'remove', 'book_id': self.books[2].id},
+                )
+                self.assertEqual(response.status_code, 200)
+                cart = response.json()
+                self.assertEqual(
+                    sorted((item['book_id'], item['quantity']) for item in cart['items']),
+                    [(self.books[0].id, 3), (self.books[1].id, 4)]
+                )
+                self.assertEqual(cart['total_items'], 7)
+
+    def test_batch_is_all_or_nothing(self):
+        user = create_user()
+        client = bearer_client(user)
+        self.batch(client, {'op': 'add', 'book_id': self.books[0].id, 'quantity': 4})
+        response = self.batch(
+            client,
+            {'op': 'add', 'book_id': self.books[1].id},
+            {'op': 'add', 'book_id': self.books[0].id, 'quantity': 2},
+            {'op': 'add', 'book_id': 0},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['book_id'] for error in response.json()['errors']], [self.books[0].id, 0])
+        self.assertEqual(list(CartItem.objects.filter(user=user).values_list('book_id', 'quantity')), [(self.books[0].id, 4)])
+
+    def test_malformed_batches_are_refused(self):
+        client = APIClient()
+        for operations in [[], [{'op': 'clear', 'book_id': self.books[0].id}], [{'op': 'add', 'book_id': self.books[0].id, 'quantity': -1}]]:
+            with self.subTest(operations=operations):
+                self.assertEqual(self.batch(client, *operations).status_code, 400)
+
+
+class ThrottleTests(APITestCase):
+    def test_parse_rate(self):
+        self.assertEqual(throttling.parse_rate('60/min'), (60, 1.0))
+        self.assertEqual(throttling.parse_rate('10/s'), (10, 10.0))
+
+    def test_bucket_allows_bursts_then_refills_at_the_rate(self):
+        for store in (throttling.LocalBucketStore(), throttling.CacheBucketStore()):
+            with self.subTest(store=type(store).__name__):
+                waits = [store.take('search:ip:1', 3, 0.5, 100.0) for _ in range(4)]
+                self.assertEqual(waits, [0, 0, 0, 2.0])
+                self.assertEqual(store.take('search:ip:1', 3, 0.5, 101.0), 1.0)
+                self.assertEqual(store.take('search:ip:1', 3, 0.5, 102.0), 0)
+                self.assertEqual(store.take('search:ip:2', 3, 0.5, 102.0), 0)
+
+    def test_local_store_drops_the_least_recently_used_bucket(self):
+        store = throttling.LocalBucketStore(max_entries=2)
+        store.take('a', 1, 1.0, 0.0)
+        store.take('b', 1, 1.0, 0.0)
+        store.take('a', 1, 1.0, 0.0)
+        store.take('c', 1, 1.0, 0.0)
+        self.assertEqual(list(store._buckets), ['a', 'c'])
+        self.assertGreater(store.take('a', 1, 1.0, 0.0), 0)
+
+    def test_auth_endpoints_answer_429_with_retry_after(self):
+        capacity, refill_rate = throttling.get_rate('auth')
+        url = reverse('token-refresh')
+        for _ in range(capacity):
+            self.assertEqual(self.client.post(url, {'refresh_token': 'stale'}, format='json').status_code, 401)
+
+        response = self.client.post(url, {'refresh_token': 'stale'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response['Retry-After']), 1 / refill_rate + 1)
+        # Scopes are limited separately
+        self.assertEqual(self.client.post(reverse('checkout'), CHECKOUT, format='json').status_code, 400)
+
+    def test_users_have_their_own_buckets(self):
+        capacity, _ = throttling.get_rate('checkout')
+        client = bearer_client(create_user())
+        for _ in range(capacity):
+            client.post(reverse('checkout'), CHECKOUT, format='json')
+        self.assertEqual(client.post(reverse('checkout'), CHECKOUT, format='json').status_code, 429)
+
+        other = bearer_client(create_user(email='other@example.com'))
+        self.assertEqual(other.post(reverse('checkout'), CHECKOUT, format='json').status_code, 400)
+
+
+class PrefixCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = [
+            create_book(name='Nejma', author='Kateb Yacine'),
+            create_book(name='Nedjma Revisited', author='Assia Djebar'),
+            create_book(name='La Grande Maison', author='Mohammed Dib'),
+        ]
+        self.cache = search.PrefixCache(max_entries=3, ttl=60, candidate_limit=2)
+
+    def names(self, books):
+        return sorted(book.name for book in books)
+
+    def test_longer_queries_are_narrowed_from_a_cached_prefix(self):
+        self.assertEqual(self.names(self.cache.search('Ne')), ['Nedjma Revisited', 'Nejma'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(self.cache.search('ned')), ['Nedjma Revisited'])
+            self.assertEqual(self.names(self.cache.search('NE')), ['Nedjma Revisited', 'Nejma'])
+            # Author names match too, but not across the title and author
+            self.assertEqual(self.names(self.cache.search('nejma kateb')), [])
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 1))
+
+    def test_broad_prefixes_are_not_narrowed(self):
+        self.assertEqual(len(self.cache.search('a')), 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names(self.cache.search('ass')), ['Nedjma Revisited'])
+
+    def test_entries_expire_and_are_evicted(self):
+        self.cache.search('ne')
+        self.cache.search('la')
+        self.cache.search('dib')
+        self.cache.search('ne')
+        self.cache.search('zz')
+        self.assertEqual(list(self.cache._entries), ['dib', 'ne', 'zz'])
+
+        self.cache.ttl = 0
+        self.cache.search('ka')
+        with self.assertNumQueries(1):
+            self.cache.search('kat')
+
+    def test_warmed_prefixes_answer_without_queries(self):
+        self.cache.warm(['  Nej '])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(self.cache.search('nejm')), ['Nejma'])
+
+
+@override_settings(SEARCH_LOG_ENABLED=True, SEARCH_CACHE_ENABLED=False, SEARCH_FUZZY_ENABLED=False)
+class SearchLogTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # A writer that only runs when flushed by hand
+        self.buffer = search_log.SearchLogBuffer(max_size=4, flush_interval=3600)
+        patcher = mock.patch.object(search_log, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_searches_are_logged_without_writing_in_the_request(self):
+        create_book(name='Nedjma')
+        with inspect_queries() as inspector:
+            self.client.get(reverse('search'), {'q': '  Nedjma '})
+            self.client.get(reverse('search'), {'q': 'nothing'})
+        self.assertFalse([query for query in inspector.queries if 'searchquerylog' in query[1]])
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(
+            list(SearchQueryLog.objects.order_by('created_at').values_list('query', 'normalized', 'result_count')),
+            [('  Nedjma ', 'nedjma', 1), ('nothing', 'nothing', 0)]
+        )
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_full_buffer_drops_new_entries(self):
+        for i in range(6):
+            search_log.record(f'query {i}', f'query {i}', 1, 1.0)
+        self.assertEqual(self.buffer.dropped, 2)
+        self.assertEqual(self.buffer.flush(), 4)
+
+    def test_aggregate_folds_new_logs_into_stats(self):
+        for result_count in (2, 0, 0):
+            search_log.record('Nedjma', 'nedjma', result_count, 4.0)
+        search_log.record('Dib', 'dib', 1, 1.0)
+        self.buffer.flush()
+
+        output = StringIO()
+        call_command('aggregate_search_logs', lag=0, stdout=output)
+        self.assertIn('Aggregated 4 searches into 2 query stats', output.getvalue())
+        stat = SearchQueryStat.objects.get(normalized='nedjma')
+        self.assertEqual((stat.searches, stat.zero_result_searches, stat.last_result_count), (3, 2, 0))
+        self.assertEqual(stat.average_latency_ms, 4.0)
+        self.assertEqual([stat.normalized for stat in search_log.zero_result_queries()], ['nedjma'])
+
+        # Logs behind the watermark are not counted again
+        self.assertEqual(search_log.aggregate(lag=timedelta(0)), (0, 0))
+        search_log.record('Dib', 'dib', 3, 1.0)
+        self.buffer.flush()
+        self.assertEqual(search_log.aggregate(lag=timedelta(0)), (1, 1))
+        self.assertEqual(SearchQueryStat.objects.get(normalized='dib').searches, 2)
+
+
+@override_settings(SEARCH_CACHE_ENABLED=False)
+class FuzzySearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = create_book(name='Nedjma', author='Kateb Yacine')
+        self.arabic = create_book(name='اللص والكلاب', author='نجيب محفوظ')
+        # Index jobs run inline, and the process-wide index is restored afterwards
+        for patcher in [
+            mock.patch.object(fuzzy, '_index', None),
+            mock.patch.object(fuzzy, '_in_background', side_effect=lambda job, *args: job(*args)),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_typos_and_letter_variants_match(self):
+        fuzzy.build()
+        self.assertEqual(fuzzy.fuzzy_search('Nedjam'), [self.book])
+        self.assertEqual(fuzzy.fuzzy_search('محفوض'), [self.arabic])
+
+    def test_refresh_applies_catalog_changes(self):
+        fuzzy.build()
+        index = fuzzy._index
+        Book.objects.filter(pk=self.book.pk).update(name='La Grande Maison', updated_at=timezone.now())
+        added = create_book(name='Le Fleuve detourne', author='Rachid Mimouni')
+        fuzzy.refresh_index(index)
+
+        self.assertEqual(index.search('Nedjma'), [])
+        self.assertEqual(index.search('Grande Maisson'), [self.book.id])
+        self.assertEqual(index.search('Mimounni'), [added.id])
+        stock.adjust_stock({added.id: -added.stock}, reason='checkout')
+        fuzzy.refresh_index(index)
+        self.assertEqual(index.search('Mimounni'), [])
+
+    def test_index_work_is_handed_to_the_background(self):
+        fuzzy._in_background.side_effect = None
+        self.assertIsNone(fuzzy.get_index())
+        fuzzy._in_background.assert_called_once_with(fuzzy.build)
+
+        fuzzy.build()
+        index = fuzzy._index
+        index.refreshed_at -= settings.SEARCH_FUZZY_REFRESH_INTERVAL
+        with self.assertNumQueries(0):
+            self.assertIs(fuzzy.get_index(), index)
+        fuzzy._in_background.assert_called_with(fuzzy._refresh, index)
+
+    @override_settings(SEARCH_LOG_ENABLED=True)
+    def test_searches_are_not_logged_while_the_index_builds(self):
+        fuzzy._in_background.side_effect = None
+        with mock.patch.object(search_log, 'record') as record:
+            response = self.client.get(reverse('search'), {'q': 'Nedjam'})
+            self.assertEqual(response.json()['results'], [])
+            record.assert_not_called()
+
+            fuzzy.build()
+            response = self.client.get(reverse('search'), {'q': 'Nedjam'})
+            self.assertEqual((response.json()['fuzzy'], len(response.json()['results'])), (True, 1))
+            record.assert_called_once()
+
+
+@override_settings(CATALOG_SNAPSHOT_ENABLED=True, CATALOG_SNAPSHOT_MAX_AGE=3600)
+class CatalogSnapshotTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = [
+            create_book(name='Nedjma', author='Kateb Yacine'),
+            create_book(name='La Grande Maison', author='Mohammed Dib'),
+            create_book(name='Sold Out', stock=0),
+        ]
+        patcher = mock.patch.object(catalog, '_snapshot', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def list_books(self, **params):
+        return self.client.get(reverse('book-list'), params).json()
+
+    def test_book_list_matches_the_database(self):
+        for params in [{}, {'author': 'DIB'}, {'category': 'روايات'}]:
+            with self.subTest(params=params):
+                with self.settings(CATALOG_SNAPSHOT_ENABLED=False):
+                    expected = self.list_books(**params)
+                self.assertEqual(self.list_books(**params), expected)
+
+    def test_reads_are_served_from_memory(self):
+        self.list_books()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.list_books()['count'], 2)
+
+    def test_refresh_applies_stock_renames_and_deletes(self):
+        snapshot = catalog.get_snapshot()
+        stock.adjust_stock({self.books[0].id: -10}, reason='checkout')
+        Author.objects.filter(pk=self.books[1].author_id).update(name='M. Dib', updated_at=timezone.now())
+        added = create_book(name='Le Fleuve detourne')
+        Book.objects.filter(pk=self.books[2].pk).delete()
+        self.assertEqual(len(snapshot.in_stock()), 2)
+        snapshot.refresh()
+
+        self.assertEqual([record.id for record in snapshot.in_stock()], [added.id, self.books[1].id])
+        self.assertEqual(snapshot.books[self.books[1].id].author.name, 'M. Dib')
+        self.assertNotIn(self.books[2].id, snapshot.books)
+        self.assertEqual([record.id for record in snapshot.search('m. d', 10)], [self.books[1].id])
+        self.assertEqual(catalog.in_stock_books([self.books[0].id, added.id]), {added.id: snapshot.books[added.id]})
+
+
+class MediaTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        patcher = override_settings(MEDIA_ROOT=media_root)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+        # Uploaded like the admin and serializers do: assigned, then saved
+        self.book = create_book()
+        self.book.cover_image = ContentFile(b'\xff\xd8 cover bytes', name='Cover.JPG')
+        self.book.save()
+        self.path = self.book.cover_image.name
+        with open(f'{media_root}/old-cover.png', 'wb') as file:
+            file.write(b'old cover')
+
+    def get(self, path, mode):
+        with self.settings(MEDIA_SERVE_MODE=mode):
+            return self.client.get(f'/media/{path}')
+
+    def test_covers_are_stored_under_their_content_hash(self):
+        self.assertTrue(media.is_hashed_name(self.path))
+        self.assertRegex(self.path, r'^book_covers/([0-9a-f]{2})/\1[0-9a-f]{14}\.jpg$')
+        self.assertEqual(media.hashed_name('book_covers', ContentFile(b'\xff\xd8 cover bytes'), 'x.jpg'), self.path)
+        self.assertFalse(media.is_hashed_name('old-cover.png'))
+
+    def test_front_server_delivers_the_bytes(self):
+        response = self.get(self.path, 'x-accel-redirect')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.path}')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        response = self.get(self.path, 'x-sendfile')
+        self.assertEqual(response['X-Sendfile'], self.book.cover_image.path)
+
+    def test_hashed_names_are_cached_forever(self):
+        for mode in ('django', 'x-accel-redirect'):
+            with self.subTest(mode=mode):
+                response = self.get(self.path, mode)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('immutable', response['Cache-Control'])
+                self.assertIn('max-age=31536000', response['Cache-Control'])
+                self.assertIn('Expires', response)
+
+                response = self.get('old-cover.png', mode)
+                self.assertNotIn('immutable', response['Cache-Control'])
+                self.assertIn('max-age=3600', response['Cache-Control'])
+
+    def test_missing_and_outside_paths_are_not_found(self):
+        self.assertEqual(self.get('missing.png', 'django').status_code, 404)
+        self.assertEqual(self.get('../settings.py', 'x-accel-redirect').status_code, 404)
+
+
+class CompressionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = bearer_client(self.user)
+        for _ in range(3):
+            create_order(self.user, [create_book()])
+
+    def test_large_json_is_gzipped_for_clients_that_accept_it(self):
+        plain = self.client.get(reverse('order-list'))
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        self.assertGreaterEqual(len(plain.content), settings.API_COMPRESSION_MIN_SIZE)
+
+        with mock.patch.object(compression, 'brotli', None):
+            response = self.client.get(reverse('order-list'), HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    def test_compressed_etags_are_weak_and_still_match(self):
+        response = self.client.get(reverse('order-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        response = self.client.get(reverse('order-list'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_and_non_json_responses_are_left_alone(self):
+        for url in [reverse('order-status-list'), reverse('stock-stream')]:
+            with self.subTest(url=url):
+                self.assertFalse(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+
+    def test_collectstatic_writes_precompressed_variants(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with self.settings(STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+        css = os.path.join(static_root, 'admin', 'css')
+        hashed = [name for name in os.listdir(css) if name.startswith('base.') and name.endswith('.css') and name != 'base.css']
+        self.assertEqual(len(hashed), 1)
+        with open(os.path.join(css, hashed[0]), 'rb') as original, gzip.open(os.path.join(css, hashed[0] + '.gz')) as variant:
+            self.assertEqual(variant.read(), original.read())
+        self.assertFalse(os.path.exists(os.path.join(css, 'base.css.gz')))
+
+
+class StartupTests(APITestCase):
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   _io\n'
+            'import time:      2400 |       2520 | django.db\n'
+            'some warning\n'
+        )
+        self.assertEqual(parse_importtime(output), [('_io', 120, 120, 1), ('django.db', 2400, 2520, 0)])
+
+    def test_api_profile_with_preload(self):
+        # A fresh process, since settings and the URLconf are loaded once;
+        # fuzzy search is off because the index is tested by FuzzySearchTests
+        script = (
+            'import gc, json, sys\n'
+            'from django.conf import settings\n'
+            'settings.SEARCH_FUZZY_ENABLED = False\n'
+            'import zajel_backend.wsgi\n'
+            'from django.apps import apps\n'
+            'from django.urls import Resolver404, resolve\n'
+            'try:\n'
+            '    resolve("/admin/")\n'
+            '    admin_routed = True\n'
+            'except Resolver404:\n'
+            '    admin_routed = False\n'
+            'print(json.dumps({\n'
+            '    "admin": apps.is_installed("django.contrib.admin"), "admin_routed": admin_routed,\n'
+            '    "views": "api.views" in sys.modules, "frozen": gc.get_freeze_count() > 0,\n'
+            '}))\n'
+        )
+        env = dict(
+            os.environ, DJANGO_SETTINGS_MODULE='zajel_backend.settings',
+            ZAJEL_DEPLOYMENT_PROFILE='api', ZAJEL_WSGI_PRELOAD='1',
+        )
+        child = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=env, cwd=settings.BASE_DIR)
+        self.assertEqual(child.returncode, 0, child.stderr)
+        self.assertEqual(
+            json.loads(child.stdout.strip().splitlines()[-1]),
+            {'admin': False, 'admin_routed': False, 'views': True, 'frozen': True},
+        )
+
+
+class LoadDataTests(APITestCase):
+    def generate(self, seed=7):
+        call_command(
+            'generate_load_data', '--authors=3', '--books=12', '--users=6', '--orders=40', f'--seed={seed}',
+            '--chunk-size=5', '--workers=1', '--until=2026-01-01', stdout=StringIO(),
+        )
+
+    def snapshot(self):
+        return sorted(
+            (str(order.id), order.user.email if order.user else None, order.wilaya, order.status,
+             order.total_price, order.created_at,
+             sorted((item.book.name, item.book_name, item.quantity, item.unit_price) for item in order.items.all()))
+            for order in Order.objects.select_related('user').prefetch_related('items__book')
+        )
+
+    def regenerate(self, seed):
+        Order.objects.all().delete()
+        User.objects.filter(email__endswith=f'@{load_data.EMAIL_DOMAIN}').delete()
+        Book.objects.all().delete()
+        Author.objects.all().delete()
+        self.generate(seed)
+        return self.snapshot()
+
+    def test_same_seed_gives_the_same_data(self):
+        self.generate()
+        first = self.snapshot()
+        self.assertEqual(self.regenerate(seed=7), first)
+        self.assertNotEqual(self.regenerate(seed=8), first)
+
+    def test_orders_are_consistent(self):
+        self.generate()
+        until = timezone.make_aware(datetime(2026, 1, 1))
+        orders = list(Order.objects.prefetch_related('items__book__author'))
+        self.assertEqual(len(orders), 40)
+        self.assertTrue(any(order.user_id is None for order in orders))
+        self.assertTrue(any(order.user_id is not None for order in orders))
+        for order in orders:
+            self.assertTrue(until - timedelta(days=365) <= order.created_at <= until)
+            self.assertEqual(order.updated_at, order.created_at)
+            self.assertIn(order.wilaya, load_data.WILAYA_NAMES)
+            self.assertTrue(order.items.all())
+            self.assertEqual(order.total_price, sum(item.subtotal for item in order.items.all()))
+            for item in order.items.all():
+                self.assertEqual(item.subtotal, item.unit_price * item.quantity)
+                self.assertEqual((item.book_name, item.author_name), (item.book.name, item.book.author.name))
+        self.assertEqual(User.objects.filter(email__endswith=f'@{load_data.EMAIL_DOMAIN}').count(), 6)
+
+    def test_orders_need_books(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_load_data', '--authors=0', '--books=0', '--users=0', '--orders=5', stdout=StringIO())
+
+
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.book = create_book()
+
+    def order(self, status, days_ago):
+        order = create_order(self.user, [self.book])
+        created_at = timezone.now() - timedelta(days=days_ago)
+        Order.objects.filter(id=order.id).update(status=status, created_at=created_at, updated_at=created_at)
+        return order
+
+    def test_moves_old_finished_orders_in_batches(self):
+        completed, canceled = self.order('completed', 100), self.order('canceled', 90)
+        pending, recent = self.order('pending', 100), self.order('completed', 1)
+
+        self.assertEqual(archive.archive_orders(days=30, batch_size=1), 2)
+        self.assertEqual(set(ArchivedOrder.objects.values_list('id', flat=True)), {completed.id, canceled.id})
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {pending.id, recent.id})
+        item = ArchivedOrderItem.objects.get(order_id=completed.id)
+        self.assertEqual((item.book_id, item.quantity, item.unit_price), (self.book.id, 1, self.book.price))
+        self.assertFalse(OrderItem.objects.filter(order_id__in=[completed.id, canceled.id]).exists())
+
+    def test_limit_and_job_watermarks(self):
+        self.order('completed', 100)
+        newer = self.order('completed', 60)
+        Watermark.objects.create(name=analytics.WATERMARK_NAME, value=timezone.now() - timedelta(days=80))
+
+        self.assertEqual(archive.archive_orders(days=30, limit=5), 1)
+        self.assertTrue(Order.objects.filter(id=newer.id).exists())
+        Watermark.objects.all().delete()
+        self.assertEqual(archive.archive_orders(days=30, limit=0), 0)
+        self.assertEqual(archive.archive_orders(days=30, limit=1), 1)
+
+    def test_history_reads_hot_and_archived_orders(self):
+        old, recent = self.order('completed', 100), self.order('pending', 1)
+        archive.archive_orders(days=30)
+
+        self.assertEqual([order.id for order in archive.order_history(self.user)], [recent.id, old.id])
+        client = bearer_client(self.user)
+        response = client.get(reverse('order-list'))
+        self.assertEqual([order['id'] for order in response.data], [str(recent.id), str(old.id)])
+        response = client.get(reverse('order-detail', args=[old.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'][0]['quantity'], 1)
+        other = bearer_client(create_user('other@example.com'))
+        self.assertEqual(other.get(reverse('order-detail', args=[old.id])).status_code, 404)
+
+
+class JobQueueTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        jobs.get_task('')  # register the real tasks before patching
+        tasks = {
+            'record': (lambda **payload: self.calls.append(payload), None),
+            'explode': (lambda **payload: 1 / 0, 2),
+        }
+        patcher = mock.patch.dict(jobs.TASKS, tasks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claim_takes_due_jobs_once(self):
+        first, second = jobs.enqueue('record', {'n': 1}), jobs.enqueue('record', {'n': 2})
+        jobs.enqueue('record', {'n': 3}, delay=60)
+
+        claimed = jobs.claim('worker-a', limit=10)
+        self.assertEqual([job.pk for job in claimed], [first.pk, second.pk])
+        self.assertEqual({(job.status, job.attempts) for job in claimed}, {('running', 1)})
+        self.assertEqual(jobs.claim('worker-b', limit=10), [])
+
+        for job in claimed:
+            self.assertEqual(jobs.run_job(job)[0], 'succeeded')
+        self.assertEqual(self.calls, [{'n': 1}, {'n': 2}])
+        self.assertEqual(Job.objects.filter(status='succeeded').count(), 2)
+
+    def test_failing_job_is_retried_with_backoff_then_failed(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('missing')
+        job = jobs.enqueue('explode')
+        self.assertEqual(job.max_attempts, 2)
+
+        with self.assertLogs('api.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_job(jobs.claim('worker')[0])[0], 'retrying')
+        job.refresh_from_db()
+        delay = (job.run_after - timezone.now()).total_seconds()
+        self.assertEqual(job.status, 'queued')
+        self.assertTrue(settings.JOB_QUEUE_RETRY_DELAY / 2 - 1 <= delay <= settings.JOB_QUEUE_RETRY_DELAY)
+        self.assertIn('ZeroDivisionError', job.last_error)
+        self.assertEqual(jobs.claim('worker'), [])
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('api.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_job(jobs.claim('worker')[0])[0], 'failed')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        with self.settings(JOB_QUEUE_RETRY_DELAY=10, JOB_QUEUE_RETRY_DELAY_MAX=60):
+            self.assertTrue(5 <= jobs.retry_delay(1) <= 10)
+            self.assertTrue(20 <= jobs.retry_delay(3) <= 40)
+            self.assertTrue(30 <= jobs.retry_delay(10) <= 60)
+
+    def test_stale_jobs_are_requeued_and_the_old_claim_cannot_finish_them(self):
+        job = jobs.enqueue('record', {'n': 1})
+        stale = jobs.claim('dead-worker')[0]
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(seconds=settings.JOB_QUEUE_LOCK_TIMEOUT + 1)
+        )
+        self.assertEqual(jobs.requeue_stale(), 1)
+
+        jobs.run_job(stale)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), ('queued', 'Worker stopped while running the job'))
+        self.assertEqual(jobs.run_job(jobs.claim('worker')[0])[0], 'succeeded')
+
+
+class SweepExpiredTests(APITestCase):
+    def sweep(self, *args):
+        out = StringIO()
+        call_command('sweep_expired', *args, stdout=out)
+        return out.getvalue()
+
+    def test_deletes_only_expired_rows_in_batches(self):
+        now = timezone.now()
+        for index in range(5):
+            IdempotencyKey.objects.create(scope='checkout', key=f'old-{index}', expires_at=now - timedelta(minutes=1))
+        fresh = IdempotencyKey.objects.create(scope='checkout', key='fresh', expires_at=now + timedelta(hours=1))
+        old = now - timedelta(days=settings.JOB_QUEUE_RETENTION_DAYS + 1)
+        for status in ['succeeded', 'failed', 'queued']:
+            Job.objects.create(task='record', status=status, run_after=old, finished_at=old if status != 'queued' else None)
+        recent = Job.objects.create(task='record', status='succeeded', run_after=now, finished_at=now)
+
+        output = self.sweep('idempotency-keys', 'finished-jobs', '--batch-size=2')
+        self.assertIn('idempotency-keys: deleted 5 rows', output)
+        self.assertIn('finished-jobs: deleted 2 rows', output)
+        self.assertEqual(list(IdempotencyKey.objects.all()), [fresh])
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {'queued', 'succeeded'})
+        self.assertTrue(Job.objects.filter(pk=recent.pk).exists())
+
+    def test_search_logs_wait_for_aggregation(self):
+        created_at = timezone.now() - timedelta(days=settings.SEARCH_LOG_RETENTION_DAYS + 2)
+        for days in [0, 1]:
+            SearchQueryLog.objects.create(
+                query='q', normalized='q', result_count=0, latency_ms=1, created_at=created_at + timedelta(days=days)
+            )
+        self.assertIn('search-logs: deleted 0 rows', self.sweep('search-logs'))
+
+        Watermark.objects.create(name=search_log.WATERMARK_NAME, value=created_at + timedelta(hours=12))
+        self.assertIn('search-logs: deleted 1 rows', self.sweep('search-logs'))
+        self.assertEqual(SearchQueryLog.objects.count(), 1)
+
+    def test_unknown_target(self):
+        with self.assertRaises(CommandError):
+            self.sweep('nothing')
+
+
+class TokenTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+
+    def refresh(self, refresh_token):
+        return APIClient().post(reverse('token-refresh'), {'refresh_token': refresh_token}, format='json')
+
+    def test_refresh_rotates_the_pair(self):
+        issued = tokens.issue_tokens(self.user)
+        response = self.refresh(issued['refresh_token'])
+        self.assertEqual(response.status_code, 200)
+
+        rotated = response.json()
+        self.assertNotEqual(rotated['refresh_token'], issued['refresh_token'])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {rotated['token']}")
+        self.assertEqual(client.get(reverse('user-profile')).status_code, 200)
+        self.assertEqual(self.refresh(rotated['refresh_token']).status_code, 200)
+
+    def test_reused_refresh_token_revokes_the_family(self):
+        issued = tokens.issue_tokens(self.user)
+        rotated = self.refresh(issued['refresh_token']).json()
+
+        response = self.refresh(issued['refresh_token'])
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(RefreshToken.objects.filter(user=self.user).exists())
+        self.assertEqual(self.refresh(rotated['refresh_token']).status_code, 401)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {rotated['token']}")
+        self.assertEqual(client.get(reverse('user-profile')).status_code, 401)
+
+    def test_expired_refresh_token_is_refused(self):
+        issued = tokens.issue_tokens(self.user)
+        RefreshToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.refresh(issued['refresh_token']).status_code, 401)
+
+    def test_tampered_and_expired_access_tokens_are_refused(self):
+        token = tokens.sign_access_token(self.user.pk)
+        payload, signature = token.rsplit('.', 1)
+        with self.settings(ACCESS_TOKEN_TTL=-1):
+            expired = tokens.sign_access_token(self.user.pk)
+        for bad in [f'{payload}.{signature[::-1]}', expired]:
+            with self.subTest(token=bad):
+                client = APIClient()
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {bad}')
+                self.assertEqual(client.get(reverse('user-profile')).status_code, 401)
+
+    def test_database_tokens_work_until_they_expire(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(client.get(reverse('user-profile')).status_code, 200)
+        Token.objects.update(created=timezone.now() - timedelta(seconds=settings.AUTH_TOKEN_TTL + 1))
+        self.assertEqual(client.get(reverse('user-profile')).status_code, 401)
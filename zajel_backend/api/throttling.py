@@ -0,0 +1,128 @@
+"""
+Token bucket rate limiting for expensive public endpoints.
+
+Views opt in with ``throttle_classes = [TokenBucketThrottle]`` and a
+``throttle_scope``. Rates come from ``DEFAULT_THROTTLE_RATES`` in the usual
+DRF ``"<requests>/<period>"`` form: the bucket holds that many tokens and
+refills evenly over the period, so short bursts pass while sustained
+traffic is held to the rate. Buckets are kept per scope and per user (or
+client IP for anonymous requests).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``"60/min"`` -> ``(60, 1.0)``: bucket capacity and tokens refilled per second"""
+    count, period = rate.split('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBucketStore:
+    """
+    Token buckets kept in the memory of the current process, at most
+    ``max_entries`` of them: the least recently used bucket is dropped to
+    make room, which only ever grants its client a fresh bucket.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate, now):
+        """Take one token. Returns 0 when allowed, else seconds until a token is available"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_entries:
+                    self._buckets.popitem(last=False)
+                self._buckets[key] = (capacity - 1, now)
+                return 0.0
+
+            self._buckets.move_to_end(key)
+            tokens, updated = bucket
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / refill_rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Token buckets kept in the Django cache, shared between processes.
+
+    Reads and writes are not atomic, so concurrent requests from the same
+    client may occasionally get one extra token.
+    """
+
+    def take(self, key, capacity, refill_rate, now):
+        cache_key = f'throttle:{key}'
+        tokens, updated = cache.get(cache_key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / refill_rate
+        if not wait:
+            tokens -= 1
+        cache.set(cache_key, (tokens, now), timeout=int(capacity / refill_rate) + 1)
+        return wait
+
+
+def _clock():
+    # The cache store is shared between processes, so it needs wall time
+    return time.time() if settings.THROTTLE_BUCKET_STORE == 'cache' else time.monotonic()
+
+
+_store = None
+_rates = {}
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = CacheBucketStore() if settings.THROTTLE_BUCKET_STORE == 'cache' else LocalBucketStore()
+    return _store
+
+
+def get_rate(scope):
+    """Parsed rate for a scope, or ``None`` when the scope is not limited"""
+    if scope not in _rates:
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        _rates[scope] = parse_rate(rate) if rate else None
+    return _rates[scope]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token bucket per client and ``throttle_scope``"""
+
+    def allow_request(self, request, view):
+        self.wait_time = 0.0
+        rate = get_rate(getattr(view, 'throttle_scope', None))
+        if rate is None:
+            return True
+
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+
+        capacity, refill_rate = rate
+        self.wait_time = get_store().take(f'{view.throttle_scope}:{ident}', capacity, refill_rate, _clock())
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
@@ -0,0 +1,181 @@
+"""
+Signed access tokens and rotating refresh tokens.
+
+An access token is ``<user id>.<issued ms>.<expires ms>.<signature>``,
+the signature being an HMAC-SHA256 of the rest under ``SECRET_KEY``
+(``salted_hmac``). It is verified without touching the database, so
+authenticated requests cost no query for authentication, and it lives
+for ``ACCESS_TOKEN_TTL`` seconds.
+
+Clients then exchange their refresh token (random, valid for
+``REFRESH_TOKEN_TTL``, stored only as a hash in ``RefreshToken``) for a new
+pair. Every exchange rotates it; presenting an already rotated refresh
+token means it leaked, and revokes all tokens of the user.
+
+Revocation (logout, password change, account deletion) records a
+``TokenRevocation``: access tokens of the user issued before it are
+refused. Each process keeps the revocations of the last
+``ACCESS_TOKEN_TTL`` (older ones cover only expired tokens) in a small
+dict, refreshed by the next request once it is older than
+``TOKEN_DENYLIST_MAX_AGE``, so a revocation reaches other processes within
+that time and applies at once in the process that made it.
+"""
+import base64
+import hashlib
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import RefreshToken, TokenRevocation
+
+KEY_SALT = 'api.tokens.access'
+
+
+class InvalidRefreshToken(Exception):
+    """Raised when a refresh token is unknown, expired, already used or its user inactive"""
+
+
+def _signature(payload, secret=None):
+    digest = salted_hmac(KEY_SALT, payload, secret=secret, algorithm='sha256').digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def sign_access_token(user_id):
+    issued = _now_ms()
+    payload = f'{user_id}.{issued}.{issued + settings.ACCESS_TOKEN_TTL * 1000}'
+    return f'{payload}.{_signature(payload)}'
+
+
+def verify_access_token(token):
+    """The user id of a valid, unexpired and unrevoked access token, else ``None``"""
+    parts = token.split('.')
+    if len(parts) != 4 or not all(part.isdigit() for part in parts[:3]):
+        return None
+    payload, signature = token.rpartition('.')[::2]
+    # Tokens signed before a SECRET_KEY rotation stay valid until they expire
+    if not any(
+        constant_time_compare(signature, _signature(payload, secret))
+        for secret in [settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS]
+    ):
+        return None
+    user_id, issued, expires = (int(part) for part in parts[:3])
+    if expires <= _now_ms():
+        return None
+    revoked_before = denylist.revoked_before(user_id)
+    if revoked_before is not None and issued < revoked_before:
+        return None
+    return user_id
+
+
+def _hash(refresh_token):
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def issue_tokens(user):
+    """A new access token and refresh token for ``user``, as returned by login and refresh"""
+    refresh_token = secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        user=user,
+        token_hash=_hash(refresh_token),
+        expires_at=timezone.now() + timedelta(seconds=settings.REFRESH_TOKEN_TTL),
+    )
+    return {
+        'token': sign_access_token(user.pk),
+        'refresh_token': refresh_token,
+        'expires_in': settings.ACCESS_TOKEN_TTL,
+    }
+
+
+def rotate(refresh_token):
+    """Exchange ``refresh_token`` for a new pair; raises ``InvalidRefreshToken``"""
+    now = timezone.now()
+    with transaction.atomic():
+        stored = (
+            RefreshToken.objects.select_for_update().select_related('user')
+            .filter(token_hash=_hash(refresh_token)).first()
+        )
+        if stored is None or stored.expires_at <= now or not stored.user.is_active:
+            raise InvalidRefreshToken('Invalid or expired refresh token')
+        # The conditional update settles two concurrent exchanges where
+        # SELECT ... FOR UPDATE is not available (SQLite)
+        first_use = not stored.rotated_at and RefreshToken.objects.filter(
+            pk=stored.pk, rotated_at__isnull=True
+        ).update(rotated_at=now)
+        if first_use:
+            return issue_tokens(stored.user)
+    # Outside the transaction, which the exception below would roll back
+    revoke(stored.user_id)
+    raise InvalidRefreshToken('Refresh token was already used; please log in again')
+
+
+def revoke_access_tokens(user_id):
+    """Refuse the access tokens issued to the user so far"""
+    revoked_before = _now_ms()
+    TokenRevocation.objects.create(
+        user_id=user_id, revoked_before=datetime.fromtimestamp(revoked_before / 1000, dt_timezone.utc)
+    )
+    denylist.add(user_id, revoked_before)
+
+
+def revoke(user_id):
+    """Refuse the user's current access tokens and delete their refresh tokens"""
+    revoke_access_tokens(user_id)
+    RefreshToken.objects.filter(user_id=user_id).delete()
+
+
+def revoke_refresh_token(refresh_token):
+    RefreshToken.objects.filter(token_hash=_hash(refresh_token)).delete()
+
+
+class Denylist:
+    """Per-process ``{user id: revoked before (ms)}`` for the revocations of the last ``ACCESS_TOKEN_TTL``"""
+
+    def __init__(self):
+        self._revoked = {}
+        self._watermark = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def revoked_before(self, user_id):
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= settings.TOKEN_DENYLIST_MAX_AGE:
+            # One request refreshes; the others carry on with the current entries
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.refresh()
+                finally:
+                    self._lock.release()
+        return self._revoked.get(user_id)
+
+    def add(self, user_id, revoked_before):
+        self._revoked[user_id] = max(self._revoked.get(user_id, 0), revoked_before)
+
+    def refresh(self):
+        """Load revocations recorded since the last refresh (re-reading a short overlap for late commits)"""
+        started = time.monotonic()
+        now = timezone.now()
+        horizon = now - timedelta(seconds=settings.ACCESS_TOKEN_TTL)
+        since = horizon
+        if self._watermark is not None:
+            since = max(horizon, self._watermark - timedelta(seconds=settings.TOKEN_DENYLIST_OVERLAP))
+        rows = TokenRevocation.objects.filter(created_at__gte=since).values_list('user_id', 'revoked_before', 'created_at')
+        for user_id, revoked_before, created_at in rows:
+            self.add(user_id, int(revoked_before.timestamp() * 1000))
+            self._watermark = max(filter(None, [self._watermark, created_at]))
+
+        # Entries older than any unexpired token are dropped to keep the dict small
+        horizon_ms = int(horizon.timestamp() * 1000)
+        self._revoked = {user_id: at for user_id, at in self._revoked.items() if at >= horizon_ms}
+        self._refreshed_at = started
+
+
+denylist = Denylist()
@@ -13,11 +13,13 @@ urlpatterns = [
     path('auth/register/', views.UserRegistrationView.as_view(), name='user-register'),
     path('auth/login/', views.UserLoginView.as_view(), name='user-login'),
     path('auth/logout/', views.UserLogoutView.as_view(), name='user-logout'),
+    path('auth/refresh/', views.TokenRefreshView.as_view(), name='token-refresh'),
     
     # User profile endpoints
     path('account/profile/', views.UserProfileView.as_view(), name='user-profile'),
     path('account/change-password/', views.ChangePasswordView.as_view(), name='change-password'),
     path('account/delete/', views.DeleteAccountView.as_view(), name='delete-account'),
+    path('account/delete/<uuid:job_id>/', views.AccountDeletionStatusView.as_view(), name='delete-account-status'),
     
     # Book and search endpoints
     path('', include(router.urls)),  # Includes /books/ and /admin/orders/
@@ -25,6 +27,11 @@ urlpatterns = [
     
     # Cart endpoints
     path('cart/', views.CartView.as_view(), name='cart'),
+    path('cart/batch/', views.CartBatchView.as_view(), name='cart-batch'),
+    
+    # Stock feed endpoints
+    path('stock/changes/', views.StockChangeFeedView.as_view(), name='stock-changes'),
+    path('stock/stream/', views.stock_change_stream, name='stock-stream'),
     
     # Checkout endpoint
     path('checkout/', views.CheckoutView.as_view(), name='checkout'),
@@ -38,6 +45,9 @@ urlpatterns = [
     path('categories/', views.CategoriesListView.as_view(), name='categories-list'),
     path('order-statuses/', views.OrderStatusListView.as_view(), name='order-status-list'),
     
+    # Admin dashboard endpoints
+    path('admin/stats/', views.AdminStatsView.as_view(), name='admin-stats'),
+    
     # Legacy endpoint for compatibility
     path('example/', views.get_example_data, name='example'),
 ]
\ No newline at end of file
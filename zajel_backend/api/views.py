@@ -1,38 +1,61 @@
+import asyncio
+import json
+import mimetypes
+import time
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from rest_framework import status, generics, viewsets, permissions
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.authtoken.models import Token
 from django.contrib.auth import login, logout
-from django.db.models import Q
+from django.urls import reverse
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import prefetch_related_objects
+from datetime import date, timedelta
 from decimal import Decimal
 
-from .models import User, Author, Book, Order, OrderItem, WILAYA_CHOICES, ORDER_STATUS_CHOICES
+from .models import User, Author, Book, Order, OrderItem, ArchivedOrder, AccountDeletion, WILAYA_CHOICES, ORDER_STATUS_CHOICES, ROLLUP_DIMENSION_CHOICES
 from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, UserProfileSerializer,
-    ChangePasswordSerializer, AuthorSerializer, BookSerializer, BookListSerializer,
-    OrderSerializer, OrderCreateSerializer, CartItemSerializer, CartSerializer,
-    SearchSerializer, OrderItemSerializer
+    ChangePasswordSerializer, AccountDeletionSerializer, AuthorSerializer, BookSerializer, BookListSerializer,
+    OrderSerializer, ArchivedOrderSerializer, OrderCreateSerializer, CartItemSerializer, CartItemUpdateSerializer, CartSerializer,
+    SearchSerializer, OrderItemSerializer, OrderBulkStatusSerializer, CartBatchSerializer, TokenRefreshSerializer
 )
+from . import accounts, analytics, archive, conditional, jobs, search_log, stock, tokens
+from .orders import transition_orders, OrderTransitionError
+from .idempotency import idempotent
+from .cart import get_cart, merge_session_cart
+from .catalog import get_snapshot, in_stock_books
+from .throttling import TokenBucketThrottle
+from .search import normalize_query, search_books
+from .fuzzy import fuzzy_search
+from .media import is_hashed_name
 
 # Authentication Views
 class UserRegistrationView(APIView):
     """User registration endpoint"""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'auth'
     
     def post(self, request):
         serializer = UserRegistrationSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            token, created = Token.objects.get_or_create(user=user)
             return Response({
                 'message': 'User registered successfully',
-                'token': token.key,
+                **tokens.issue_tokens(user),
                 'user': UserProfileSerializer(user).data
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -40,16 +63,18 @@ class UserRegistrationView(APIView):
 class UserLoginView(APIView):
     """User login endpoint"""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'auth'
     
     def post(self, request):
         serializer = UserLoginSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data['user']
             login(request, user)
-            token, created = Token.objects.get_or_create(user=user)
+            merge_session_cart(request, user)
             return Response({
                 'message': 'Login successful',
-                'token': token.key,
+                **tokens.issue_tokens(user),
                 'user': UserProfileSerializer(user).data
             })
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -59,19 +84,47 @@ class UserLogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
-        logout(request)
-        if hasattr(request.user, 'auth_token'):
-            request.user.auth_token.delete()
+        user_id = request.user.pk
+        if request.auth is None:
+            logout(request)
+        # Access tokens cannot be deleted, only refused from now on; other
+        # devices get new ones with their refresh tokens
+        tokens.revoke_access_tokens(user_id)
+        if request.data.get('refresh_token'):
+            tokens.revoke_refresh_token(request.data['refresh_token'])
+        # Only the logout paths touch database tokens, so workers do not import them at startup
+        from rest_framework.authtoken.models import Token
+        Token.objects.filter(user_id=user_id).delete()
         return Response({'message': 'Logout successful'})
 
+class TokenRefreshView(APIView):
+    """Exchange a refresh token for a new access and refresh token"""
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'auth'
+    
+    def post(self, request):
+        serializer = TokenRefreshSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(tokens.rotate(serializer.validated_data['refresh_token']))
+        except tokens.InvalidRefreshToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
 # User Profile Views
 class UserProfileView(APIView):
     """User profile management"""
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
-        serializer = UserProfileSerializer(request.user)
-        return Response(serializer.data)
+        # Profile fields only change through PUT, which bumps last_profile_update
+        etag = conditional.make_etag('profile', request.user.pk, request.user.last_profile_update)
+        response = conditional.not_modified(request, etag)
+        if response is None:
+            response = Response(UserProfileSerializer(request.user).data)
+        return conditional.set_etag(response, etag)
     
     def put(self, request):
         serializer = UserProfileSerializer(request.user, data=request.data, partial=True)
@@ -93,22 +146,47 @@ class ChangePasswordView(APIView):
             user = request.user
             user.set_password(serializer.validated_data['new_password'])
             user.save()
-            return Response({'message': 'Password changed successfully'})
+            # Tokens issued with the old password stop working everywhere
+            tokens.revoke(user.pk)
+            from rest_framework.authtoken.models import Token
+            Token.objects.filter(user_id=user.pk).delete()
+            return Response({
+                'message': 'Password changed successfully',
+                **tokens.issue_tokens(user),
+            })
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class DeleteAccountView(APIView):
-    """Delete account endpoint"""
+    """Delete account endpoint; the deletion itself runs in the background"""
     permission_classes = [permissions.IsAuthenticated]
     
     def delete(self, request):
-        user = request.user
-        user.delete()
-        return Response({'message': 'Account deleted successfully'})
+        job = accounts.request_deletion(request.user)
+        accounts.start(job)
+        # Only a session needs ending; token users are revoked by
+        # request_deletion and, now inactive, can no longer be loaded
+        if request.auth is None:
+            logout(request)
+        return Response({
+            'message': 'Account deletion started',
+            'job': AccountDeletionSerializer(job).data
+        }, status=status.HTTP_202_ACCEPTED, headers={'Location': reverse('delete-account-status', args=[job.id])})
+
+class AccountDeletionStatusView(APIView):
+    """Progress of an account deletion; the unguessable job id is the credential"""
+    permission_classes = [permissions.AllowAny]
+    
+    def get(self, request, job_id):
+        try:
+            job = AccountDeletion.objects.get(id=job_id)
+        except AccountDeletion.DoesNotExist:
+            return Response({'error': 'Deletion job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(AccountDeletionSerializer(job).data)
 
 # Book Views
 class BookViewSet(viewsets.ReadOnlyModelViewSet):
     """Book viewset for listing and retrieving books"""
-    queryset = Book.objects.filter(available=True)
+    queryset = Book.objects.in_stock()
     permission_classes = [permissions.AllowAny]
     
     def get_serializer_class(self):
@@ -117,7 +195,7 @@ class BookViewSet(viewsets.ReadOnlyModelViewSet):
         return BookListSerializer
     
     def get_queryset(self):
-        queryset = Book.objects.filter(available=True)
+        queryset = Book.objects.in_stock().select_related('author')
         author = self.request.query_params.get('author', None)
         category = self.request.query_params.get('category', None)
         
@@ -127,26 +205,79 @@ class BookViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(category=category)
             
         return queryset
+    
+    def list(self, request, *args, **kwargs):
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return super().list(request, *args, **kwargs)
+        
+        # Same filters as get_queryset, applied to the in-memory catalog
+        books = snapshot.in_stock()
+        author = request.query_params.get('author', None)
+        category = request.query_params.get('category', None)
+        if author:
+            author = author.lower()
+            books = [book for book in books if author in book.author.name_lower]
+        if category:
+            books = [book for book in books if book.category == category]
+        
+        page = self.paginate_queryset(books)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def bestsellers(self, request):
+        """Top-selling books over the last few days, read from the sales rollups"""
+        try:
+            days = max(1, min(int(request.query_params.get('days', 7)), 365))
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            return Response({'error': 'Invalid days or limit'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        end = timezone.now().date()
+        stats = analytics.sales_stats('book', end - timedelta(days=days - 1), end, limit=limit)
+        ranked_ids = [int(row['key']) for row in stats['results']]
+        books = in_stock_books(ranked_ids)
+        
+        serializer = BookListSerializer(
+            [books[book_id] for book_id in ranked_ids if book_id in books],
+            many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
 
 # Search View
 class SearchView(APIView):
     """Live search endpoint"""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'search'
     
     def get(self, request):
         query = request.query_params.get('q', '')
         if not query:
             return Response({'results': []})
         
-        books = Book.objects.filter(
-            Q(name__icontains=query) | Q(author__name__icontains=query),
-            available=True
-        )[:10]  # Limit to 10 results
-        
+        started = time.perf_counter()
+        books = search_books(query)
+        fuzzy = False
+        complete = True
+        if not books and settings.SEARCH_FUZZY_ENABLED:
+            # Nothing contains the query as typed; fall back to similar titles
+            similar = fuzzy_search(query)
+            complete = similar is not None
+            books = similar or []
+            fuzzy = bool(books)
         serializer = BookListSerializer(books, many=True)
+        data = serializer.data
+        if complete:
+            # Not while the fuzzy index is still being built, or the
+            # search would count as a zero-result query
+            search_log.record(query, normalize_query(query).lower(), len(books), (time.perf_counter() - started) * 1000)
+        
         return Response({
             'query': query,
-            'results': serializer.data
+            'fuzzy': fuzzy,
+            'results': data
         })
 
 # Cart Views
@@ -156,58 +287,27 @@ class CartView(APIView):
     
     def get(self, request):
         """Get current cart"""
-        cart = request.session.get('cart', {})
-        items = []
-        total_price = Decimal('0.00')
-        total_items = 0
-        
-        for book_id, quantity in cart.items():
-            try:
-                book = Book.objects.get(id=book_id, available=True)
-                if book.stock >= quantity:
-                    subtotal = book.price * quantity
-                    items.append({
-                        'book_id': book.id,
-                        'quantity': quantity,
-                        'book_name': book.name,
-                        'book_price': book.price,
-                        'book_cover': book.cover_image.url if book.cover_image else None,
-                        'subtotal': subtotal,
-                        'available_stock': book.stock
-                    })
-                    total_price += subtotal
-                    total_items += quantity
-                else:
-                    # Remove item if insufficient stock
-                    del cart[book_id]
-            except Book.DoesNotExist:
-                # Remove item if book doesn't exist
-                del cart[book_id]
-        
-        request.session['cart'] = cart
-        request.session.modified = True
-        
-        return Response({
-            'items': items,
-            'total_items': total_items,
-            'total_price': total_price
-        })
+        return Response(get_cart(request).summary())
     
+    @idempotent
     def post(self, request):
         """Add item to cart"""
-        book_id = request.data.get('book_id')
-        quantity = int(request.data.get('quantity', 1))
+        serializer = CartItemSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        book_id = serializer.validated_data['book_id']
+        quantity = serializer.validated_data['quantity']
         
         try:
-            book = Book.objects.get(id=book_id, available=True)
+            book = Book.objects.in_stock().get(id=book_id)
             if book.stock < quantity:
                 return Response(
                     {'error': f'Only {book.stock} copies available'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            cart = request.session.get('cart', {})
-            current_quantity = cart.get(str(book_id), 0)
+            cart = get_cart(request)
+            current_quantity = cart.quantity(book.id)
             new_quantity = current_quantity + quantity
             
             if new_quantity > book.stock:
@@ -216,67 +316,104 @@ class CartView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            cart[str(book_id)] = new_quantity
-            request.session['cart'] = cart
-            request.session.modified = True
+            cart.add(book.id, quantity)
             
             return Response({'message': 'Item added to cart'})
             
         except Book.DoesNotExist:
             return Response({'error': 'Book not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    @idempotent
     def put(self, request):
         """Update cart item quantity"""
-        book_id = request.data.get('book_id')
-        quantity = int(request.data.get('quantity', 1))
+        serializer = CartItemUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        book_id = serializer.validated_data['book_id']
+        quantity = serializer.validated_data['quantity']
         
         try:
-            book = Book.objects.get(id=book_id, available=True)
+            book = Book.objects.in_stock().get(id=book_id)
             if quantity > book.stock:
                 return Response(
                     {'error': f'Only {book.stock} copies available'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            cart = request.session.get('cart', {})
-            if quantity <= 0:
-                cart.pop(str(book_id), None)
-            else:
-                cart[str(book_id)] = quantity
-            
-            request.session['cart'] = cart
-            request.session.modified = True
+            get_cart(request).set(book.id, quantity)
             
             return Response({'message': 'Cart updated'})
             
         except Book.DoesNotExist:
             return Response({'error': 'Book not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    @idempotent
     def delete(self, request):
         """Remove item from cart or clear cart"""
         book_id = request.data.get('book_id')
-        cart = request.session.get('cart', {})
+        cart = get_cart(request)
         
         if book_id:
             # Remove specific item
-            cart.pop(str(book_id), None)
+            cart.remove(book_id)
         else:
             # Clear entire cart
             cart.clear()
         
-        request.session['cart'] = cart
-        request.session.modified = True
-        
         return Response({'message': 'Item removed from cart'})
 
+class CartBatchView(APIView):
+    """Apply several cart operations in one request"""
+    permission_classes = [permissions.AllowAny]
+    
+    @idempotent
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        cart = get_cart(request)
+        current = cart.quantities()
+        quantities = {}
+        for operation in serializer.validated_data['operations']:
+            book_id = operation['book_id']
+            quantity = quantities.get(book_id, current.get(book_id, 0))
+            if operation['op'] == 'add':
+                quantities[book_id] = quantity + operation['quantity']
+            elif operation['op'] == 'set':
+                quantities[book_id] = operation['quantity']
+            else:
+                quantities[book_id] = 0
+        
+        # Validate every resulting line against stock with a single query
+        books = Book.objects.in_stock().filter(id__in=quantities.keys()).in_bulk()
+        errors = []
+        for book_id, quantity in quantities.items():
+            if quantity <= 0:
+                continue
+            book = books.get(book_id)
+            if book is None:
+                errors.append({'book_id': book_id, 'error': 'Book not found'})
+            elif quantity > book.stock:
+                errors.append({'book_id': book_id, 'error': f'Only {book.stock} copies available'})
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        cart.update(quantities)
+        return Response(cart.summary())
+
 # Checkout View
 class CheckoutView(APIView):
     """Checkout endpoint"""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'checkout'
     
+    @idempotent
     def post(self, request):
-        cart = request.session.get('cart', {})
-        if not cart:
+        cart = get_cart(request)
+        quantities = cart.quantities()
+        if not quantities:
             return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Prepare order data
@@ -297,34 +434,37 @@ class CheckoutView(APIView):
                 return Response({'error': f'{field} is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Prepare items data
-        for book_id, quantity in cart.items():
-            try:
-                book = Book.objects.get(id=book_id, available=True)
-                if book.stock < quantity:
-                    return Response(
-                        {'error': f'Insufficient stock for {book.name}'}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                order_data['items'].append({
-                    'book_id': book.id,
-                    'quantity': quantity,
-                    'unit_price': book.price
-                })
-            except Book.DoesNotExist:
+        books = Book.objects.in_stock().filter(id__in=quantities.keys()).in_bulk()
+        for book_id, quantity in quantities.items():
+            book = books.get(book_id)
+            if book is None:
                 return Response({'error': f'Book with id {book_id} not found'}, status=status.HTTP_404_NOT_FOUND)
+            if book.stock < quantity:
+                return Response(
+                    {'error': f'Insufficient stock for {book.name}'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            order_data['items'].append({
+                'book_id': book.id,
+                'quantity': quantity,
+                'unit_price': book.price
+            })
         
         # Create order
         serializer = OrderCreateSerializer(data=order_data, context={'request': request})
         if serializer.is_valid():
             order = serializer.save()
+            # Load the items for the response; they render from their snapshot
+            prefetch_related_objects([order], 'items')
             
             # Clear cart
-            request.session['cart'] = {}
-            request.session.modified = True
+            cart.clear()
             
-            # Send confirmation email
-            self.send_order_confirmation_email(order)
+            # Emails are sent by the background workers
+            jobs.enqueue('send_order_notification', {'order_id': str(order.id)})
+            if order.user_id:
+                jobs.enqueue('send_order_confirmation', {'order_id': str(order.id)})
             
             return Response({
                 'message': 'Order created successfully',
@@ -333,77 +473,109 @@ class CheckoutView(APIView):
             }, status=status.HTTP_201_CREATED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+# Stock Feed Views
+class StockChangeFeedView(APIView):
+    """Incremental feed of stock changes, read with ?since=<cursor>"""
+    permission_classes = [permissions.AllowAny]
     
-    def send_order_confirmation_email(self, order):
-        """Send order confirmation email"""
-        subject = f'Order Confirmation - {order.id}'
-        message = f"""
-        New order received:
-        
-        Order ID: {order.id}
-        Customer: {order.full_name}
-        Email: {order.email}
-        Phone: {order.phone_number}
-        Address: {order.address}
-        Wilaya: {order.get_wilaya_display()}
-        Postal Code: {order.postal_code}
-        Total: ${order.total_price}
-        
-        Items:
-        """
-        
-        for item in order.items.all():
-            message += f"- {item.book.name} x{item.quantity} = ${item.subtotal}\n"
+    def get(self, request):
+        try:
+            cursor = int(request.query_params.get('since', 0))
+            limit = max(1, min(int(request.query_params.get('limit', 100)), 500))
+        except ValueError:
+            return Response({'error': 'Invalid since or limit'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Send to admin
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [settings.ADMIN_EMAIL],
-            fail_silently=True
+        changes = stock.changes_since(cursor, limit)
+        return Response({
+            'cursor': changes[-1]['id'] if changes else cursor,
+            'changes': changes
+        })
+
+async def stock_change_stream(request):
+    """
+    Server-Sent Events stream of stock changes. Only served over ASGI: a
+    WSGI worker would be held for the whole stream. Each stream ends after
+    ``STOCK_STREAM_MAX_DURATION`` or ``STOCK_STREAM_MAX_EVENTS``, and the
+    client reconnects from its ``Last-Event-ID``.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(
+            'The stock stream needs an ASGI server; poll /api/stock/changes/ instead',
+            status=501
         )
-        
-        # Send to customer if logged in
-        if order.user:
-            customer_message = f"""
-            Thank you for your order!
-            
-            Order ID: {order.id}
-            Total: ${order.total_price}
-            
-            We will process your order and contact you soon.
-            """
-            
-            send_mail(
-                'Order Confirmation - Zajil Books',
-                customer_message,
-                settings.DEFAULT_FROM_EMAIL,
-                [order.email],
-                fail_silently=True
-            )
+    if 'since' in request.GET or 'Last-Event-ID' in request.headers:
+        try:
+            cursor = int(request.GET.get('since') or request.headers.get('Last-Event-ID'))
+        except ValueError:
+            return HttpResponse('Invalid since', status=400)
+    else:
+        cursor = await sync_to_async(stock.latest_cursor)()
+    
+    async def events():
+        nonlocal cursor
+        idle_polls = 0
+        sent = 0
+        deadline = time.monotonic() + settings.STOCK_STREAM_MAX_DURATION
+        while time.monotonic() < deadline and sent < settings.STOCK_STREAM_MAX_EVENTS:
+            limit = min(100, settings.STOCK_STREAM_MAX_EVENTS - sent)
+            changes = await sync_to_async(stock.changes_since)(cursor, limit)
+            for change in changes:
+                cursor = change['id']
+                yield f"id: {cursor}\nevent: stock\ndata: {json.dumps(change, cls=DjangoJSONEncoder)}\n\n"
+            sent += len(changes)
+            if changes:
+                idle_polls = 0
+                continue
+            idle_polls += 1
+            if idle_polls % 15 == 0:
+                yield ': keep-alive\n\n'
+            await asyncio.sleep(settings.STOCK_STREAM_POLL_INTERVAL)
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 # Order Views
+def serialize_order(order):
+    """Render a live or archived order the same way"""
+    if isinstance(order, ArchivedOrder):
+        return ArchivedOrderSerializer(order).data
+    return OrderSerializer(order).data
+
+def order_etag(request, *parts):
+    """Per-user ETag of an order page; the embedded profile is left out so a 304 never loads the user row"""
+    return conditional.make_etag(*parts, request.user.pk)
+
 class OrderListView(APIView):
-    """List user orders"""
+    """List user orders, including archived ones"""
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
-        orders = Order.objects.filter(user=request.user)
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        etag = order_etag(request, 'orders', archive.history_version(request.user))
+        response = conditional.not_modified(request, etag)
+        if response is None:
+            response = Response([serialize_order(order) for order in archive.order_history(request.user)])
+        return conditional.set_etag(response, etag)
 
 class OrderDetailView(APIView):
     """Get order details"""
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, order_id):
+        version = archive.order_version(order_id, request.user)
+        if version is None:
+            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        etag = order_etag(request, 'order', str(order_id), version)
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return response
         try:
-            order = Order.objects.get(id=order_id, user=request.user)
-            serializer = OrderSerializer(order)
-            return Response(serializer.data)
+            order = archive.get_order(order_id, request.user)
         except Order.DoesNotExist:
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        return conditional.set_etag(Response(serialize_order(order)), etag)
 
 # Utility Views
 class WilayaListView(APIView):
@@ -436,7 +608,7 @@ class AdminOrderViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAdminUser]
     
     def get_queryset(self):
-        queryset = Order.objects.all()
+        queryset = Order.objects.with_details()
         status_filter = self.request.query_params.get('status', None)
         wilaya_filter = self.request.query_params.get('wilaya', None)
         
@@ -446,6 +618,55 @@ class AdminOrderViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(wilaya=wilaya_filter)
         
         return queryset
+    
+    def _transition(self, order_ids, new_status):
+        try:
+            updated = transition_orders(order_ids, new_status)
+        except OrderTransitionError as e:
+            return Response({'error': str(e), 'order_ids': e.order_ids}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'message': f'{len(updated)} orders moved to {new_status}',
+            'status': new_status,
+            'updated': len(updated)
+        })
+    
+    @action(detail=False, methods=['post'], url_path='bulk-status')
+    def bulk_status(self, request):
+        """Move many orders to a new status at once"""
+        serializer = OrderBulkStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return self._transition(serializer.validated_data['order_ids'], serializer.validated_data['status'])
+    
+    @action(detail=True, methods=['post'], url_path='status')
+    def set_status(self, request, pk=None):
+        """Move a single order to a new status"""
+        order = self.get_object()
+        return self._transition([order.pk], request.data.get('status'))
+
+class AdminStatsView(APIView):
+    """Sales dashboard served from the daily rollup tables"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        dimension = request.query_params.get('dimension', 'wilaya')
+        if dimension not in dict(ROLLUP_DIMENSION_CHOICES):
+            return Response({'error': f'Unknown dimension {dimension}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params else timezone.now().date()
+            start = date.fromisoformat(request.query_params['start']) if 'start' in request.query_params else end - timedelta(days=6)
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        except ValueError:
+            return Response({'error': 'Invalid start, end or limit'}, status=status.HTTP_400_BAD_REQUEST)
+        if not timedelta(0) <= end - start < timedelta(days=analytics.MAX_DAYS):
+            return Response(
+                {'error': f'The range must run forward and cover at most {analytics.MAX_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        daily = request.query_params.get('daily') in ('1', 'true')
+        return Response(analytics.sales_stats(dimension, start, end, limit=limit, daily=daily))
 
 # Legacy view for compatibility
 @api_view(['GET'])
@@ -456,5 +677,40 @@ def get_example_data(request):
     }
     return Response(data)
 
+# Media
+def serve_media(request, path):
+    """
+    Media files. The response only carries headers when a front web server
+    delivers the bytes (MEDIA_SERVE_MODE 'x-accel-redirect' or 'x-sendfile').
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid media path')
+    
+    mode = settings.MEDIA_SERVE_MODE
+    if mode == 'django':
+        # Development only, so not imported by production workers
+        from django.views.static import serve as static_serve
+        response = static_serve(request, path, document_root=settings.MEDIA_ROOT)
+    else:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        if mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+        else:
+            response['X-Sendfile'] = full_path
+    
+    if response.status_code == 200:
+        # Hashed names never change content; anything else may be replaced
+        if is_hashed_name(path):
+            max_age = settings.MEDIA_CACHE_MAX_AGE
+            patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+        else:
+            max_age = settings.MEDIA_CACHE_MAX_AGE_UNHASHED
+            patch_cache_control(response, public=True, max_age=max_age)
+        response['Expires'] = http_date(time.time() + max_age)
+    return response
+
 def main(request):
     return HttpResponse("hello world")
\ No newline at end of file
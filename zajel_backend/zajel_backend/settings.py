@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.JSONCompressionMiddleware',
+    'api.query_inspector.QueryInspectorMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,6 +76,35 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'zajel_backend.wsgi.application'
 
+# Per-request SQL inspection and N+1 detection (api.query_inspector), for
+# development and CI; removed from the middleware chain when disabled
+QUERY_INSPECTOR_ENABLED = DEBUG
+QUERY_INSPECTOR_THRESHOLD = 5  # the same statement from the same call site this often in one request is flagged
+QUERY_INSPECTOR_STRICT = False  # raise NPlusOneDetected instead of logging a warning; api.tests.APITestCase turns it on
+QUERY_INSPECTOR_REPORT_DIR = None  # directory for one JSON report per endpoint (worst request seen)
+QUERY_INSPECTOR_STACK_DEPTH = 3  # project frames recorded as the call site
+QUERY_INSPECTOR_ALLOW = [
+    'api/stock.py:adjust_stock',  # one guarded UPDATE per book, by design
+]
+
+# Deployment profile: 'full' serves everything; 'api' is for workers that
+# only answer /api/ and media (the front web server routes the admin and
+# password reset pages to 'full' workers), so admin, messages and
+# staticfiles are not loaded. Measure with ``manage.py profile_startup``.
+DEPLOYMENT_PROFILE = os.environ.get('ZAJEL_DEPLOYMENT_PROFILE', 'full')
+if DEPLOYMENT_PROFILE == 'api':
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS
+        if app not in ('django.contrib.admin', 'django.contrib.messages', 'django.contrib.staticfiles')
+    ]
+    MIDDLEWARE = [m for m in MIDDLEWARE if m != 'django.contrib.messages.middleware.MessageMiddleware']
+    TEMPLATES[0]['OPTIONS']['context_processors'].remove('django.contrib.messages.context_processors.messages')
+
+# Import the URLconf, views and serializers when the WSGI module loads
+# instead of on the first request. With ``gunicorn --preload`` this happens
+# once in the master and forked workers share the pages copy-on-write.
+WSGI_PRELOAD = os.environ.get('ZAJEL_WSGI_PRELOAD') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -125,10 +156,31 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic writes content-hashed names plus .gz (and .br with the
+# optional brotli package) variants for the front web server
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'api.storage.CompressedManifestStaticFilesStorage'},
+}
+STATIC_PRECOMPRESS_MIN_SIZE = 256  # bytes; smaller files are not worth a variant
+
+# Compression of API responses by api.middleware.JSONCompressionMiddleware
+API_COMPRESSION_CONTENT_TYPES = ['application/json']
+API_COMPRESSION_MIN_SIZE = 1024  # bytes; smaller bodies go out as they are
+API_COMPRESSION_LEVEL = 6  # gzip level, 1 (fastest) to 9 (smallest)
+API_BROTLI_QUALITY = 5  # Brotli quality when the brotli package is installed, 0 to 11
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How media reaches clients: 'django' streams files (development only),
+# 'x-accel-redirect' hands them to nginx, 'x-sendfile' to Apache/lighttpd
+MEDIA_SERVE_MODE = 'django' if DEBUG else 'x-accel-redirect'
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'  # internal nginx location aliased to MEDIA_ROOT
+MEDIA_CACHE_MAX_AGE = 31536000  # content-hashed files never change
+MEDIA_CACHE_MAX_AGE_UNHASHED = 3600  # files uploaded before content hashing
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -141,16 +193,30 @@ CORS_ALLOW_CREDENTIALS = True
 # Django REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.AccessTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        # Transitional: database tokens are no longer issued and the last
+        # ones expire AUTH_TOKEN_TTL after the release that stopped issuing
+        # them. Remove this entry (with the 'tokens' target of
+        # sweep_expired) in the first release after that.
+        'api.authentication.ExpiringTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Token bucket sizes for views using api.throttling.TokenBucketThrottle
+    'DEFAULT_THROTTLE_RATES': {
+        'search': '60/min',
+        'auth': '10/min',
+        'checkout': '10/min',
+    },
 }
 
+# Where token buckets live: 'local' (per process memory) or 'cache' (Django cache, shared)
+THROTTLE_BUCKET_STORE = 'local'
+
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For development
 EMAIL_HOST = 'localhost'
@@ -164,4 +230,70 @@ ADMIN_EMAIL = 'admin@zajil.com'
 
 # Session Configuration
 SESSION_COOKIE_AGE = 86400 * 7  # 7 days
-SESSION_SAVE_EVERY_REQUEST = True
\ No newline at end of file
+SESSION_SAVE_EVERY_REQUEST = True
+
+# Database API tokens issued before signed access tokens (api.authentication)
+# are valid this long after login; expired sessions and tokens are deleted
+# in batches by sweep_expired
+AUTH_TOKEN_TTL = 86400 * 30  # seconds
+
+# Signed access tokens and rotating refresh tokens (api.tokens)
+ACCESS_TOKEN_TTL = 900  # seconds an access token is valid; also how long a revocation is kept in memory
+REFRESH_TOKEN_TTL = 86400 * 30  # seconds a refresh token is valid
+TOKEN_DENYLIST_MAX_AGE = 10  # seconds before a process reloads revocations made by other processes
+TOKEN_DENYLIST_OVERLAP = 10  # seconds of revocations re-read on each reload, for late commits
+
+# Background jobs (api.jobs): a queue in the database, run by run_workers
+JOB_QUEUE_EAGER = False  # run each job in the enqueuing process right after commit (development without workers)
+JOB_QUEUE_MAX_ATTEMPTS = 5  # runs of a failing job before it is marked failed
+JOB_QUEUE_RETRY_DELAY = 10  # seconds before the first retry, doubled for each further one (with jitter)
+JOB_QUEUE_RETRY_DELAY_MAX = 3600  # longest wait between retries
+JOB_QUEUE_LOCK_TIMEOUT = 3600  # seconds before a job whose worker died is run again
+JOB_QUEUE_POLL_INTERVAL = 1.0  # seconds an idle worker waits before looking for due jobs again
+JOB_QUEUE_RETENTION_DAYS = 7  # finished jobs older than this are removed by sweep_expired
+
+# Account deletion (api.accounts): a background job after the request
+# returns; process_account_deletions reruns interrupted deletions
+ACCOUNT_DELETION_BATCH_SIZE = 1000  # orders anonymized per UPDATE, sessions scanned per query
+ACCOUNT_DELETION_STALE_AFTER = 3600  # seconds before a running job counts as abandoned
+
+# Order archival (api.archive): finished orders older than this move to the
+# archive tables when archive_orders runs
+ORDER_ARCHIVE_AFTER_DAYS = 180
+ORDER_ARCHIVE_BATCH_SIZE = 1000  # orders copied and deleted per transaction
+
+# Stock alerts and change feed
+LOW_STOCK_THRESHOLD = 5
+STOCK_STREAM_POLL_INTERVAL = 1.0  # seconds between polls of the stock change log
+STOCK_STREAM_MAX_DURATION = 300  # seconds before a stream ends; EventSource clients reconnect with Last-Event-ID
+STOCK_STREAM_MAX_EVENTS = 1000  # changes sent before a stream ends, so a backlog is not streamed in one go
+
+# Idempotency-Key support for checkout and cart mutations
+IDEMPOTENCY_KEY_TTL = 86400  # seconds a stored response can be replayed
+
+# Prefix result cache for live search (per process)
+SEARCH_CACHE_ENABLED = True
+SEARCH_CACHE_TTL = 60  # seconds a cached prefix is trusted
+SEARCH_CACHE_MAX_ENTRIES = 512
+SEARCH_CACHE_CANDIDATE_LIMIT = 200  # prefixes matching more books are not cached
+SEARCH_CACHE_WARM_INTERVAL = 60  # seconds between background refreshes of popular prefixes
+SEARCH_CACHE_WARM_PREFIXES = []
+SEARCH_CACHE_WARM_TOP_QUERIES = 50  # most searched queries (from aggregate_search_logs) to warm
+
+# Search telemetry, buffered in memory and written in bulk by a background thread
+SEARCH_LOG_ENABLED = True
+SEARCH_LOG_FLUSH_INTERVAL = 5.0  # seconds between bulk inserts
+SEARCH_LOG_BUFFER_SIZE = 10000  # entries beyond this are dropped until the next flush
+SEARCH_LOG_RETENTION_DAYS = 30  # raw logs older than this are removed by sweep_expired once aggregated
+
+# Typo-tolerant fallback when a search finds nothing (in-memory trigram index per process)
+SEARCH_FUZZY_ENABLED = True
+SEARCH_FUZZY_THRESHOLD = 0.5  # share of query trigrams a book must contain
+SEARCH_FUZZY_MAX_CANDIDATES = 5000
+SEARCH_FUZZY_REFRESH_INTERVAL = 30  # seconds before a search applies catalog changes to the index
+SEARCH_FUZZY_OVERLAP = 10  # seconds of updates re-read on each refresh to catch late commits
+
+# Optional per-process snapshot of the catalog for lists, search and cart hydration
+CATALOG_SNAPSHOT_ENABLED = False
+CATALOG_SNAPSHOT_MAX_AGE = 5  # seconds before a read refreshes the snapshot (bounds staleness)
+CATALOG_SNAPSHOT_OVERLAP = 10  # seconds of updates re-read on each refresh to catch late commits
@@ -14,36 +14,47 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls import path, include
+import re
+
+from django.apps import apps
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
-from django.contrib.auth import views as auth_views
-from api.views import main
+from api.views import main, serve_media
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path('', main, name='main'),
-    
-    # Password reset URLs
-    path('password-reset/', 
-         auth_views.PasswordResetView.as_view(template_name='registration/password_reset_form.html'),
-         name='password_reset'),
-    path('password-reset/done/',
-         auth_views.PasswordResetDoneView.as_view(template_name='registration/password_reset_done.html'),
-         name='password_reset_done'),
-    path('reset/<uidb64>/<token>/',
-         auth_views.PasswordResetConfirmView.as_view(template_name='registration/password_reset_confirm.html'),
-         name='password_reset_confirm'),
-    path('reset/done/',
-         auth_views.PasswordResetCompleteView.as_view(template_name='registration/password_reset_complete.html'),
-         name='password_reset_complete'),
 ]
 
-# Serve media files during development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# The admin site and the password reset pages (which use the admin's
+# templates) are only served by the 'full' deployment profile
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+    from django.contrib.auth import views as auth_views
+
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+    
+        # Password reset URLs
+        path('password-reset/', 
+             auth_views.PasswordResetView.as_view(template_name='registration/password_reset_form.html'),
+             name='password_reset'),
+        path('password-reset/done/',
+             auth_views.PasswordResetDoneView.as_view(template_name='registration/password_reset_done.html'),
+             name='password_reset_done'),
+        path('reset/<uidb64>/<token>/',
+             auth_views.PasswordResetConfirmView.as_view(template_name='registration/password_reset_confirm.html'),
+             name='password_reset_confirm'),
+        path('reset/done/',
+             auth_views.PasswordResetCompleteView.as_view(template_name='registration/password_reset_complete.html'),
+             name='password_reset_complete'),
+    ]
+
+# Media files: streamed by Django in development, handed to the front web
+# server (X-Accel-Redirect / X-Sendfile) in production
+urlpatterns += [
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]
 
 
 
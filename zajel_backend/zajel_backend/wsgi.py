@@ -9,8 +9,43 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zajel_backend.settings')
 
 application = get_wsgi_application()
+
+
+def preload():
+    """
+    Do the work Django otherwise defers to the first request: import the
+    URLconf (and with it every view and serializer) and DRF's settings, and
+    build the fuzzy search index.
+
+    Run in a forking server's master (``gunicorn --preload``), the imported
+    modules are shared copy-on-write by all workers. Database connections
+    opened while loading are closed so no socket is shared across forks,
+    and the loaded objects are moved out of the garbage collector's reach
+    so collections in the workers do not touch (and copy) those pages.
+    """
+    import gc
+
+    from django.db import connections
+    from django.urls import get_resolver
+    from rest_framework.settings import api_settings
+
+    get_resolver().url_patterns
+    for name in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                 'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_PAGINATION_CLASS'):
+        getattr(api_settings, name)
+    if settings.SEARCH_FUZZY_ENABLED:
+        from api import fuzzy
+        fuzzy.build()
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+
+
+if settings.WSGI_PRELOAD:
+    preload()